@@ -102,7 +102,7 @@ public class CachedSongFiles
                 {
                     AddFileToCache(FileKey.Vocals, file, CachedSongFile.FileType.Audio);
                 }
-                else if (fileName.Equals($"{subdirectoryName}.wav", StringComparison.OrdinalIgnoreCase))
+                else if (IsOriginalAudioFile(fileName, subdirectoryName))
                 {
                     AddFileToCache(FileKey.Original, file, CachedSongFile.FileType.Audio);
                 }
@@ -148,6 +148,15 @@ public class CachedSongFiles
         return fileName.EndsWith(".jpg", StringComparison.OrdinalIgnoreCase) || fileName.EndsWith(".png", StringComparison.OrdinalIgnoreCase);
     }
 
+    // The downloaded audio keeps its native container (opus/webm/m4a), or is a WAV when the download is set to WAV
+    private static readonly string[] OriginalAudioExtensions = { ".wav", ".opus", ".webm", ".m4a", ".ogg", ".mp3" };
+
+    private bool IsOriginalAudioFile(string fileName, string subdirectoryName)
+    {
+        return Path.GetFileNameWithoutExtension(fileName).Equals(subdirectoryName, StringComparison.OrdinalIgnoreCase)
+            && Array.Exists(OriginalAudioExtensions, extension => Path.GetExtension(fileName).Equals(extension, StringComparison.OrdinalIgnoreCase));
+    }
+
     // Method to get the count of cached files
     public int Count()
     {
@@ -1,4 +1,6 @@
+using System;
 using System.Collections.Generic;
+using System.IO;
 
 namespace DataClasses
 {
@@ -8,12 +10,29 @@ namespace DataClasses
         public string artist;
         public string title;
         public List<string> thumbnails;
+        // Resized local copies of the best thumbnail by use ("list", "detail", "original"), see thumbnail_cache.py
+        public Dictionary<string, string> local_thumbnails;
         public string url;
 
         public string URL => url;
         public string Artist => artist;
         public string Title => title;
-        public List<string> ThumbnailsURLs => thumbnails ?? new List<string>();
+        public List<string> ThumbnailsURLs => LocalThumbnailsURLs() ?? thumbnails ?? new List<string>();
         public string Lyrics => null;
+
+        /// <summary>
+        /// The list-item and detail sized local thumbnails as file URIs, list-item first, or null unless both are on disk.
+        /// </summary>
+        private List<string> LocalThumbnailsURLs()
+        {
+            if (local_thumbnails == null ||
+                !local_thumbnails.TryGetValue("list", out var listPath) ||
+                !local_thumbnails.TryGetValue("detail", out var detailPath) ||
+                !File.Exists(listPath) || !File.Exists(detailPath))
+            {
+                return null;
+            }
+            return new List<string> { new Uri(listPath).AbsoluteUri, new Uri(detailPath).AbsoluteUri };
+        }
     }
 }
\ No newline at end of file
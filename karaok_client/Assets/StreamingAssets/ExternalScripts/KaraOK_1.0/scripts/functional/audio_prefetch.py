@@ -0,0 +1,121 @@
+import os
+import sys
+import shutil
+import subprocess
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from .logger import log_message
+from .download_cache import cache_enabled, cache_folder, lookup_download, claim_prefetch, hand_over_prefetch, release_prefetch
+from .separation_cache import video_id_from_url
+from scripts.main.config_manager import get_from_config
+
+# Niceness of a prefetch process, so it yields the CPU to conversions and the UI
+PREFETCH_NICENESS = 10
+
+# Prefetches of the resident worker run one at a time on a single background thread
+_prefetch_queue = None
+_prefetch_queue_lock = threading.Lock()
+
+def prefetch_enabled():
+    """
+    Prefetching is opt-in (config key 'prefetch_audio_on_metadata'), it spends bandwidth and disk space on
+    songs that may never be converted.
+    """
+    return bool(get_from_config("prefetch_audio_on_metadata", False)) and cache_enabled()
+
+def lower_priority():
+    if hasattr(os, "nice"):
+        os.nice(PREFETCH_NICENESS)
+
+def prefetch_format(audio_format=None):
+    from .youtube_downloader import NATIVE_AUDIO_FORMAT
+    return audio_format or get_from_config("download_audio_format", NATIVE_AUDIO_FORMAT)
+
+def prefetch_audio(youtube_url, audio_format=None, claimed=False):
+    """
+    Download the audio of the video straight into the download cache, so a conversion that follows finds
+    it there. Does nothing when it is already cached or another prefetch of it is running.
+
+    :param claimed: True when the caller already holds the prefetch claim of the video (see start_audio_prefetch).
+    :return: True if the audio was downloaded.
+    """
+    from .youtube_downloader import WAV_AUDIO_FORMAT, download_options, downloaded_file_path, cache_download
+
+    video_id = video_id_from_url(youtube_url)
+    if not video_id:
+        log_message(f"[Prefetch] No video id in {youtube_url}, nothing to prefetch.")
+        return False
+    audio_format = prefetch_format(audio_format)
+    if lookup_download(video_id, audio_format):
+        log_message(f"[Prefetch] {video_id} ({audio_format}) is already cached.")
+        if claimed:
+            release_prefetch(video_id, audio_format)
+        return False
+    if not claimed and not claim_prefetch(video_id, audio_format):
+        log_message(f"[Prefetch] {video_id} ({audio_format}) is already being prefetched.")
+        return False
+
+    staging_folder = os.path.join(cache_folder(), "prefetch", uuid.uuid4().hex)
+    try:
+        import yt_dlp
+        ydl_opts = download_options(get_from_config("ffmpeg_path"), audio_format,
+                                    os.path.join(staging_folder, '%(id)s.%(ext)s'))
+        ydl_opts['quiet'] = True
+        ydl_opts['noprogress'] = True
+        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            info = ydl.extract_info(youtube_url, download=True)
+            audio_file_path = downloaded_file_path(ydl, info)
+        if audio_format == WAV_AUDIO_FORMAT:
+            audio_file_path = os.path.splitext(audio_file_path)[0] + ".wav"
+
+        cache_download(video_id, audio_format, audio_file_path)
+        log_message(f"[Prefetch] Prefetched {youtube_url} into the download cache.")
+        return True
+    except Exception as e:
+        log_message(f"[Prefetch] Failed to prefetch {youtube_url}: {e}")
+        return False
+    finally:
+        release_prefetch(video_id, audio_format)
+        shutil.rmtree(staging_folder, ignore_errors=True)
+
+def start_audio_prefetch(youtube_url, background="process"):
+    """
+    Queue a low-priority prefetch of the audio of the video when prefetching is enabled.
+
+    :param background: "process" to run 'smule.py --prefetch-audio' in a detached process (command line),
+                       or "thread" to queue it on the background thread of the current process (resident worker).
+    """
+    if not prefetch_enabled():
+        return
+
+    # The claim is taken here, before the prefetch starts, so a conversion requested right after this
+    # returns already waits for the prefetch instead of downloading the song a second time
+    video_id = video_id_from_url(youtube_url)
+    audio_format = prefetch_format()
+    if not video_id or lookup_download(video_id, audio_format) or not claim_prefetch(video_id, audio_format):
+        return
+
+    if background == "thread":
+        global _prefetch_queue
+        with _prefetch_queue_lock:
+            if _prefetch_queue is None:
+                _prefetch_queue = ThreadPoolExecutor(max_workers=1, thread_name_prefix="prefetch")
+        _prefetch_queue.submit(prefetch_audio, youtube_url, audio_format, True)
+        log_message(f"[Prefetch] Queued {youtube_url}")
+        return
+
+    smule_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "main", "smule.py")
+    log_path = os.path.join(cache_folder(), "prefetch", f"{video_id}.log")
+    try:
+        os.makedirs(os.path.dirname(log_path), exist_ok=True)
+        with open(log_path, 'a') as log_file:
+            process = subprocess.Popen([sys.executable, os.path.normpath(smule_path), "--prefetch-audio", youtube_url,
+                                        "--prefetch-claimed", audio_format],
+                                       stdin=subprocess.DEVNULL, stdout=log_file, stderr=subprocess.STDOUT,
+                                       start_new_session=True)
+        hand_over_prefetch(video_id, audio_format, process.pid)
+    except Exception:
+        release_prefetch(video_id, audio_format)
+        raise
+    log_message(f"[Prefetch] Prefetching {youtube_url} in the background (pid {process.pid}), logging to {log_path}")
@@ -1,7 +1,13 @@
 import os
 import subprocess
+import uuid
 from scripts.main.environment import get_venv_path
 from scripts.main.config_manager import get_from_config
+from scripts.main.transcode import OUTPUT_PROFILES, transcode
+from .segmented_audio import clip_samples
+
+# ffmpeg arguments of the M4A outputs, shared by the WAV conversion and the streaming encoder
+M4A_CODEC_ARGS = OUTPUT_PROFILES["m4a"]["codec_args"]
 
 def sanitize_output_folder(output_folder):
     """
@@ -12,7 +18,30 @@ def sanitize_output_folder(output_folder):
         os.makedirs(sanitized_path)
     return sanitized_path
 
-def separate_vocals(audio_file_path, output_folder, model):
+def separate_vocals(audio_file_path, output_folder, model, shifts=1, overlap=0.25):
+    """
+    Separate vocals from the audio file using Demucs with the specified model.
+    By default Demucs runs in-process against a resident model (see demucs_engine); set the
+    config key 'demucs_engine' to 'cli' to always use the demucs executable of the virtual environment.
+    The CLI is also the fallback when the in-process engine is unavailable or fails.
+
+    :param shifts: Number of random shifts averaged by Demucs (more is better and proportionally slower).
+    :param overlap: Overlap between the Demucs split windows.
+    """
+    if get_from_config("demucs_engine", "inprocess") != "cli":
+        try:
+            from scripts.functional.demucs_engine import get_engine
+            get_engine().separate(audio_file_path, output_folder, model, shifts=shifts, overlap=overlap)
+            print(f"Vocals successfully separated for {audio_file_path}")
+            return
+        except ImportError as e:
+            print(f"In-process Demucs is not available ({e}), falling back to the demucs CLI.")
+        except Exception as e:
+            print(f"In-process Demucs separation failed ({e}), falling back to the demucs CLI.")
+
+    separate_vocals_cli(audio_file_path, output_folder, model, shifts, overlap)
+
+def separate_vocals_cli(audio_file_path, output_folder, model, shifts=1, overlap=0.25):
     """
     Separate vocals from the audio file using Demucs with the specified model inside the virtual environment.
     """
@@ -25,7 +54,8 @@ def separate_vocals(audio_file_path, output_folder, model):
     # Use the full path to the Demucs executable with the selected model
     try:
         # Adding the stem specification to extract only vocals
-        subprocess.run([demucs_command, "-n", model, "--two-stems=vocals", audio_file_path, '-o', output_folder], check=True)
+        subprocess.run([demucs_command, "-n", model, "--two-stems=vocals", "--shifts", str(shifts), "--overlap", str(overlap),
+                        "--clip-mode", "clamp", audio_file_path, '-o', output_folder], check=True)
         print(f"Vocals successfully separated for {audio_file_path}")
     except subprocess.CalledProcessError as e:
         print(f"Error during vocal separation: {e}")
@@ -36,6 +66,15 @@ def convert_wav_to_m4a(input_wav_path, output_directory):
     Convert the separated WAV files to M4A format using ffmpeg.
     The output file name will be <parent_folder_name>_<wav_file_name_without_ext>.m4a.
     """
+    return convert_wavs_to_m4a([input_wav_path], output_directory)[0]
+
+def convert_wavs_to_m4a(input_wav_paths, output_directory):
+    """
+    Convert several WAV files (e.g. both stems) to M4A with a single ffmpeg process.
+    Each output file is named <parent_folder_name>_<wav_file_name_without_ext>.m4a, like convert_wav_to_m4a.
+
+    :return: The M4A paths, in the order of input_wav_paths.
+    """
     # Retrieve the ffmpeg path from the configuration
     ffmpeg_path = get_from_config("ffmpeg_path")
     if not ffmpeg_path:
@@ -44,23 +83,147 @@ def convert_wav_to_m4a(input_wav_path, output_directory):
     # Ensure the output directory exists
     os.makedirs(output_directory, exist_ok=True)
 
-    # Extract the parent folder name
-    parent_folder_name = os.path.basename(os.path.dirname(input_wav_path))
+    outputs = []
+    for index, input_wav_path in enumerate(input_wav_paths):
+        # Construct the output file name in the format <parent_folder_name>_<wav_file_name_without_ext>.m4a
+        parent_folder_name = os.path.basename(os.path.dirname(input_wav_path))
+        wav_file_name_without_ext = os.path.splitext(os.path.basename(input_wav_path))[0]
+        m4a_output_filename = f"{parent_folder_name}_{wav_file_name_without_ext}.m4a"
+        outputs.append((index, os.path.join(output_directory, m4a_output_filename), OUTPUT_PROFILES["m4a"]))
 
-    # Extract the WAV file name without extension
-    wav_file_name_without_ext = os.path.splitext(os.path.basename(input_wav_path))[0]
-
-    # Construct the output file name in the format <parent_folder_name>_<wav_file_name_without_ext>.m4a
-    m4a_output_filename = f"{parent_folder_name}_{wav_file_name_without_ext}.m4a"
-    m4a_output_path = os.path.join(output_directory, m4a_output_filename)
-
-    print(f"Converting {input_wav_path} to {m4a_output_path} using ffmpeg...")
+    print(f"Converting {input_wav_paths} to {[path for _, path, _ in outputs]} using ffmpeg...")
 
     try:
-        # Use the configured ffmpeg path to convert wav to m4a, adding -y to overwrite existing files
-        subprocess.run([ffmpeg_path, '-i', input_wav_path, '-c:a', 'aac', '-b:a', '320k', '-y', m4a_output_path], check=True)
-        print(f"Successfully converted to {m4a_output_path}")
-        return m4a_output_path
+        m4a_output_paths = transcode(ffmpeg_path, input_wav_paths, outputs)
+        print(f"Successfully converted to {m4a_output_paths}")
+        return m4a_output_paths
     except subprocess.CalledProcessError as e:
         print(f"Error during conversion: {e}")
-        raise
\ No newline at end of file
+        raise
+
+class FFmpegEncoderSink:
+    """
+    A separation sink that pipes raw float PCM straight into an ffmpeg encoder, so no WAV is ever written.
+    Samples are clipped with clip_samples first, so encoded stems match the WAV stems of every other path.
+    """
+
+    def __init__(self, output_path, samplerate, channels, codec_args=M4A_CODEC_ARGS):
+        ffmpeg_path = get_from_config("ffmpeg_path")
+        if not ffmpeg_path:
+            raise ValueError("FFmpeg path not set. Please run 'smule.py --init' to configure the environment.")
+
+        self.path = output_path
+        self._command = [ffmpeg_path, '-loglevel', 'error', '-f', 'f32le', '-ar', str(samplerate), '-ac', str(channels),
+                         '-i', 'pipe:0'] + codec_args + ['-y', output_path]
+        self._process = subprocess.Popen(self._command, stdin=subprocess.PIPE)
+
+    def write(self, stem_audio):
+        self._process.stdin.write(clip_samples(stem_audio).t().contiguous().numpy().astype('<f4', copy=False).tobytes())
+
+    def close(self):
+        if self._process.stdin.closed:
+            return
+        self._process.stdin.close()
+        return_code = self._process.wait()
+        if return_code != 0:
+            raise subprocess.CalledProcessError(return_code, self._command)
+        print(f"Successfully encoded {self.path}")
+
+def _temp_output_path(output_path):
+    # Keeps the extension, ffmpeg and soundfile pick the output format from it
+    base, extension = os.path.splitext(output_path)
+    return f"{base}.{uuid.uuid4().hex}.tmp{extension}"
+
+def separate_and_encode(audio_file_path, output_directory, model, stems=("no_vocals",), keep_wav=False, shifts=1, overlap=0.25):
+    """
+    Separate the track and encode only the requested stems to M4A in output_directory, piping the separated
+    audio straight into ffmpeg. WAV stems are only written when keep_wav is True.
+    The M4A files are named <output_folder_name>_<stem>.m4a, like convert_wav_to_m4a names them.
+    The outputs are written to temporary files renamed into place once the separation succeeded, so a failed
+    separation never leaves a partial file behind. Like separate_vocals, any failure of the in-process engine
+    falls back to the demucs CLI.
+
+    :param stems: The stems to produce, out of "vocals" and "no_vocals".
+    :return: The paths of the files produced.
+    """
+    os.makedirs(output_directory, exist_ok=True)
+    song_name = os.path.basename(os.path.normpath(output_directory))
+
+    sinks = {}
+    temp_paths = []  # (temporary path, final path)
+    finished = False
+    try:
+        from scripts.functional.demucs_engine import get_engine
+        from scripts.functional.segmented_audio import WavFileSink
+        engine = get_engine()
+        demucs_model = engine.get_model(model)
+
+        for stem in stems:
+            outputs = [(os.path.join(output_directory, f"{song_name}_{stem}.m4a"), FFmpegEncoderSink)]
+            if keep_wav:
+                outputs.append((os.path.join(output_directory, f"{stem}.wav"), WavFileSink))
+            for output_path, sink_class in outputs:
+                temp_paths.append((_temp_output_path(output_path), output_path))
+                sinks.setdefault(stem, []).append(sink_class(temp_paths[-1][0], demucs_model.samplerate,
+                                                             demucs_model.audio_channels))
+
+        print(f"Separating {audio_file_path} straight into: {[path for _, path in temp_paths]}")
+        engine.separate_to_sinks(audio_file_path, model, sinks, shifts=shifts, overlap=overlap)
+        for temp_path, output_path in temp_paths:
+            os.replace(temp_path, output_path)
+        finished = True
+        return [output_path for _, output_path in temp_paths]
+    except ImportError as e:
+        print(f"In-process Demucs is not available ({e}), separating with the demucs CLI and encoding the WAV files.")
+    except Exception as e:
+        print(f"In-process Demucs separation failed ({e}), separating with the demucs CLI and encoding the WAV files.")
+    finally:
+        if not finished:
+            _discard_outputs(sinks, temp_paths)
+
+    return _separate_and_encode_cli(audio_file_path, output_directory, model, stems, keep_wav, shifts, overlap)
+
+def _discard_outputs(sinks, temp_paths):
+    """
+    Close the sinks of a failed separation (separate_to_sinks already closed them when it ran) and remove
+    the temporary files they wrote.
+    """
+    for stem_sinks in sinks.values():
+        for sink in stem_sinks:
+            try:
+                sink.close()
+            except Exception:
+                pass
+    for temp_path, _ in temp_paths:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+def _separate_and_encode_cli(audio_file_path, output_directory, model, stems, keep_wav, shifts=1, overlap=0.25):
+    """
+    Fallback of separate_and_encode for when Demucs cannot run in-process: the CLI writes WAV stems to the
+    folder of the source audio, the requested ones are encoded, and the WAV files are removed unless kept.
+    """
+    import shutil
+
+    work_folder = os.path.dirname(os.path.abspath(audio_file_path))
+    separate_vocals_cli(audio_file_path, work_folder, model, shifts, overlap)
+    track_name = os.path.splitext(os.path.basename(audio_file_path))[0]
+    stems_folder = os.path.join(work_folder, model, track_name)
+    song_name = os.path.basename(os.path.normpath(output_directory))
+
+    output_paths = []
+    wav_paths = [os.path.join(stems_folder, f"{stem}.wav") for stem in stems]
+    m4a_paths = convert_wavs_to_m4a(wav_paths, output_directory)
+    for stem, wav_path, m4a_path in zip(stems, wav_paths, m4a_paths):
+        # convert_wavs_to_m4a names the file after the demucs folder, align it with the song folder name
+        expected_path = os.path.join(output_directory, f"{song_name}_{stem}.m4a")
+        if m4a_path != expected_path:
+            os.replace(m4a_path, expected_path)
+        output_paths.append(expected_path)
+        if keep_wav:
+            kept_wav_path = os.path.join(output_directory, f"{stem}.wav")
+            shutil.move(wav_path, kept_wav_path)
+            output_paths.append(kept_wav_path)
+
+    shutil.rmtree(stems_folder, ignore_errors=True)
+    return output_paths
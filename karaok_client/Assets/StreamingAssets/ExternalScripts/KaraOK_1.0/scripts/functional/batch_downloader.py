@@ -0,0 +1,200 @@
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from .logger import log_message
+from .download_cache import lookup_download, restore_download, wait_for_prefetch
+from .separation_cache import get_video_id
+from .youtube_downloader import (
+    NATIVE_AUDIO_FORMAT, WAV_AUDIO_FORMAT, get_audio_file_name, download_options, downloaded_file_path, cache_download
+)
+from scripts.main.config_manager import get_from_config
+
+# Songs downloaded at the same time (config 'download_workers')
+DEFAULT_DOWNLOAD_WORKERS = 3
+# Fragments of one DASH/HLS download fetched at the same time (config 'download_fragment_workers')
+DEFAULT_FRAGMENT_WORKERS = 4
+# Progress is reported every time a download moves this many percent further
+PROGRESS_STEP_PERCENT = 10
+
+def log_progress(url, progress):
+    """
+    Default progress callback: log the status and percentage of the download of url.
+    """
+    percent = progress.get("percent")
+    percent_text = f" {percent:.0f}%" if percent is not None else ""
+    log_message(f"[Download] {url}: {progress['status']}{percent_text}")
+
+class BatchDownloader:
+    """
+    Downloads the audio of many songs with a bounded number of concurrent downloads.
+    Each worker thread keeps one YoutubeDL session for every song it downloads, so the extractor state and the
+    HTTP connections stay warm between songs. Files are downloaded into a staging folder named after the video id
+    and then moved to the folder each song asked for, which lets the sessions share a single output template.
+    The download cache is checked before any network call, like download_audio_from_youtube does.
+    """
+
+    def __init__(self, staging_folder, max_workers=None, audio_format=None, progress_callback=log_progress,
+                 ydl_options=None, ffmpeg_path=None):
+        """
+        :param staging_folder: Folder the sessions download into before the files are moved to the song folders.
+        :param max_workers: Concurrent downloads, defaults to the config key 'download_workers'.
+        :param audio_format: "native" or "wav", defaults to the config key 'download_audio_format'.
+        :param progress_callback: Called with (url, progress dictionary) as downloads advance, or None.
+        :param ydl_options: Extra yt-dlp options applied on top of the defaults of every session
+                            (e.g. a proxy, or the options of a local stand-in server, see download_harness).
+        :param ffmpeg_path: The ffmpeg binary, defaults to the config key 'ffmpeg_path'.
+        """
+        self.ffmpeg_path = ffmpeg_path or get_from_config("ffmpeg_path")
+        if not self.ffmpeg_path:
+            raise ValueError("FFmpeg path not set. Please run 'smule.py --init' to configure the environment.")
+        if max_workers is None:
+            max_workers = int(get_from_config("download_workers", DEFAULT_DOWNLOAD_WORKERS))
+        self.max_workers = max(1, max_workers)
+        self.audio_format = audio_format or get_from_config("download_audio_format", NATIVE_AUDIO_FORMAT)
+        self.staging_folder = staging_folder
+        self.progress_callback = progress_callback
+        self.ydl_options = dict(ydl_options or {})
+        self._local = threading.local()
+        self._sessions = []
+        self._lock = threading.Lock()
+        self._reported = {}
+        self._song_locks = {}  # song key -> lock held while that song downloads
+        os.makedirs(staging_folder, exist_ok=True)
+
+    def _session(self):
+        """
+        Return the YoutubeDL session of the calling thread, creating it on first use.
+        """
+        session = getattr(self._local, "session", None)
+        if session is None:
+            import yt_dlp
+            ydl_opts = download_options(self.ffmpeg_path, self.audio_format,
+                                        os.path.join(self.staging_folder, '%(id)s.%(ext)s'))
+            ydl_opts['concurrent_fragment_downloads'] = int(get_from_config("download_fragment_workers",
+                                                                            DEFAULT_FRAGMENT_WORKERS))
+            ydl_opts['progress_hooks'] = [self._on_progress]
+            ydl_opts['quiet'] = True
+            ydl_opts['noprogress'] = True
+            ydl_opts.update(self.ydl_options)
+            session = yt_dlp.YoutubeDL(ydl_opts)
+            self._local.session = session
+            with self._lock:
+                self._sessions.append(session)
+        return session
+
+    def _on_progress(self, status):
+        if self.progress_callback is None:
+            return
+        info = status.get("info_dict") or {}
+        url = info.get("original_url") or info.get("webpage_url") or info.get("id")
+        total = status.get("total_bytes") or status.get("total_bytes_estimate")
+        downloaded = status.get("downloaded_bytes")
+        percent = downloaded * 100.0 / total if total and downloaded is not None else None
+
+        # Fragment threads call the hook concurrently, report each step of each URL once
+        with self._lock:
+            step = int(percent // PROGRESS_STEP_PERCENT) if percent is not None else None
+            if status.get("status") == "downloading" and self._reported.get(url) == step:
+                return
+            self._reported[url] = step
+        self.progress_callback(url, {"status": status.get("status"), "percent": percent,
+                                     "downloaded_bytes": downloaded, "total_bytes": total})
+
+    def _song_key(self, song_metadata):
+        # Two entries of the same video share the '%(id)s.%(ext)s' staging file, whatever their URL looks like
+        return get_video_id(song_metadata) or song_metadata["URL"]
+
+    def download_one(self, song_metadata, output_folder):
+        """
+        Download the audio of one song into output_folder as '<Artist> - <Title>.<ext>', on the session of the
+        calling thread. Safe to call from several threads at once: two calls for the same video run one after
+        the other, so they never write the same staging file, and the second one finds the first in the cache.
+
+        :return: The path of the downloaded audio file.
+        """
+        with self._lock:
+            song_lock = self._song_locks.setdefault(self._song_key(song_metadata), threading.Lock())
+        with song_lock:
+            return self._download_one(song_metadata, output_folder)
+
+    def _download_one(self, song_metadata, output_folder):
+        youtube_url = song_metadata["URL"]
+        audio_file_name = get_audio_file_name(song_metadata)
+        video_id = get_video_id(song_metadata)
+        wait_for_prefetch(video_id, self.audio_format)
+        cached = lookup_download(video_id, self.audio_format)
+        if cached:
+            return restore_download(cached, output_folder, audio_file_name)
+
+        session = self._session()
+        info = session.extract_info(youtube_url, download=True)
+        staged_path = downloaded_file_path(session, info)
+        if self.audio_format == WAV_AUDIO_FORMAT:
+            staged_path = os.path.splitext(staged_path)[0] + ".wav"
+
+        os.makedirs(output_folder, exist_ok=True)
+        audio_file_path = os.path.join(output_folder, audio_file_name + os.path.splitext(staged_path)[1])
+        shutil.move(staged_path, audio_file_path)
+        log_message(f"Downloaded audio from {youtube_url}")
+
+        cache_download(video_id, self.audio_format, audio_file_path)
+        return audio_file_path
+
+    def _copy_download(self, downloaded_path, song_metadata, output_folder):
+        """
+        Give a duplicate entry of the batch its own copy of a song downloaded for another entry.
+        """
+        audio_file_name = get_audio_file_name(song_metadata)
+        audio_file_path = os.path.join(output_folder, audio_file_name + os.path.splitext(downloaded_path)[1])
+        if os.path.abspath(audio_file_path) != os.path.abspath(downloaded_path):
+            os.makedirs(output_folder, exist_ok=True)
+            shutil.copy2(downloaded_path, audio_file_path)
+        return audio_file_path
+
+    def download_many(self, songs):
+        """
+        Download many songs with at most max_workers downloads at a time.
+        Entries of the same video are downloaded once and the file is copied to the folder of every entry.
+
+        :param songs: A list of (song_metadata, output_folder) tuples.
+        :return: One result per song, in the order of songs:
+                 {"url": ..., "success": True, "path": ...} or {"url": ..., "success": False, "error": ...}.
+        """
+        def download(song_metadata, output_folder):
+            try:
+                return {"url": song_metadata["URL"], "success": True, "path": self.download_one(song_metadata, output_folder)}
+            except Exception as e:
+                log_message(f"Failed to download audio from {song_metadata['URL']}: {e}")
+                return {"url": song_metadata["URL"], "success": False, "error": str(e)}
+
+        # The first entry of every video is downloaded, the others wait for its result
+        first_entry = {}
+        for index, (song_metadata, _) in enumerate(songs):
+            first_entry.setdefault(self._song_key(song_metadata), index)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="download") as pool:
+            futures = {index: pool.submit(download, *songs[index]) for index in first_entry.values()}
+
+        results = []
+        for index, (song_metadata, output_folder) in enumerate(songs):
+            result = futures[first_entry[self._song_key(song_metadata)]].result()
+            if index in futures or not result["success"]:
+                results.append(dict(result, url=song_metadata["URL"]))
+                continue
+            try:
+                results.append({"url": song_metadata["URL"], "success": True,
+                                "path": self._copy_download(result["path"], song_metadata, output_folder)})
+            except OSError as e:
+                log_message(f"Failed to copy the audio of {song_metadata['URL']}: {e}")
+                results.append({"url": song_metadata["URL"], "success": False, "error": str(e)})
+        return results
+
+    def close(self):
+        """
+        Close every session, releasing their HTTP connections.
+        """
+        with self._lock:
+            sessions, self._sessions = self._sessions, []
+        for session in sessions:
+            session.close()
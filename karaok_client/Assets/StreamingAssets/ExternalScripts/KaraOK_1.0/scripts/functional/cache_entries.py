@@ -0,0 +1,57 @@
+import os
+import json
+import shutil
+import uuid
+from .logger import log_message
+
+# Every cache folder holds <root>/<video id>/<entry>/, described by this file
+ENTRY_FILE_NAME = "entry.json"
+
+def read_entry(entry_folder):
+    """
+    Load the entry.json of a cache entry folder, or None when it is missing or unreadable.
+    """
+    try:
+        with open(os.path.join(entry_folder, ENTRY_FILE_NAME), 'r') as entry_file:
+            return json.load(entry_file)
+    except (OSError, json.JSONDecodeError):
+        return None
+
+def write_entry(entry_folder, entry):
+    # Write to a temp file and rename so readers never see a partial entry
+    entry_path = os.path.join(entry_folder, ENTRY_FILE_NAME)
+    temp_path = f"{entry_path}.{uuid.uuid4().hex}.tmp"
+    with open(temp_path, 'w') as entry_file:
+        json.dump(entry, entry_file, indent=4)
+    os.replace(temp_path, entry_path)
+
+def evict_entries(root, max_bytes, label):
+    """
+    Delete the least recently used entries under root until their total 'size' fits in max_bytes.
+
+    :param label: The name of the cache in the log messages.
+    """
+    if not os.path.isdir(root):
+        return
+
+    entries = []
+    for video_id in os.listdir(root):
+        video_folder = os.path.join(root, video_id)
+        if not os.path.isdir(video_folder):
+            continue
+        for name in os.listdir(video_folder):
+            entry_folder = os.path.join(video_folder, name)
+            entry = read_entry(entry_folder)
+            if entry:
+                entries.append((entry.get("last_used", 0), entry.get("size", 0), entry_folder))
+
+    total_size = sum(size for _, size, _ in entries)
+    for _, size, entry_folder in sorted(entries):
+        if total_size <= max_bytes:
+            break
+        shutil.rmtree(entry_folder, ignore_errors=True)
+        total_size -= size
+        video_folder = os.path.dirname(entry_folder)
+        if not os.listdir(video_folder):
+            os.rmdir(video_folder)
+        log_message(f"[{label}] Evicted {entry_folder}")
@@ -0,0 +1,442 @@
+import os
+import threading
+import uuid
+from collections import OrderedDict, deque
+from .logger import log_message
+from .segmented_audio import (
+    SEGMENT_CROSSFADE_SECONDS, plan_segments, track_stats, track_frames, read_segment, decode_blocks, decode_to_wav,
+    stream_segments, CrossfadeStitcher, WavFileSink
+)
+from scripts.main.config_manager import get_from_config
+
+# How many Demucs models may stay loaded at once before the least recently used one is released
+DEFAULT_MAX_RESIDENT_MODELS = 1
+
+# Memory a separation may use before the track is processed in segments (config 'demucs_memory_budget_mb')
+DEFAULT_MEMORY_BUDGET_MB = 4096
+# Rough memory of a loaded model and its activations, which does not grow with the track length
+MODEL_OVERHEAD_MB = 1024
+MIN_SEGMENT_SECONDS = 10
+# Processes a single track is split across on CPU (config 'demucs_workers', 1 = off, 0 = every core)
+DEFAULT_WORKERS = 1
+# Chunks submitted to the separation processes ahead of the one being stitched, per process
+CHUNKS_IN_FLIGHT_PER_WORKER = 1
+
+class DemucsEngine:
+    """
+    Runs Demucs inside the current process. Each model is loaded once and kept resident, so successive
+    tracks are separated against a warm model instead of re-importing torch and re-reading the weights.
+    Models are kept in least-recently-used order and released when more than max_resident_models are loaded.
+    """
+
+    def __init__(self, max_resident_models=None, device=None):
+        if max_resident_models is None:
+            max_resident_models = int(get_from_config("demucs_max_resident_models", DEFAULT_MAX_RESIDENT_MODELS))
+        self.max_resident_models = max(1, max_resident_models)
+        self._device = device or get_from_config("demucs_device")
+        self._models = OrderedDict()
+        self._pool = None
+        self._lock = threading.Lock()
+
+    @property
+    def device(self):
+        if not self._device:
+            import torch
+            self._device = "cuda" if torch.cuda.is_available() else "cpu"
+        return self._device
+
+    def get_model(self, model_name):
+        """
+        Return the resident model, loading it on first use and evicting the least recently used one if needed.
+        """
+        with self._lock:
+            if model_name in self._models:
+                self._models.move_to_end(model_name)
+                return self._models[model_name]
+
+            from demucs.pretrained import get_model
+            log_message(f"[Demucs] Loading model '{model_name}' on {self.device}...")
+            model = get_model(model_name)
+            model.to(self.device)
+            model.eval()
+            self._models[model_name] = model
+
+            while len(self._models) > self.max_resident_models:
+                evicted_name, _ = self._models.popitem(last=False)
+                log_message(f"[Demucs] Released model '{evicted_name}'")
+            self._empty_device_cache()
+            return model
+
+    def release(self, model_name=None):
+        """
+        Release one model, or every model when model_name is None, together with its separation processes.
+        """
+        with self._lock:
+            if model_name is None:
+                self._models.clear()
+            else:
+                self._models.pop(model_name, None)
+            if self._pool is not None and (model_name is None or self._pool[0][0] == model_name):
+                self._pool[1].shutdown()
+                self._pool = None
+            self._empty_device_cache()
+
+    def loaded_models(self):
+        return list(self._models)
+
+    def _empty_device_cache(self):
+        if self._device and self._device.startswith("cuda"):
+            import torch
+            torch.cuda.empty_cache()
+
+    def load_track(self, audio_file_path, model):
+        """
+        Read the track as a (channels, samples) tensor at the model sample rate and channel count.
+        """
+        from demucs.audio import AudioFile, convert_audio
+        try:
+            import torchaudio
+            wav, samplerate = torchaudio.load(audio_file_path)
+            return convert_audio(wav, samplerate, model.samplerate, model.audio_channels)
+        except Exception as e:
+            # Same fallback as the demucs CLI: let ffmpeg decode what torchaudio cannot
+            log_message(f"[Demucs] torchaudio could not load {audio_file_path} ({e}), decoding with ffmpeg.")
+            return AudioFile(audio_file_path).read(streams=0, samplerate=model.samplerate, channels=model.audio_channels)
+
+    def separate_tensor(self, model, wav, stem="vocals", shifts=1, overlap=0.25, stats=None):
+        """
+        Separate a (channels, frames) tensor and return a (2, channels, frames) tensor holding the stem
+        and the sum of every other source.
+
+        :param stats: (mean, std) used for normalization. Defaults to the statistics of wav itself,
+                      which is what the demucs CLI does for a whole track.
+        """
+        import torch
+        from demucs.apply import apply_model
+
+        if stats is None:
+            ref = wav.mean(0)
+            stats = (ref.mean(), ref.std())
+        mean, std = stats
+
+        wav = (wav - mean) / std
+        with torch.no_grad():
+            sources = apply_model(model, wav[None], device=self.device, shifts=shifts, split=True,
+                                  overlap=overlap, progress=False)[0]
+        sources = (sources * std + mean).cpu()
+
+        stem_audio = sources[model.sources.index(stem)]
+        return torch.stack([stem_audio, sources.sum(0) - stem_audio])
+
+    def separate(self, audio_file_path, output_folder, model_name, stem="vocals", shifts=1, overlap=0.25):
+        """
+        Separate the track into '<stem>.wav' and 'no_<stem>.wav', written to the same
+        <output_folder>/<model_name>/<track_name>/ layout as 'demucs --two-stems=<stem>'.
+
+        :return: The folder holding the two stems.
+        """
+        model = self.get_model(model_name)
+        stems_folder = stems_folder_path(audio_file_path, output_folder, model_name)
+        sinks = {
+            name: [WavFileSink(os.path.join(stems_folder, f"{name}.wav"), model.samplerate, model.audio_channels)]
+            for name in (stem, f"no_{stem}")
+        }
+        self.separate_to_sinks(audio_file_path, model_name, sinks, stem, shifts, overlap)
+        return stems_folder
+
+    def separate_to_sinks(self, audio_file_path, model_name, sinks, stem="vocals", shifts=1, overlap=0.25):
+        """
+        Separate the track and feed the stems to sinks as they are produced, so the caller decides what is
+        written (WAV files, encoder pipes, or nothing for stems it does not need). Every sink is closed at the end.
+
+        :param sinks: A dictionary of '<stem>' / 'no_<stem>' -> list of sinks with write(tensor) and close().
+        """
+        segment_count, crossfade_frames, separated_segments = self.stem_segments(
+            audio_file_path, model_name, stem, shifts, overlap)
+
+        def stem_writer(stem_sinks):
+            def write(stem_audio):
+                for sink in stem_sinks:
+                    sink.write(stem_audio)
+            return write
+
+        stem_sinks = [sinks.get(stem, []), sinks.get(f"no_{stem}", [])]
+        try:
+            stitcher = CrossfadeStitcher([stem_writer(each) for each in stem_sinks], crossfade_frames)
+            for index, stems in enumerate(separated_segments):
+                stitcher.add(stems, is_last=index == segment_count - 1)
+        finally:
+            for sink in stem_sinks[0] + stem_sinks[1]:
+                sink.close()
+
+    def stem_segments(self, audio_file_path, model_name, stem="vocals", shifts=1, overlap=0.25):
+        """
+        Pick how the track is separated and return (segment_count, crossfade_frames, iterator of stems tensors):
+        on CPU the track is split across 'demucs_workers' processes when that is set above 1, compressed tracks
+        (the native YouTube containers) are decoded through an ffmpeg pipe, tracks whose full separation would
+        not fit in the memory budget are separated segment by segment, and every other track is separated whole.
+        The stems are not clipped here: every path leaves that to the sinks, which all clamp with clip_samples.
+        """
+        model = self.get_model(model_name)
+        readable = self._readable_frames(audio_file_path, model) is not None
+        ffmpeg_path = get_from_config("ffmpeg_path")
+        workers = self.parallel_workers()
+        if workers > 1 and self.device == "cpu" and (readable or ffmpeg_path):
+            return self.parallel_stems(audio_file_path, model_name, workers, stem, shifts, overlap)
+        if not readable and ffmpeg_path:
+            return self.streamed_stems(audio_file_path, model_name, stem, shifts, overlap)
+        if self.needs_segmenting(audio_file_path, model):
+            return self.segmented_stems(audio_file_path, model_name, stem, shifts, overlap)
+
+        return self.whole_track_stems(model, self.load_track(audio_file_path, model), stem, shifts, overlap)
+
+    def whole_track_stems(self, model, wav, stem="vocals", shifts=1, overlap=0.25):
+        """
+        Separate a whole (channels, frames) track at once. Returns the same tuple as stem_segments().
+        """
+        # Not rescaled to its peak: the sinks clamp it like the segments of the other paths (see clip_samples)
+        return 1, 0, iter([self.separate_tensor(model, wav, stem, shifts, overlap)])
+
+    def memory_budget_bytes(self):
+        return int(get_from_config("demucs_memory_budget_mb", DEFAULT_MEMORY_BUDGET_MB)) * 1024 ** 2
+
+    def _bytes_per_frame(self, model):
+        # Input, its normalized copy, every source and the two output stems, as float32
+        return model.audio_channels * 4 * (len(model.sources) + 4)
+
+    def _readable_frames(self, audio_file_path, model):
+        """
+        Frames of the track at the model sample rate, or None when soundfile cannot read the file.
+        """
+        try:
+            return track_frames(audio_file_path, model.samplerate)
+        except Exception:
+            return None
+
+    def needs_segmenting(self, audio_file_path, model):
+        """
+        True when separating the whole track at once is estimated to exceed the memory budget.
+        Files that soundfile cannot read (e.g. compressed containers) are always separated whole.
+        """
+        total_frames = self._readable_frames(audio_file_path, model)
+        if total_frames is None:
+            return False
+        estimate = MODEL_OVERHEAD_MB * 1024 ** 2 + total_frames * self._bytes_per_frame(model)
+        return estimate > self.memory_budget_bytes()
+
+    def segment_frames(self, model):
+        """
+        Longest segment whose separation fits in the memory budget, at least MIN_SEGMENT_SECONDS long.
+        """
+        available = self.memory_budget_bytes() - MODEL_OVERHEAD_MB * 1024 ** 2
+        frames = available // self._bytes_per_frame(model)
+        return int(max(frames, MIN_SEGMENT_SECONDS * model.samplerate))
+
+    def segmented_stems(self, audio_file_path, model_name, stem="vocals", shifts=1, overlap=0.25):
+        """
+        Separate a track in overlapping segments read one at a time, so peak memory depends on the memory
+        budget and not on the track length. Returns the same tuple as stem_segments().
+        """
+        import soundfile
+
+        model = self.get_model(model_name)
+        total_frames = track_frames(audio_file_path, model.samplerate)
+        crossfade_frames = int(SEGMENT_CROSSFADE_SECONDS * model.samplerate)
+        segments = plan_segments(total_frames, self.segment_frames(model), crossfade_frames)
+        stats = track_stats(audio_file_path)
+        log_message(f"[Demucs] Separating {audio_file_path} in {len(segments)} segments to stay within the memory budget.")
+
+        def separated_segments():
+            with soundfile.SoundFile(audio_file_path) as source:
+                for start, length in segments:
+                    wav = read_segment(source, start, length, model.samplerate, model.audio_channels)
+                    yield self.separate_tensor(model, wav, stem, shifts, overlap, stats)
+
+        return len(segments), crossfade_frames, separated_segments()
+
+    def streamed_stems(self, audio_file_path, model_name, stem="vocals", shifts=1, overlap=0.25):
+        """
+        Separate a track soundfile cannot read (opus, m4a, ...) by decoding it through an ffmpeg pipe.
+        The first decoding pass keeps the audio while it fits in the memory budget and then separates the
+        track whole; longer tracks only get their statistics from that pass and are decoded a second time,
+        segment by segment. Returns the same tuple as stem_segments().
+        """
+        import torch
+
+        model = self.get_model(model_name)
+        ffmpeg_path = get_from_config("ffmpeg_path")
+        max_frames = (self.memory_budget_bytes() - MODEL_OVERHEAD_MB * 1024 ** 2) // self._bytes_per_frame(model)
+
+        blocks = []
+        total_frames = 0
+        total = 0.0
+        total_squares = 0.0
+        for block in decode_blocks(audio_file_path, ffmpeg_path, model.samplerate, model.audio_channels):
+            mono = block.mean(0).double()
+            total += mono.sum().item()
+            total_squares += (mono ** 2).sum().item()
+            total_frames += block.shape[-1]
+            if blocks is not None:
+                blocks.append(block)
+                if total_frames > max_frames:
+                    blocks = None
+
+        if not total_frames:
+            raise ValueError(f"ffmpeg decoded no audio from {audio_file_path}")
+        if blocks is not None:
+            return self.whole_track_stems(model, torch.cat(blocks, dim=-1), stem, shifts, overlap)
+
+        mean = total / total_frames
+        stats = (mean, max(total_squares / total_frames - mean ** 2, 0.0) ** 0.5 or 1.0)
+        crossfade_frames = int(SEGMENT_CROSSFADE_SECONDS * model.samplerate)
+        segments = plan_segments(total_frames, self.segment_frames(model), crossfade_frames)
+        log_message(f"[Demucs] Separating {audio_file_path} in {len(segments)} streamed segments to stay within the memory budget.")
+
+        def separated_segments():
+            blocks = decode_blocks(audio_file_path, ffmpeg_path, model.samplerate, model.audio_channels)
+            for wav in stream_segments(blocks, segments):
+                yield self.separate_tensor(model, wav, stem, shifts, overlap, stats)
+
+        return len(segments), crossfade_frames, separated_segments()
+
+    def parallel_workers(self):
+        """
+        Number of processes one track is split across (config 'demucs_workers'). 1 disables parallel
+        separation and 0 uses every CPU core.
+        """
+        workers = int(get_from_config("demucs_workers", DEFAULT_WORKERS))
+        return workers if workers > 0 else (os.cpu_count() or 1)
+
+    def _process_pool(self, model_name, workers):
+        """
+        Return a process pool whose workers already hold model_name. The pool stays alive for the
+        following tracks and is replaced when another model or worker count is requested.
+        The workers are spawned rather than forked, so they never inherit a copy of the loaded models,
+        the torch thread pools or the locks of the parent.
+        """
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+
+        with self._lock:
+            if self._pool is not None and self._pool[0] == (model_name, workers):
+                return self._pool[1]
+            if self._pool is not None:
+                self._pool[1].shutdown()
+
+            threads = max(1, (os.cpu_count() or 1) // workers)
+            log_message(f"[Demucs] Starting {workers} separation processes for '{model_name}' ({threads} threads each)...")
+            executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                           initializer=_init_chunk_worker, initargs=(model_name, threads))
+            self._pool = ((model_name, workers), executor)
+            return executor
+
+    def parallel_stems(self, audio_file_path, model_name, workers, stem="vocals", shifts=1, overlap=0.25):
+        """
+        Split one track into overlapping chunks and separate the chunks concurrently in a process pool.
+        Returns the same tuple as stem_segments(), with the chunks yielded in track order.
+        Only CHUNKS_IN_FLIGHT_PER_WORKER chunks per process are submitted ahead of the one being stitched,
+        so memory holds a few chunks whatever the track length. Files soundfile cannot read (the native
+        YouTube containers) are first decoded to a temporary PCM WAV next to them, which the processes read
+        their chunks from.
+        """
+        import torch
+
+        model = self.get_model(model_name)
+        decoded_path = None
+        if self._readable_frames(audio_file_path, model) is None:
+            decoded_path = os.path.join(os.path.dirname(os.path.abspath(audio_file_path)),
+                                        f".{uuid.uuid4().hex}.decoded.wav")
+            log_message(f"[Demucs] Decoding {audio_file_path} to PCM for the separation processes.")
+            audio_file_path = decode_to_wav(audio_file_path, get_from_config("ffmpeg_path"), model.samplerate,
+                                            model.audio_channels, decoded_path)
+
+        try:
+            total_frames = track_frames(audio_file_path, model.samplerate)
+            crossfade_frames = int(SEGMENT_CROSSFADE_SECONDS * model.samplerate)
+
+            # One chunk per worker, unless that would not fit in the memory budget with every worker busy
+            chunk_frames = -(-(total_frames + (workers - 1) * crossfade_frames) // workers)
+            budget_frames = max(self.segment_frames(model) // workers, MIN_SEGMENT_SECONDS * model.samplerate)
+            chunks = plan_segments(total_frames, min(chunk_frames, budget_frames), crossfade_frames)
+            stats = track_stats(audio_file_path)
+            pool = self._process_pool(model_name, workers)
+        except Exception:
+            if decoded_path and os.path.exists(decoded_path):
+                os.remove(decoded_path)
+            raise
+        log_message(f"[Demucs] Separating {audio_file_path} in {len(chunks)} chunks across {workers} processes.")
+
+        def separated_chunks():
+            pending = deque()
+            remaining = iter(chunks)
+            in_flight = workers * (1 + CHUNKS_IN_FLIGHT_PER_WORKER)
+            try:
+                for start, length in remaining:
+                    pending.append(pool.submit(_separate_chunk, audio_file_path, model_name, start, length,
+                                               stem, shifts, overlap, stats))
+                    if len(pending) >= in_flight:
+                        break
+                while pending:
+                    stems = torch.from_numpy(pending.popleft().result())
+                    chunk = next(remaining, None)
+                    if chunk is not None:
+                        pending.append(pool.submit(_separate_chunk, audio_file_path, model_name, chunk[0], chunk[1],
+                                                   stem, shifts, overlap, stats))
+                    yield stems
+            finally:
+                for future in pending:
+                    future.cancel()
+                if decoded_path:
+                    # Chunks already running still read the file, wait for them before removing it
+                    for future in pending:
+                        if not future.cancelled():
+                            future.exception()
+                    if os.path.exists(decoded_path):
+                        os.remove(decoded_path)
+
+        return len(chunks), crossfade_frames, separated_chunks()
+
+_chunk_engine = None
+
+def _init_chunk_worker(model_name, threads):
+    """
+    Initializer of the separation processes: limit torch threads so the workers share the cores, and load the model.
+    """
+    global _chunk_engine
+    import torch
+    torch.set_num_threads(threads)
+    _chunk_engine = DemucsEngine(max_resident_models=1, device="cpu")
+    _chunk_engine.get_model(model_name)
+
+def _separate_chunk(audio_file_path, model_name, start, length, stem, shifts, overlap, stats):
+    """
+    Separate one chunk of the track inside a pool process and return the (2, channels, frames) stems as an array.
+    """
+    import soundfile
+
+    model = _chunk_engine.get_model(model_name)
+    with soundfile.SoundFile(audio_file_path) as source:
+        wav = read_segment(source, start, length, model.samplerate, model.audio_channels)
+    return _chunk_engine.separate_tensor(model, wav, stem, shifts, overlap, stats).numpy()
+
+def stems_folder_path(audio_file_path, output_folder, model_name):
+    """
+    Create and return <output_folder>/<model_name>/<track_name>, where the demucs CLI writes its stems.
+    """
+    track_name = os.path.splitext(os.path.basename(audio_file_path))[0]
+    stems_folder = os.path.join(output_folder, model_name, track_name)
+    os.makedirs(stems_folder, exist_ok=True)
+    return stems_folder
+
+_engine = None
+_engine_lock = threading.Lock()
+
+def get_engine():
+    """
+    Return the process wide DemucsEngine, creating it on first use.
+    """
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = DemucsEngine()
+        return _engine
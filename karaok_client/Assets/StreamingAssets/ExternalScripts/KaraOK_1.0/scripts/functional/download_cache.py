@@ -0,0 +1,187 @@
+import os
+import sys
+import time
+import shutil
+import uuid
+from .logger import log_message
+from .cache_entries import read_entry, write_entry, evict_entries
+from scripts.main.config_manager import get_from_config
+from files_utils import link_or_copy
+
+# Default location and size of the downloaded audio cache, overridable from the config file
+DEFAULT_CACHE_FOLDER = os.path.join(os.path.expanduser('~'), "kara-ok_cache", "downloads")
+DEFAULT_CACHE_MAX_BYTES = 5 * 1024 ** 3  # 5 GB
+# Where the prefetch process cannot be checked, a prefetch lock older than this is left over from one that died
+PREFETCH_STALE_SECONDS = 15 * 60
+DEFAULT_PREFETCH_WAIT_SECONDS = 600
+
+def cache_enabled():
+    return bool(get_from_config("download_cache_enabled", True))
+
+def cache_folder():
+    return get_from_config("download_cache_path", DEFAULT_CACHE_FOLDER)
+
+def _entry_folder(video_id, audio_format):
+    return os.path.join(cache_folder(), video_id, audio_format)
+
+def lookup_download(video_id, audio_format):
+    """
+    Find the cached source audio of the video in the given download format.
+
+    :param video_id: The YouTube video id.
+    :param audio_format: The download format, "native" or "wav".
+    :return: The entry dictionary (with its 'folder'), or None on a miss.
+    """
+    if not video_id or not cache_enabled():
+        return None
+
+    entry_folder = _entry_folder(video_id, audio_format)
+    entry = read_entry(entry_folder)
+    if not entry or not os.path.isfile(os.path.join(entry_folder, entry.get("file", ""))):
+        return None
+    entry["folder"] = entry_folder
+    return entry
+
+def restore_download(entry, output_folder, audio_file_name):
+    """
+    Restore the cached audio as <output_folder>/<audio_file_name><extension> and mark the entry as recently used.
+
+    :return: The path of the restored audio file.
+    """
+    os.makedirs(output_folder, exist_ok=True)
+    audio_file_path = os.path.join(output_folder, audio_file_name + os.path.splitext(entry["file"])[1])
+    link_or_copy(os.path.join(entry["folder"], entry["file"]), audio_file_path)
+
+    entry_folder = entry.pop("folder")
+    entry["last_used"] = time.time()
+    write_entry(entry_folder, entry)
+
+    log_message(f"[Download cache] Restored {entry['video_id']} ({entry['format']}) to {audio_file_path}")
+    return audio_file_path
+
+def store_download(video_id, audio_format, audio_file_path):
+    """
+    Store a freshly downloaded audio file in the cache, then evict old entries if needed.
+    """
+    if not video_id or not cache_enabled():
+        return None
+
+    entry_folder = _entry_folder(video_id, audio_format)
+    temp_folder = f"{entry_folder}.{uuid.uuid4().hex}.tmp"
+    os.makedirs(temp_folder)
+
+    try:
+        file_name = os.path.basename(audio_file_path)
+        link_or_copy(audio_file_path, os.path.join(temp_folder, file_name))
+        now = time.time()
+        write_entry(temp_folder, {
+            "video_id": video_id,
+            "format": audio_format,
+            "file": file_name,
+            "size": os.path.getsize(audio_file_path),
+            "created": now,
+            "last_used": now,
+        })
+
+        if os.path.exists(entry_folder):
+            shutil.rmtree(entry_folder)
+        os.replace(temp_folder, entry_folder)
+    except Exception:
+        shutil.rmtree(temp_folder, ignore_errors=True)
+        raise
+
+    log_message(f"[Download cache] Stored {video_id} ({audio_format}) at {entry_folder}")
+    evict_downloads()
+    return entry_folder
+
+def evict_downloads(max_bytes=None):
+    """
+    Delete the least recently used entries until the cache fits in max_bytes
+    (config key 'download_cache_max_bytes', 5 GB by default).
+    """
+    if max_bytes is None:
+        max_bytes = int(get_from_config("download_cache_max_bytes", DEFAULT_CACHE_MAX_BYTES))
+
+    evict_entries(cache_folder(), max_bytes, "Download cache")
+
+def _prefetch_lock_path(video_id, audio_format):
+    return os.path.join(cache_folder(), video_id, f"{audio_format}.prefetch")
+
+def _prefetch_lock_is_stale(lock_path):
+    """
+    A lock is stale when the process named in it is gone. A live prefetch keeps its claim however long
+    it takes. Where liveness cannot be checked (Windows, or no pid in the lock), a lock older than
+    PREFETCH_STALE_SECONDS is considered left over from a prefetch that died.
+    """
+    try:
+        with open(lock_path, 'r') as lock_file:
+            pid = int(lock_file.read().strip() or 0)
+        age = time.time() - os.path.getmtime(lock_path)
+    except (OSError, ValueError):
+        return True
+    if sys.platform == "win32" or not pid:
+        return age > PREFETCH_STALE_SECONDS
+    try:
+        os.kill(pid, 0)  # Signal 0 only checks that the process exists
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        pass
+    return False
+
+def claim_prefetch(video_id, audio_format):
+    """
+    Mark the video as being prefetched (see audio_prefetch), so a second prefetch does not download it again
+    and a download waits for the prefetch instead of racing it. The claim holds the pid of the current
+    process, see hand_over_prefetch to pass it on to a child process.
+
+    :return: True if the claim was taken, False if another live prefetch holds it.
+    """
+    lock_path = _prefetch_lock_path(video_id, audio_format)
+    os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+    for _ in range(2):
+        try:
+            descriptor = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            if not _prefetch_lock_is_stale(lock_path):
+                return False
+            os.remove(lock_path)
+            continue
+        with os.fdopen(descriptor, 'w') as lock_file:
+            lock_file.write(str(os.getpid()))
+        return True
+    return False
+
+def hand_over_prefetch(video_id, audio_format, pid):
+    """
+    Record pid as the holder of a claim taken with claim_prefetch, once the process that does the
+    download has started. The claim is never free in between, so no other prefetch can take it.
+    """
+    lock_path = _prefetch_lock_path(video_id, audio_format)
+    temp_path = f"{lock_path}.{uuid.uuid4().hex}.tmp"
+    with open(temp_path, 'w') as lock_file:
+        lock_file.write(str(pid))
+    os.replace(temp_path, lock_path)
+
+def release_prefetch(video_id, audio_format):
+    lock_path = _prefetch_lock_path(video_id, audio_format)
+    if os.path.exists(lock_path):
+        os.remove(lock_path)
+
+def wait_for_prefetch(video_id, audio_format, timeout=None):
+    """
+    Wait while a prefetch of the video is downloading, up to timeout seconds
+    (config key 'prefetch_wait_seconds', 10 minutes by default), so the caller then finds it in the cache.
+    """
+    if not video_id or not cache_enabled():
+        return
+    lock_path = _prefetch_lock_path(video_id, audio_format)
+    if not os.path.exists(lock_path):
+        return
+    if timeout is None:
+        timeout = float(get_from_config("prefetch_wait_seconds", DEFAULT_PREFETCH_WAIT_SECONDS))
+
+    log_message(f"[Download cache] Waiting for the prefetch of {video_id} ({audio_format}) to finish...")
+    deadline = time.time() + timeout
+    while os.path.exists(lock_path) and not _prefetch_lock_is_stale(lock_path) and time.time() < deadline:
+        time.sleep(0.5)
@@ -0,0 +1,114 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from .logger import log_message
+from .metadata_provider import METADATA_OPTIONS, cached_song_metadata, extract_song_metadata
+from .separation_cache import video_id_from_url
+from scripts.main.config_manager import get_from_config
+
+# Metadata lookups run at the same time (config 'metadata_workers')
+DEFAULT_METADATA_WORKERS = 8
+
+def read_urls(lines):
+    """
+    Read one URL per line, skipping blank lines and '#' comments.
+    """
+    return [line.strip() for line in lines if line.strip() and not line.strip().startswith("#")]
+
+class MetadataResolver:
+    """
+    Resolves the metadata of many videos and playlists with a bounded number of concurrent lookups.
+    Each worker thread keeps one YoutubeDL session for all of its lookups, and cache hits (see metadata_cache)
+    never open a session at all.
+    """
+
+    def __init__(self, max_workers=None):
+        """
+        :param max_workers: Concurrent lookups, defaults to the config key 'metadata_workers'.
+        """
+        if max_workers is None:
+            max_workers = int(get_from_config("metadata_workers", DEFAULT_METADATA_WORKERS))
+        self.max_workers = max(1, max_workers)
+        self._local = threading.local()
+        self._sessions = []
+        self._lock = threading.Lock()
+
+    def _session(self):
+        """
+        Return the YoutubeDL session of the calling thread, creating it on first use.
+        """
+        session = getattr(self._local, "session", None)
+        if session is None:
+            import yt_dlp
+            session = yt_dlp.YoutubeDL(METADATA_OPTIONS)
+            self._local.session = session
+            with self._lock:
+                self._sessions.append(session)
+        return session
+
+    def expand(self, url):
+        """
+        Return the video URLs of a playlist URL, or [url] for a video URL.
+        URLs with a video id are never looked up here, so single videos cost no extra request.
+        """
+        if video_id_from_url(url):
+            return [url]
+
+        info = self._session().extract_info(url, download=False)
+        if info.get("_type") != "playlist":
+            return [url]
+
+        entries = [entry for entry in info.get("entries") or [] if entry]
+        log_message(f"Playlist {url} has {len(entries)} videos")
+        return [entry.get("url") or f"https://www.youtube.com/watch?v={entry['id']}" for entry in entries]
+
+    def resolve_one(self, url):
+        """
+        Resolve the metadata of one video on the session of the calling thread.
+
+        :return: {"url", "ok": True, "result"} or {"url", "ok": False, "error"}.
+        """
+        try:
+            # One cache probe per video: a hit needs no session, a miss goes straight to yt-dlp
+            result = cached_song_metadata(url) or extract_song_metadata(url, self._session())
+            return {"url": url, "ok": True, "result": result}
+        except Exception as e:
+            return {"url": url, "ok": False, "error": str(e)}
+
+    def resolve_many(self, urls, emit):
+        """
+        Resolve every video of the given video and playlist URLs, calling emit with each result as soon as it is
+        ready, in completion order. Playlists are expanded first and their videos queued as they are listed.
+
+        :param emit: Called with each result dictionary, from one thread at a time.
+        :return: The number of videos resolved.
+        """
+        emit_lock = threading.Lock()
+
+        def resolve_and_emit(url):
+            result = self.resolve_one(url)
+            with emit_lock:
+                emit(result)
+
+        count = 0
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="metadata") as pool:
+            for url in urls:
+                try:
+                    video_urls = self.expand(url)
+                except Exception as e:
+                    log_message(f"Failed to list {url}: {e}")
+                    with emit_lock:
+                        emit({"url": url, "ok": False, "error": str(e)})
+                    continue
+                for video_url in video_urls:
+                    pool.submit(resolve_and_emit, video_url)
+                    count += 1
+        return count
+
+    def close(self):
+        """
+        Close every YoutubeDL session that was opened.
+        """
+        with self._lock:
+            sessions, self._sessions = self._sessions, []
+        for session in sessions:
+            session.close()
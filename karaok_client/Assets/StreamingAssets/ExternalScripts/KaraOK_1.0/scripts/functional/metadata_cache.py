@@ -0,0 +1,67 @@
+import os
+import json
+import time
+import sqlite3
+from .logger import log_message
+from scripts.main.config_manager import get_from_config
+
+# Default location and lifetime of cached metadata, overridable from the config file
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser('~'), "kara-ok_cache", "metadata.sqlite")
+DEFAULT_TTL_SECONDS = 7 * 24 * 3600  # 7 days
+
+def cache_enabled():
+    return bool(get_from_config("metadata_cache_enabled", True))
+
+def cache_path():
+    return get_from_config("metadata_cache_path", DEFAULT_CACHE_PATH)
+
+def _connect():
+    path = cache_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Several processes (Unity may run lookups in parallel) share the file, wait for a writer instead of failing
+    connection = sqlite3.connect(path, timeout=10)
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS metadata (video_id TEXT PRIMARY KEY, result TEXT NOT NULL, fetched_at REAL NOT NULL)"
+    )
+    return connection
+
+def lookup_metadata(video_id, ttl_seconds=None):
+    """
+    Return the cached metadata result of the video, or None when it is missing or older than the TTL
+    (config key 'metadata_cache_ttl_seconds', 7 days by default).
+    """
+    if not video_id or not cache_enabled():
+        return None
+    if ttl_seconds is None:
+        ttl_seconds = float(get_from_config("metadata_cache_ttl_seconds", DEFAULT_TTL_SECONDS))
+
+    try:
+        connection = _connect()
+        try:
+            row = connection.execute("SELECT result, fetched_at FROM metadata WHERE video_id = ?", (video_id,)).fetchone()
+        finally:
+            connection.close()
+    except sqlite3.Error as e:
+        log_message(f"[Metadata cache] Lookup failed: {e}")
+        return None
+
+    if row is None or time.time() - row[1] > ttl_seconds:
+        return None
+    return json.loads(row[0])
+
+def store_metadata(video_id, result):
+    """
+    Store the metadata result of the video. A cache failure never fails the lookup.
+    """
+    if not video_id or not cache_enabled():
+        return
+    try:
+        connection = _connect()
+        try:
+            with connection:
+                connection.execute("INSERT OR REPLACE INTO metadata (video_id, result, fetched_at) VALUES (?, ?, ?)",
+                                   (video_id, json.dumps(result), time.time()))
+        finally:
+            connection.close()
+    except sqlite3.Error as e:
+        log_message(f"[Metadata cache] Store failed: {e}")
@@ -1,8 +1,10 @@
-﻿import yt_dlp
-import os
+﻿import os
 import json
 import re
 from .logger import log_message
+from .metadata_cache import lookup_metadata, store_metadata
+from .separation_cache import video_id_from_url
+from .thumbnail_cache import prefetch_thumbnail
 from scripts.main.config_manager import get_from_config
 
 def validate_json_data(result):
@@ -54,67 +56,123 @@ def extract_artist_title_from_title(title):
     return "Unknown Artist", title.strip()
 
 
-def get_song_metadata(youtube_url):
+# yt-dlp options of a metadata lookup
+METADATA_OPTIONS = {
+    'quiet': True,  # Suppress verbose output
+    'skip_download': True,  # Do not download the video, just extract metadata
+    'extract_flat': True,  # Avoid downloading any additional media (if it's a playlist)
+}
+
+def metadata_from_info(info_dict):
     """
-    Extract song metadata (artist, title, and a list of thumbnails) from a YouTube video using yt-dlp.
-    
-    :param youtube_url: The YouTube URL to extract metadata from.
-    :return: A dictionary containing artist, title, and a list of thumbnails.
+    Build the metadata result (artist, title, a list of thumbnails and the video id) from a yt-dlp info dictionary.
     """
-    ydl_opts = {
-        'quiet': True,  # Suppress verbose output
-        'skip_download': True,  # Do not download the video, just extract metadata
-        'extract_flat': True,  # Avoid downloading any additional media (if it's a playlist)
+    video_id = info_dict.get('id', None)
+    # Extract relevant metadata
+    title = info_dict.get('title', 'Unknown Title')
+    artist = info_dict.get('artist', 'Unknown Artist')
+
+    # Check if the artist is unknown, and try to extract it from the title
+    if artist == 'Unknown Artist':
+        artist, title = extract_artist_title_from_title(title)
+
+    # Extract all available thumbnails (YouTube may provide multiple resolutions)
+    thumbnails = info_dict.get('thumbnails', [])
+    thumbnail_urls = [thumbnail['url'] for thumbnail in thumbnails if thumbnail['url'].endswith((".jpg", ".jpeg"))]
+
+    # Sort and limit to the top 5 highest-quality thumbnails
+    thumbnail_urls = sorted(thumbnail_urls, key=lambda url: ('maxresdefault' in url, 'hq' in url), reverse=True)[:5]
+
+    # If the main thumbnail is a JPG, prioritize it by placing it at the top
+    main_thumbnail = info_dict.get('thumbnail')
+    if main_thumbnail and main_thumbnail.endswith(".jpg") and main_thumbnail not in thumbnail_urls:
+        thumbnail_urls.insert(0, main_thumbnail)
+
+    # Create a dictionary for JSON output
+    result = {
+        "artist": artist,
+        "title": title,
+        "thumbnails": thumbnail_urls,
+        "id": video_id
     }
 
-    try:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info_dict = ydl.extract_info(youtube_url, download=False)
-
-            video_id = info_dict.get('id', None)
-            # Extract relevant metadata
-            title = info_dict.get('title', 'Unknown Title')
-            artist = info_dict.get('artist', 'Unknown Artist')
+    # Validate the JSON structure
+    validate_json_data(result)
+    return result
 
-            # Check if the artist is unknown, and try to extract it from the title
-            if artist == 'Unknown Artist':
-                artist, title = extract_artist_title_from_title(title)
+def with_local_thumbnails(result):
+    """
+    Add 'local_thumbnails' to the metadata result: the paths of the best thumbnail resized for each use
+    (see thumbnail_cache), or an empty dictionary when it could not be cached.
 
-            # Extract all available thumbnails (YouTube may provide multiple resolutions)
-            thumbnails = info_dict.get('thumbnails', [])
-            thumbnail_urls = [thumbnail['url'] for thumbnail in thumbnails if thumbnail['url'].endswith((".jpg", ".jpeg"))]
+    :return: True if the local thumbnails were (re)fetched.
+    """
+    local_thumbnails = result.get("local_thumbnails")
+    if local_thumbnails and all(os.path.isfile(path) for path in local_thumbnails.values()):
+        return False
+    result["local_thumbnails"] = prefetch_thumbnail(result.get("thumbnails"))
+    return bool(result["local_thumbnails"])
 
-            # Sort and limit to the top 5 highest-quality thumbnails
-            thumbnail_urls = sorted(thumbnail_urls, key=lambda url: ('maxresdefault' in url, 'hq' in url), reverse=True)[:5]
+def cached_song_metadata(youtube_url):
+    """
+    Serve the metadata of the video from the metadata cache (see metadata_cache) without importing yt-dlp,
+    refreshing its local thumbnails when they are gone.
 
-            # If the main thumbnail is a JPG, prioritize it by placing it at the top
-            main_thumbnail = info_dict.get('thumbnail')
-            if main_thumbnail and main_thumbnail.endswith(".jpg") and main_thumbnail not in thumbnail_urls:
-                thumbnail_urls.insert(0, main_thumbnail)
+    :return: The cached metadata dictionary, or None on a cache miss.
+    """
+    cached = lookup_metadata(video_id_from_url(youtube_url))
+    if not cached:
+        return None
+    if with_local_thumbnails(cached):
+        # The thumbnail files were evicted or never cached
+        store_metadata(cached["id"], cached)
+    log_message(f"Using cached metadata for {youtube_url}")
+    print(f"Return Value: {json.dumps(cached)}")
+    return cached
+
+def extract_song_metadata(youtube_url, ydl=None):
+    """
+    Extract the metadata of the video with yt-dlp and store it in the metadata cache, without looking the cache up.
 
-            # Create a dictionary for JSON output
-            result = {
-                "artist": artist,
-                "title": title,
-                "thumbnails": thumbnail_urls,
-                "id": video_id
-            }
+    :param ydl: Optional YoutubeDL session to reuse (see metadata_batch), a new one is opened otherwise.
+    """
+    try:
+        if ydl is None:
+            # Imported here so that cache hits never pay for importing yt-dlp
+            import yt_dlp
+            with yt_dlp.YoutubeDL(METADATA_OPTIONS) as ydl:
+                info_dict = ydl.extract_info(youtube_url, download=False)
+        else:
+            info_dict = ydl.extract_info(youtube_url, download=False)
 
-            # Validate the JSON structure
-            validate_json_data(result)
+        result = metadata_from_info(info_dict)
+        with_local_thumbnails(result)
+        store_metadata(result["id"], result)
 
-            # Log the result
-            log_message(f"Extracted metadata from {youtube_url} -  json is: {json.dumps(result, indent=4)}")
+        # Log the result
+        log_message(f"Extracted metadata from {youtube_url} -  json is: {json.dumps(result, indent=4)}")
 
-            # Print the JSON formatted result
-            print(f"Return Value: {json.dumps(result)}")
+        # Print the JSON formatted result
+        print(f"Return Value: {json.dumps(result)}")
 
-            return result
+        return result
 
     except Exception as e:
         log_message(f"Failed to extract metadata: {e}")
         raise
 
+def get_song_metadata(youtube_url, ydl=None):
+    """
+    Extract song metadata (artist, title, and a list of thumbnails) from a YouTube video using yt-dlp,
+    and prefetch the best thumbnail into the local thumbnail cache.
+    Results are kept in the metadata cache (see metadata_cache), and a cache hit is served without importing yt-dlp.
+    
+    :param youtube_url: The YouTube URL to extract metadata from.
+    :param ydl: Optional YoutubeDL session to reuse (see metadata_batch), a new one is opened otherwise.
+    :return: A dictionary containing artist, title, a list of thumbnails and their local resized copies.
+    """
+    return cached_song_metadata(youtube_url) or extract_song_metadata(youtube_url, ydl)
+
 # Example usage:
 # metadata = get_song_metadata("https://www.youtube.com/watch?v=dQw4w9WgXcQ")
 # print(f"Metadata: {metadata}")
\ No newline at end of file
@@ -0,0 +1,209 @@
+import math
+
+# Length of the overlap between two consecutive segments, blended with a linear crossfade
+SEGMENT_CROSSFADE_SECONDS = 2.0
+# Separated samples are clamped to this peak, like the 'clamp' clip mode of the demucs CLI
+CLIP_LIMIT = 0.99
+
+def clip_samples(audio):
+    """
+    The clipping policy of every separation path, whole tracks included: samples are clamped to CLIP_LIMIT.
+    Rescaling like the default 'rescale' clip mode of the demucs CLI needs the peak of the whole track
+    before the first frame is written, which segmented, streamed and parallel separation do not know,
+    so clamping is the one policy that gives a song the same levels whichever path separates it.
+    """
+    return audio.clamp(-CLIP_LIMIT, CLIP_LIMIT)
+
+def plan_segments(total_frames, segment_frames, crossfade_frames):
+    """
+    Split a track into overlapping segments. Each segment overlaps the previous one by crossfade_frames.
+
+    :return: A list of (start_frame, length) tuples covering the whole track.
+    """
+    segment_frames = max(segment_frames, crossfade_frames * 2)
+    hop = segment_frames - crossfade_frames
+    segments = []
+    start = 0
+    while True:
+        length = min(segment_frames, total_frames - start)
+        segments.append((start, length))
+        if start + length >= total_frames:
+            return segments
+        start += hop
+
+def track_stats(audio_file_path, block_frames=1024 * 1024):
+    """
+    Mean and standard deviation of the mono mix of the track, computed in one streaming pass.
+    Used to normalize every segment with the same whole-track statistics the demucs CLI would use.
+    """
+    import soundfile
+    total = 0.0
+    total_squares = 0.0
+    count = 0
+    for block in soundfile.blocks(audio_file_path, blocksize=block_frames, dtype='float64', always_2d=True):
+        mono = block.mean(axis=1)
+        total += mono.sum()
+        total_squares += (mono ** 2).sum()
+        count += mono.shape[0]
+
+    if count == 0:
+        return 0.0, 1.0
+    mean = total / count
+    variance = max(total_squares / count - mean ** 2, 0.0)
+    return mean, math.sqrt(variance) or 1.0
+
+def track_frames(audio_file_path, samplerate):
+    """
+    Number of frames of the track once resampled to samplerate, read from the file header only.
+    """
+    import soundfile
+    info = soundfile.info(audio_file_path)
+    return int(info.frames * samplerate / info.samplerate)
+
+def read_segment(sound_file, start, length, samplerate, channels):
+    """
+    Read one segment, given in frames at the target samplerate, as a (channels, length) tensor.
+    Only the frames of this segment are read from disk.
+    """
+    import torch
+    from demucs.audio import convert_audio
+
+    ratio = sound_file.samplerate / samplerate
+    sound_file.seek(int(start * ratio))
+    data = sound_file.read(int(math.ceil(length * ratio)) + 1, dtype='float32', always_2d=True)
+    wav = torch.from_numpy(data.T.copy())
+    wav = convert_audio(wav, sound_file.samplerate, samplerate, channels)
+
+    if wav.shape[-1] < length:
+        wav = torch.nn.functional.pad(wav, (0, length - wav.shape[-1]))
+    return wav[..., :length]
+
+def decode_blocks(audio_file_path, ffmpeg_path, samplerate, channels, block_frames=1024 * 1024):
+    """
+    Decode any file ffmpeg can read (opus, m4a, webm, ...) through a pipe, without writing a WAV to disk.
+
+    :return: An iterator of (channels, frames) float32 tensors at samplerate, in track order.
+    """
+    import subprocess
+    import numpy
+    import torch
+
+    command = [ffmpeg_path, '-loglevel', 'error', '-i', audio_file_path, '-f', 'f32le', '-ac', str(channels),
+               '-ar', str(samplerate), 'pipe:1']
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stdin=subprocess.DEVNULL)
+    frame_bytes = channels * 4
+    finished = False
+    try:
+        while True:
+            data = process.stdout.read(block_frames * frame_bytes)
+            if not data:
+                break
+            data = data[:len(data) - len(data) % frame_bytes]
+            block = numpy.frombuffer(data, dtype='<f4').reshape(-1, channels).T
+            yield torch.from_numpy(block.copy())
+        finished = True
+    finally:
+        if not finished:
+            process.kill()
+        process.stdout.close()
+        return_code = process.wait()
+    if return_code != 0:
+        raise subprocess.CalledProcessError(return_code, command)
+
+def decode_to_wav(audio_file_path, ffmpeg_path, samplerate, channels, wav_path):
+    """
+    Decode any file ffmpeg can read to a float PCM WAV at samplerate, for readers that need to seek
+    (segments read by soundfile in other processes).
+    """
+    import subprocess
+    subprocess.run([ffmpeg_path, '-y', '-loglevel', 'error', '-i', audio_file_path, '-vn', '-acodec', 'pcm_f32le',
+                    '-ac', str(channels), '-ar', str(samplerate), wav_path], stdin=subprocess.DEVNULL, check=True)
+    return wav_path
+
+def stream_segments(blocks, segments):
+    """
+    Cut consecutive, overlapping segments out of a stream of blocks, keeping only the frames
+    that are still needed in memory.
+
+    :param blocks: An iterator of (channels, frames) tensors, as returned by decode_blocks.
+    :param segments: The (start_frame, length) tuples of plan_segments, in order.
+    :return: An iterator of (channels, length) tensors, zero padded if the stream ends early.
+    """
+    import torch
+
+    buffer = None
+    buffer_start = 0
+    blocks = iter(blocks)
+    for start, length in segments:
+        while buffer is None or buffer_start + buffer.shape[-1] < start + length:
+            block = next(blocks, None)
+            if block is None:
+                break
+            buffer = block if buffer is None else torch.cat([buffer, block], dim=-1)
+
+        if buffer is None:
+            return
+        # Drop what no later segment needs
+        if start > buffer_start:
+            buffer = buffer[..., start - buffer_start:]
+            buffer_start = start
+
+        wav = buffer[..., :length]
+        if wav.shape[-1] < length:
+            wav = torch.nn.functional.pad(wav, (0, length - wav.shape[-1]))
+        yield wav
+
+class CrossfadeStitcher:
+    """
+    Joins separated segments back together with a linear crossfade over their overlap and hands the
+    finished frames to the writers straight away, so only one segment plus one overlap is held in memory.
+    """
+
+    def __init__(self, writers, crossfade_frames):
+        """
+        :param writers: One callable per stem, called with a (channels, frames) tensor of finished audio.
+        :param crossfade_frames: The overlap between consecutive segments, as passed to plan_segments.
+        """
+        self.writers = writers
+        self.crossfade_frames = crossfade_frames
+        self._tail = None
+
+    def add(self, stems, is_last):
+        """
+        :param stems: A (stems, channels, frames) tensor for the next segment, in track order.
+        :param is_last: True for the last segment, which is written out completely.
+        """
+        import torch
+
+        if self._tail is not None:
+            blend = min(self._tail.shape[-1], stems.shape[-1])
+            fade_in = torch.linspace(0.0, 1.0, blend, dtype=stems.dtype)
+            stems = stems.clone()
+            stems[..., :blend] = self._tail[..., :blend] * (1.0 - fade_in) + stems[..., :blend] * fade_in
+
+        if is_last:
+            ready, self._tail = stems, None
+        else:
+            keep = min(self.crossfade_frames, stems.shape[-1])
+            ready, self._tail = stems[..., :stems.shape[-1] - keep], stems[..., stems.shape[-1] - keep:]
+
+        for writer, stem_audio in zip(self.writers, ready):
+            if stem_audio.shape[-1]:
+                writer(stem_audio)
+
+class WavFileSink:
+    """
+    A separation sink that appends (channels, frames) tensors to a 16-bit WAV file as they arrive.
+    Samples are clipped with clip_samples, like every other separation output.
+    """
+
+    def __init__(self, path, samplerate, channels):
+        import soundfile
+        self.path = path
+        self._file = soundfile.SoundFile(path, 'w', samplerate=samplerate, channels=channels, subtype='PCM_16')
+
+    def write(self, stem_audio):
+        self._file.write(clip_samples(stem_audio).t().contiguous().numpy())
+
+    def close(self):
+        self._file.close()
@@ -0,0 +1,168 @@
+import os
+import re
+import time
+import shutil
+import uuid
+from .logger import log_message
+from .cache_entries import read_entry, write_entry, evict_entries
+from scripts.main.config_manager import get_from_config
+
+# Default location and size of the separation cache, overridable from the config file
+DEFAULT_CACHE_FOLDER = os.path.join(os.path.expanduser('~'), "kara-ok_cache", "separation")
+DEFAULT_CACHE_MAX_BYTES = 10 * 1024 ** 3  # 10 GB
+
+YOUTUBE_ID_PATTERN = re.compile(r'(?:[?&]v=|youtu\.be/|/shorts/|/embed/|/live/)([A-Za-z0-9_-]{11})')
+
+def get_video_id(song_metadata):
+    """
+    Get the YouTube video id of a song without any network call.
+    Prefers an 'id' stored by the metadata provider in MetadataSources, and falls back to parsing the URL.
+
+    :param song_metadata: The song metadata dictionary loaded from the metadata JSON file.
+    :return: The video id, or None if it cannot be determined.
+    """
+    for source in song_metadata.get("MetadataSources") or []:
+        if isinstance(source, dict) and source.get("id"):
+            return source["id"]
+
+    return video_id_from_url(song_metadata.get("URL"))
+
+def video_id_from_url(youtube_url):
+    """
+    Parse the 11 character video id out of any of the YouTube URL forms (watch, youtu.be, shorts, embed, live).
+    """
+    match = YOUTUBE_ID_PATTERN.search(youtube_url or "")
+    return match.group(1) if match else None
+
+def cache_enabled():
+    return bool(get_from_config("separation_cache_enabled", True))
+
+def cache_folder():
+    return get_from_config("separation_cache_path", DEFAULT_CACHE_FOLDER)
+
+def _entry_folder(video_id, model, source_hash, shifts, overlap):
+    return os.path.join(cache_folder(), video_id, f"{model}_s{shifts}_o{overlap}_{source_hash[:16]}")
+
+def _copy_file(source, destination):
+    # Always a real copy, never a hard link: encoders overwrite their outputs in place (ffmpeg -y, WAV sinks
+    # truncate), which would otherwise rewrite the cached file through the shared inode
+    if os.path.lexists(destination):
+        os.remove(destination)
+    shutil.copy2(source, destination)
+
+def lookup_separation(video_id, model, shifts=None, overlap=None, source_hash=None):
+    """
+    Find a cached separation for the video, Demucs model and separation settings.
+
+    :param video_id: The YouTube video id.
+    :param model: The Demucs model name.
+    :param shifts: The Demucs shifts the entry was separated with, or None to accept any.
+    :param overlap: The Demucs overlap the entry was separated with, or None to accept any.
+    :param source_hash: Optional source audio hash. When given, only an entry with that exact source matches.
+    :return: The entry dictionary (with its 'folder'), or None on a miss.
+    """
+    if not video_id or not cache_enabled():
+        return None
+
+    video_folder = os.path.join(cache_folder(), video_id)
+    if not os.path.isdir(video_folder):
+        return None
+
+    best_entry = None
+    for name in os.listdir(video_folder):
+        entry_folder = os.path.join(video_folder, name)
+        entry = read_entry(entry_folder)
+        if not entry or entry.get("model") != model:
+            continue
+        # Entries stored without their settings may be degraded deadline results, they only match "any"
+        if shifts is not None and entry.get("shifts") != shifts:
+            continue
+        if overlap is not None and entry.get("overlap") != overlap:
+            continue
+        if source_hash and entry.get("source_hash") != source_hash:
+            continue
+        if not all(os.path.exists(os.path.join(entry_folder, f)) for f in entry.get("files", [])):
+            continue
+        if best_entry is None or entry.get("created", 0) > best_entry.get("created", 0):
+            entry["folder"] = entry_folder
+            best_entry = entry
+
+    return best_entry
+
+def restore_separation(entry, output_folder):
+    """
+    Restore the cached outputs of an entry into <output_folder>/<song_name> and mark the entry as recently used.
+
+    :return: The song outputs path.
+    """
+    song_outputs_path = os.path.join(output_folder, entry["song_name"])
+    os.makedirs(song_outputs_path, exist_ok=True)
+    for file_name in entry["files"]:
+        _copy_file(os.path.join(entry["folder"], file_name), os.path.join(song_outputs_path, file_name))
+
+    entry_folder = entry.pop("folder")
+    entry["last_used"] = time.time()
+    write_entry(entry_folder, entry)
+
+    log_message(f"[Cache] Restored {entry['video_id']} ({entry['model']}) to {song_outputs_path}")
+    return song_outputs_path
+
+def store_separation(video_id, model, shifts, overlap, source_hash, song_outputs_path, file_paths):
+    """
+    Store the outputs of a finished conversion in the cache, keyed by the model and the shifts and overlap
+    it was separated with, then evict old entries if needed.
+
+    :param file_paths: The files of song_outputs_path to keep, the stems and the final M4A files only
+                       (the song folder also holds the source audio, which the download cache already has).
+    """
+    if not video_id or not source_hash or not cache_enabled():
+        return None
+
+    entry_folder = _entry_folder(video_id, model, source_hash, shifts, overlap)
+    temp_folder = f"{entry_folder}.{uuid.uuid4().hex}.tmp"
+    os.makedirs(temp_folder)
+
+    try:
+        files = []
+        size = 0
+        for file_path in file_paths:
+            if os.path.isfile(file_path):
+                file_name = os.path.basename(file_path)
+                _copy_file(file_path, os.path.join(temp_folder, file_name))
+                files.append(file_name)
+                size += os.path.getsize(file_path)
+
+        now = time.time()
+        write_entry(temp_folder, {
+            "video_id": video_id,
+            "model": model,
+            "shifts": shifts,
+            "overlap": overlap,
+            "source_hash": source_hash,
+            "song_name": os.path.basename(os.path.normpath(song_outputs_path)),
+            "files": files,
+            "size": size,
+            "created": now,
+            "last_used": now,
+        })
+
+        if os.path.exists(entry_folder):
+            shutil.rmtree(entry_folder)
+        os.replace(temp_folder, entry_folder)
+    except Exception:
+        shutil.rmtree(temp_folder, ignore_errors=True)
+        raise
+
+    log_message(f"[Cache] Stored {video_id} ({model}) at {entry_folder}")
+    evict_separations()
+    return entry_folder
+
+def evict_separations(max_bytes=None):
+    """
+    Delete the least recently used entries until the cache fits in max_bytes
+    (config key 'separation_cache_max_bytes', 10 GB by default).
+    """
+    if max_bytes is None:
+        max_bytes = int(get_from_config("separation_cache_max_bytes", DEFAULT_CACHE_MAX_BYTES))
+
+    evict_entries(cache_folder(), max_bytes, "Cache")
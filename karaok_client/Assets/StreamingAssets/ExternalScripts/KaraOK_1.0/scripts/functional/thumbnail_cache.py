@@ -0,0 +1,159 @@
+import os
+import hashlib
+import subprocess
+import time
+import uuid
+from .logger import log_message
+from scripts.main.config_manager import get_from_config
+from files_utils import file_sha256
+from http_download import download_file
+
+# Default location of the thumbnail cache, overridable from the config file
+DEFAULT_CACHE_FOLDER = os.path.join(os.path.expanduser('~'), "kara-ok_cache", "thumbnails")
+# Width in pixels of every resized variant (config 'thumbnail_sizes'), never upscaled past the original
+DEFAULT_THUMBNAIL_SIZES = {"list": 320, "detail": 1280}
+JPEG_QUALITY = 3  # ffmpeg -q:v, 2 (best) to 31
+# Seconds before a thumbnail that could not be cached is tried again (config 'thumbnail_retry_seconds')
+DEFAULT_RETRY_SECONDS = 6 * 3600
+
+def cache_enabled():
+    return bool(get_from_config("thumbnail_cache_enabled", True))
+
+def cache_folder():
+    return get_from_config("thumbnail_cache_path", DEFAULT_CACHE_FOLDER)
+
+def _content_path(content_hash, variant):
+    # Files are addressed by the SHA-256 of the original image, spread over 256 subfolders
+    return os.path.join(cache_folder(), content_hash[:2], f"{content_hash}_{variant}.jpg")
+
+def _url_index_path(url):
+    return os.path.join(cache_folder(), "urls", hashlib.sha256(url.encode("utf-8")).hexdigest())
+
+def _failure_path(url):
+    return os.path.join(cache_folder(), "failed", hashlib.sha256(url.encode("utf-8")).hexdigest())
+
+def _retry_pending(url):
+    """
+    True while a failure to cache the image at url is recorded and its retry time has not come yet.
+    """
+    try:
+        with open(_failure_path(url), 'r') as failure_file:
+            retry_after = float(failure_file.read().strip())
+    except (OSError, ValueError):
+        return False
+    return time.time() < retry_after
+
+def _record_failure(url):
+    retry_seconds = float(get_from_config("thumbnail_retry_seconds", DEFAULT_RETRY_SECONDS))
+    failure_path = _failure_path(url)
+    try:
+        os.makedirs(os.path.dirname(failure_path), exist_ok=True)
+        with open(failure_path, 'w') as failure_file:
+            failure_file.write(str(time.time() + retry_seconds))
+    except OSError as e:
+        log_message(f"[Thumbnail cache] Could not record the failure of {url}: {e}")
+
+def _clear_failure(url):
+    try:
+        os.remove(_failure_path(url))
+    except OSError:
+        pass
+
+def _variant_paths(content_hash, sizes):
+    return {variant: _content_path(content_hash, variant) for variant in list(sizes) + ["original"]}
+
+def _lookup_url(url, sizes):
+    """
+    Return the cached variants of the image at url, or None unless every variant is on disk.
+    """
+    try:
+        with open(_url_index_path(url), 'r') as index_file:
+            content_hash = index_file.read().strip()
+    except OSError:
+        return None
+    paths = _variant_paths(content_hash, sizes)
+    return paths if all(os.path.isfile(path) for path in paths.values()) else None
+
+def _fetch_original(url):
+    """
+    Download the image at url into the cache under its content hash and index the URL to it.
+    Two URLs serving the same image share one set of files.
+    """
+    temp_path = os.path.join(cache_folder(), "tmp", f"{uuid.uuid4().hex}.jpg")
+    download_file(url, temp_path)
+    content_hash = file_sha256(temp_path)
+
+    original_path = _content_path(content_hash, "original")
+    os.makedirs(os.path.dirname(original_path), exist_ok=True)
+    os.replace(temp_path, original_path)
+
+    index_path = _url_index_path(url)
+    os.makedirs(os.path.dirname(index_path), exist_ok=True)
+    with open(index_path, 'w') as index_file:
+        index_file.write(content_hash)
+    return content_hash
+
+def _resize(ffmpeg_path, original_path, targets):
+    """
+    Decode the original once and write every resized variant in a single ffmpeg run.
+
+    :param targets: A list of (width, output_path) tuples.
+    """
+    command = [ffmpeg_path, '-y', '-loglevel', 'error', '-i', original_path]
+    temp_paths = []
+    for width, output_path in targets:
+        temp_path = f"{os.path.splitext(output_path)[0]}.{uuid.uuid4().hex}.tmp.jpg"
+        temp_paths.append((temp_path, output_path))
+        command += ['-vf', f"scale='min({width},iw)':-2", '-q:v', str(JPEG_QUALITY), '-frames:v', '1', temp_path]
+
+    try:
+        subprocess.run(command, check=True)
+        # Rename into place so readers never see a partial image
+        for temp_path, output_path in temp_paths:
+            os.replace(temp_path, output_path)
+    finally:
+        for temp_path, _ in temp_paths:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+def prefetch_thumbnail(thumbnail_urls):
+    """
+    Download the best thumbnail (the first of the list, see metadata_provider) once and store resized
+    variants of it next to the original, so the UI loads small local files instead of full-size remote images.
+
+    :param thumbnail_urls: The remote thumbnail URLs, best first.
+    :return: A dictionary of variant name ('list', 'detail', ..., 'original') -> local path, or {} when the
+             thumbnail could not be cached. A failure is recorded, and the download is not tried again for
+             'thumbnail_retry_seconds', so metadata cache hits never wait on an unreachable image.
+    """
+    if not thumbnail_urls or not cache_enabled():
+        return {}
+
+    url = thumbnail_urls[0]
+    sizes = get_from_config("thumbnail_sizes", DEFAULT_THUMBNAIL_SIZES)
+    cached = _lookup_url(url, sizes)
+    if cached:
+        return cached
+    if _retry_pending(url):
+        return {}
+
+    ffmpeg_path = get_from_config("ffmpeg_path")
+    if not ffmpeg_path:
+        log_message("[Thumbnail cache] FFmpeg path not set, thumbnails are not cached.")
+        return {}
+
+    try:
+        content_hash = _fetch_original(url)
+        paths = _variant_paths(content_hash, sizes)
+        missing = [(width, paths[variant]) for variant, width in sizes.items() if not os.path.isfile(paths[variant])]
+        if missing:
+            _resize(ffmpeg_path, paths["original"], missing)
+    except Exception as e:
+        # The remote URLs still work, a cache failure never fails the metadata lookup
+        log_message(f"[Thumbnail cache] Failed to cache {url}: {e}")
+        _record_failure(url)
+        return {}
+
+    _clear_failure(url)
+    log_message(f"[Thumbnail cache] Cached {url} as {content_hash}")
+    return paths
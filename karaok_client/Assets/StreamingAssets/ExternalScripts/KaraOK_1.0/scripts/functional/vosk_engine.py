@@ -0,0 +1,173 @@
+import json
+import threading
+import wave
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from .logger import log_message
+from scripts.main.config_manager import get_from_config
+
+# How many Vosk models may stay loaded at once before the least recently used one is released
+DEFAULT_MAX_RESIDENT_MODELS = 1
+# Recognizers of one model running at the same time (config 'vosk_recognizers'), they all share the model
+DEFAULT_RECOGNIZERS = 4
+# Frames fed to the recognizer per call
+FRAMES_PER_CHUNK = 4000
+SUPPORTED_FRAME_RATES = [8000, 16000, 44100]
+
+class VoskEngine:
+    """
+    Runs Vosk transcriptions inside the current process. Each model is loaded once and kept resident,
+    and every model has a pool of KaldiRecognizer instances that share it, so many tracks can be
+    transcribed at the same time without reading a multi-GB model per track.
+    Models are kept in least-recently-used order and released when more than max_resident_models are loaded.
+    """
+
+    def __init__(self, max_resident_models=None, max_recognizers=None):
+        if max_resident_models is None:
+            max_resident_models = int(get_from_config("vosk_max_resident_models", DEFAULT_MAX_RESIDENT_MODELS))
+        if max_recognizers is None:
+            max_recognizers = int(get_from_config("vosk_recognizers", DEFAULT_RECOGNIZERS))
+        self.max_resident_models = max(1, max_resident_models)
+        self.max_recognizers = max(1, max_recognizers)
+        self._models = OrderedDict()  # model path -> (model, semaphore bounding its recognizers)
+        self._idle_recognizers = {}  # (model path, frame rate) -> recognizers ready for reuse
+        self._load_locks = {}  # model path -> lock held while that model loads
+        self._lock = threading.Lock()
+
+    def _resident_entry(self, model_path):
+        # Called with self._lock held
+        if model_path in self._models:
+            self._models.move_to_end(model_path)
+            return self._models[model_path]
+        return None
+
+    def _get_entry(self, model_path):
+        with self._lock:
+            entry = self._resident_entry(model_path)
+            if entry:
+                return entry
+            load_lock = self._load_locks.setdefault(model_path, threading.Lock())
+
+        # Loading takes seconds to minutes: it only holds the lock of that model, so transcriptions with
+        # resident models go on, and threads asking for the same model wait for this load instead of repeating it
+        with load_lock:
+            with self._lock:
+                entry = self._resident_entry(model_path)
+                if entry:
+                    return entry
+
+            import vosk
+            log_message(f"[Vosk] Loading model '{model_path}'...")
+            entry = (vosk.Model(model_path), threading.BoundedSemaphore(self.max_recognizers))
+
+            with self._lock:
+                self._models[model_path] = entry
+                self._load_locks.pop(model_path, None)
+                while len(self._models) > self.max_resident_models:
+                    evicted_path, _ = self._models.popitem(last=False)
+                    for key in [key for key in self._idle_recognizers if key[0] == evicted_path]:
+                        del self._idle_recognizers[key]
+                    log_message(f"[Vosk] Released model '{evicted_path}'")
+            return entry
+
+    def get_model(self, model_path):
+        """
+        Return the resident model, loading it on first use and evicting the least recently used one if needed.
+        """
+        return self._get_entry(model_path)[0]
+
+    @contextmanager
+    def recognizer(self, model_path, frame_rate):
+        """
+        Lend a recognizer of the model for the frame rate, blocking while max_recognizers of that model are in use.
+        The recognizer is reset and returned to the pool afterwards.
+        """
+        model, semaphore = self._get_entry(model_path)
+        key = (model_path, frame_rate)
+        with semaphore:
+            with self._lock:
+                idle = self._idle_recognizers.get(key)
+                recognizer = idle.pop() if idle else None
+            if recognizer is None:
+                import vosk
+                recognizer = vosk.KaldiRecognizer(model, frame_rate)
+
+            try:
+                yield recognizer
+            finally:
+                recognizer.Reset()
+                with self._lock:
+                    # A model released meanwhile drops its recognizers with it
+                    if model_path in self._models:
+                        self._idle_recognizers.setdefault(key, []).append(recognizer)
+
+    def transcribe(self, vocal_track_path, model_path):
+        """
+        Transcribe a mono 16-bit WAV file and return the list of Vosk results, partial results included.
+        """
+        with wave.open(vocal_track_path, "rb") as wf:
+            if wf.getnchannels() != 1 or wf.getsampwidth() != 2 or wf.getframerate() not in SUPPORTED_FRAME_RATES:
+                raise ValueError("Unsupported audio format for Vosk. Use mono, 16-bit, and either 8000, 16000, or 44100 Hz. converting..,")
+
+            results = []
+            with self.recognizer(model_path, wf.getframerate()) as rec:
+                while True:
+                    data = wf.readframes(FRAMES_PER_CHUNK)
+                    if len(data) == 0:
+                        break
+                    if rec.AcceptWaveform(data):
+                        results.append(json.loads(rec.Result()))
+                    else:
+                        results.append(json.loads(rec.PartialResult()))
+        return results
+
+    def transcribe_many(self, vocal_track_paths, model_path):
+        """
+        Transcribe many tracks with the same model, up to max_recognizers at a time.
+
+        :return: One result per track, in the order of vocal_track_paths (a path given twice gets two results):
+                 {"success": True, "transcript": ...} or {"success": False, "error": ...}.
+        """
+        # Load the model before the workers start, so they do not all queue on the load
+        self.get_model(model_path)
+
+        def transcribe(path):
+            try:
+                return {"success": True, "transcript": self.transcribe(path, model_path)}
+            except Exception as e:
+                log_message(f"[Vosk] Failed to transcribe {path}: {e}")
+                return {"success": False, "error": str(e)}
+
+        with ThreadPoolExecutor(max_workers=self.max_recognizers, thread_name_prefix="vosk") as pool:
+            futures = [pool.submit(transcribe, path) for path in vocal_track_paths]
+        return [future.result() for future in futures]
+
+    def release(self, model_path=None):
+        """
+        Release one model, or every model when model_path is None, together with its recognizers.
+        """
+        with self._lock:
+            if model_path is None:
+                self._models.clear()
+                self._idle_recognizers.clear()
+            else:
+                self._models.pop(model_path, None)
+                for key in [key for key in self._idle_recognizers if key[0] == model_path]:
+                    del self._idle_recognizers[key]
+
+    def loaded_models(self):
+        return list(self._models)
+
+_engine = None
+_engine_lock = threading.Lock()
+
+def get_vosk_engine():
+    """
+    Return the process wide VoskEngine, creating it on first use.
+    """
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = VoskEngine()
+        return _engine
@@ -1,14 +1,46 @@
-import yt_dlp
 import os
 from .logger import log_message
+from .download_cache import lookup_download, restore_download, store_download, wait_for_prefetch
+from .separation_cache import get_video_id
 from scripts.main.config_manager import get_from_config
 
-def download_audio_from_youtube(song_metadata, output_folder):
+# Download formats (config 'download_audio_format'): "native" keeps the container YouTube serves (opus/m4a),
+# which Demucs decodes directly, "wav" transcodes to WAV after the download like before
+NATIVE_AUDIO_FORMAT = "native"
+WAV_AUDIO_FORMAT = "wav"
+
+def get_audio_file_name(song_metadata):
+    return f'{song_metadata["Artist"]} - {song_metadata["Title"]}'
+
+def download_options(ffmpeg_path, audio_format, outtmpl):
+    """
+    The yt-dlp options of an audio download in the given format ("native" or "wav").
+    """
+    ydl_opts = {
+        'format': 'bestaudio/best',
+        'outtmpl': outtmpl,
+        'ffmpeg_location': ffmpeg_path,  # Use the ffmpeg path from config
+    }
+    if audio_format == WAV_AUDIO_FORMAT:
+        ydl_opts['postprocessors'] = [{
+            'key': 'FFmpegExtractAudio',
+            'preferredcodec': 'wav',
+            'preferredquality': '192',
+        }]
+    return ydl_opts
+
+def download_audio_from_youtube(song_metadata, output_folder, audio_format=None):
     """
-    Download audio from a YouTube URL and save it as an WAV file in the specified folder.
+    Download audio from a YouTube URL into the specified folder.
+    By default the audio keeps its native container, so there is no transcoding pass and no large WAV on disk;
+    WAV output is only produced when asked for explicitly.
+    Downloads are kept in the download cache (see download_cache), which is checked before going to the network,
+    after waiting for a prefetch of the same video (see audio_prefetch) that is still running.
     
-    :param youtube_url: The YouTube URL to download.
+    :param song_metadata: The song metadata, with the "Artist", "Title" and YouTube "URL".
     :param output_folder: The folder where the audio file will be saved.
+    :param audio_format: "native" or "wav", defaults to the config key 'download_audio_format'.
+    :return: The path of the downloaded audio file.
     """
     
     # Retrieve the ffmpeg path from the configuration
@@ -16,30 +48,55 @@ def download_audio_from_youtube(song_metadata, output_folder):
     print(f"ffmpeg_path: {ffmpeg_path}")
     if not ffmpeg_path:
         raise ValueError("FFmpeg path not set. Please run 'smule.py --init' to configure the environment.")
-    artist = song_metadata["Artist"]
-    title = song_metadata["Title"]
+    if audio_format is None:
+        audio_format = get_from_config("download_audio_format", NATIVE_AUDIO_FORMAT)
     youtube_url = song_metadata["URL"]
-    audio_file_name = f'{artist} - {title}'
+    audio_file_name = get_audio_file_name(song_metadata)
+
+    # Reuse the audio downloaded by a previous conversion of this video, e.g. with another Demucs model
+    video_id = get_video_id(song_metadata)
+    wait_for_prefetch(video_id, audio_format)
+    cached = lookup_download(video_id, audio_format)
+    if cached:
+        return restore_download(cached, output_folder, audio_file_name)
+
     # YT-DLP options
-    ydl_opts = {
-        'format': 'bestaudio/best',
-        'outtmpl': os.path.join(output_folder, audio_file_name+'.%(ext)s'),
-        'ffmpeg_location': ffmpeg_path,  # Use the ffmpeg path from config
-        'postprocessors': [{
-            'key': 'FFmpegExtractAudio',
-            'preferredcodec': 'wav',
-            'preferredquality': '192',
-        }],
-    }
+    ydl_opts = download_options(ffmpeg_path, audio_format, os.path.join(output_folder, audio_file_name+'.%(ext)s'))
+
+    # Imported here so that cache hits never pay for importing yt-dlp
+    import yt_dlp
 
     try:
         # Use yt-dlp to download
         with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            ydl.download([youtube_url])
+            info = ydl.extract_info(youtube_url, download=True)
+            audio_file_path = downloaded_file_path(ydl, info)
         log_message(f"Downloaded audio from {youtube_url}")
     except Exception as e:
         log_message(f"Failed to download audio: {e}")
         raise
 
-    # Find the downloaded wav
-    return os.path.join(output_folder, audio_file_name+".wav")
\ No newline at end of file
+    if audio_format == WAV_AUDIO_FORMAT:
+        # Find the downloaded wav
+        audio_file_path = os.path.join(output_folder, audio_file_name+".wav")
+
+    cache_download(video_id, audio_format, audio_file_path)
+    return audio_file_path
+
+def cache_download(video_id, audio_format, audio_file_path):
+    """
+    Keep a fresh download in the download cache. A cache failure never fails the download.
+    """
+    try:
+        store_download(video_id, audio_format, audio_file_path)
+    except Exception as e:
+        log_message(f"Failed to store the download in the download cache: {e}")
+
+def downloaded_file_path(ydl, info):
+    """
+    The path of the file yt-dlp wrote for info, in whatever container the chosen format uses.
+    """
+    requested_downloads = info.get('requested_downloads') or []
+    if requested_downloads and requested_downloads[0].get('filepath'):
+        return requested_downloads[0]['filepath']
+    return ydl.prepare_filename(info)
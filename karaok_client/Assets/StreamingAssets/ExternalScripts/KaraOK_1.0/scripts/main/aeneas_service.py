@@ -2,7 +2,6 @@
 import argparse
 import subprocess
 import sys
-import moviepy.editor as mp
 from aeneas.executetask import ExecuteTask
 from aeneas.task import Task
 from aeneas.tools.execute_task import ExecuteTaskCLI
@@ -94,6 +93,9 @@ def generate_lyrics_video(instrumental_track_path, srt_file_path, output_video_p
     :param srt_file_path: Path to the synchronized subtitle file (srt)
     :param output_video_path: Path where the generated video will be saved
     """
+    # Imported here, moviepy takes longer to import than the rest of the service to run
+    import moviepy.editor as mp
+
     # Create a blank video with lyrics
     video = mp.ColorClip(size=(1280, 720), color=(0, 0, 0), duration=mp.AudioFileClip(instrumental_track_path).duration)
     
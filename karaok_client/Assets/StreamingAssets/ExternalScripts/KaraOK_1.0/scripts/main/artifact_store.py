@@ -0,0 +1,127 @@
+# artifact_store.py (Local store of install artifacts: a wheelhouse and checksummed binary archives)
+import os
+import re
+import subprocess
+import urllib.parse
+from scripts.main.config_manager import get_from_config
+from scripts.main.environment import venv_python_path
+from scripts.main.http_download import download_file
+from files_utils import file_sha256
+
+# Default location of the store (config 'artifact_store_path'). Point it at a shared folder to provision
+# many machines from one download.
+DEFAULT_STORE_FOLDER = os.path.join(os.path.expanduser('~'), "kara-ok_cache", "artifacts")
+CHECKSUM_SUFFIX = ".sha256"
+
+def store_folder():
+    return get_from_config("artifact_store_path", DEFAULT_STORE_FOLDER)
+
+def wheelhouse_folder():
+    return os.path.join(store_folder(), "wheels")
+
+def archives_folder():
+    return os.path.join(store_folder(), "archives")
+
+def offline_only():
+    """
+    With the config key 'offline_install' set, installs only use what is already in the store.
+    """
+    return bool(get_from_config("offline_install", False))
+
+def _read_checksum(archive_path):
+    try:
+        with open(archive_path + CHECKSUM_SUFFIX, 'r') as checksum_file:
+            return checksum_file.read().strip() or None
+    except OSError:
+        return None
+
+def fetch_archive(url, expected_sha256=None):
+    """
+    Return the path of the archive at url in the store, downloading it only when it is not there yet.
+    The SHA-256 of every stored archive is recorded next to it and checked on each reuse, against
+    expected_sha256 when given, so a corrupt or substituted archive is never installed.
+
+    :return: The path of the archive in the store.
+    """
+    archive_path = os.path.join(archives_folder(), os.path.basename(urllib.parse.urlparse(url).path))
+
+    if os.path.exists(archive_path):
+        expected = (expected_sha256 or _read_checksum(archive_path) or "").lower()
+        if expected and file_sha256(archive_path) == expected:
+            print(f"[Artifacts] Using stored {archive_path}")
+            return archive_path
+        print(f"[Artifacts] Stored {archive_path} does not match its checksum, fetching it again")
+        os.remove(archive_path)
+
+    if offline_only():
+        raise FileNotFoundError(f"[Artifacts] {url} is not in the artifact store at {store_folder()} and offline_install is set")
+
+    download_file(url, archive_path, expected_sha256=expected_sha256)
+    with open(archive_path + CHECKSUM_SUFFIX, 'w') as checksum_file:
+        checksum_file.write(file_sha256(archive_path))
+    return archive_path
+
+def seed_wheels(venv_path, requirements):
+    """
+    Build or download wheels of the requirements and all of their dependencies into the wheelhouse,
+    with the interpreter of the virtual environment so they match its Python version and platform.
+    Requirements already in the wheelhouse are taken from it.
+    """
+    wheelhouse = wheelhouse_folder()
+    os.makedirs(wheelhouse, exist_ok=True)
+    venv_python = venv_python_path(venv_path)
+    print(f"[Artifacts] Filling the wheelhouse at {wheelhouse} with {', '.join(requirements)}")
+    subprocess.run([venv_python, "-m", "pip", "wheel", "--disable-pip-version-check", "--wheel-dir", wheelhouse,
+                    "--find-links", wheelhouse] + requirements, check=True)
+
+def _normalize_name(name):
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+def stored_wheels():
+    """
+    The (name, version) pairs of the wheels in the wheelhouse, with names normalized as pip compares them.
+    """
+    wheelhouse = wheelhouse_folder()
+    if not os.path.isdir(wheelhouse):
+        return set()
+    # Wheel file names are <name>-<version>-<tags>.whl, with '-' in the name escaped as '_'
+    return {(_normalize_name(file_name.split("-")[0]), file_name.split("-")[1])
+            for file_name in os.listdir(wheelhouse) if file_name.endswith(".whl") and file_name.count("-") >= 4}
+
+def missing_wheels(requirements):
+    """
+    The pinned 'name==version' requirements that have no wheel in the wheelhouse yet.
+    """
+    stored = stored_wheels()
+    missing = []
+    for requirement in requirements:
+        name, _, version = requirement.partition("==")
+        if (_normalize_name(name), version) not in stored:
+            missing.append(requirement)
+    return missing
+
+def _pip_install_from_wheelhouse(venv_path, requirements):
+    venv_python = venv_python_path(venv_path)
+    return subprocess.run([venv_python, "-m", "pip", "install", "--disable-pip-version-check", "--no-index",
+                           "--find-links", wheelhouse_folder()] + requirements).returncode
+
+def install_wheels(venv_path, requirements):
+    """
+    Install the requirements from the wheelhouse only. Requirements without a wheel there are seeded first,
+    unless offline_install is set, so an install from a filled wheelhouse never touches the network.
+    When a dependency of a stored wheel turns out to be missing, the wheelhouse is seeded with every
+    requirement and the install runs once more. Every machine installing from the same wheelhouse gets
+    the same files.
+    """
+    offline = offline_only()
+    missing = missing_wheels(requirements)
+    if missing and not offline:
+        seed_wheels(venv_path, missing)
+
+    return_code = _pip_install_from_wheelhouse(venv_path, requirements)
+    if return_code != 0 and not offline:
+        print("[Artifacts] The wheelhouse is missing dependencies, filling it with every requirement")
+        seed_wheels(venv_path, requirements)
+        return_code = _pip_install_from_wheelhouse(venv_path, requirements)
+    if return_code != 0:
+        raise subprocess.CalledProcessError(return_code, f"pip install {' '.join(requirements)}")
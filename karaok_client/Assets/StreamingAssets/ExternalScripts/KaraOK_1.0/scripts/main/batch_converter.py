@@ -0,0 +1,198 @@
+# batch_converter.py (Converts many songs with the pipeline stages overlapping)
+import os
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from scripts.functional.batch_downloader import BatchDownloader
+from scripts.functional.logger import log_message
+from scripts.functional.report import print_report
+from scripts.main.config_manager import get_from_config
+from scripts.main.converter import (
+    temp_output_path, get_demucs_model, stem_paths, stream_encode_enabled, start_job, run_stream_stage, cached_stage,
+    separate_stage, move_stage, encode_stage, cache_stage, default_plan
+)
+from scripts.main.job_checkpoint import run_checkpointed
+from files_utils import load_json_file
+
+# Default number of concurrent jobs per stage, overridable from the config file
+DEFAULT_STAGE_LIMITS = {
+    "download": 2,  # Network-bound
+    "separate": 1,  # CPU-bound, Demucs already uses several cores
+    "encode": 2,    # Encode-bound (move + ffmpeg)
+}
+
+def get_stage_limits():
+    """
+    Read the per-stage concurrency limits from the config ('batch_<stage>_workers'), falling back to the defaults.
+    """
+    limits = {}
+    for stage, default_limit in DEFAULT_STAGE_LIMITS.items():
+        value = get_from_config(f"batch_{stage}_workers", default_limit)
+        limits[stage] = max(1, int(value))
+    return limits
+
+def load_batch_manifest(manifest_path):
+    """
+    Load the list of metadata JSON paths from a batch manifest.
+    The manifest is either a JSON list of paths or a JSON object with a "metadata_paths" list.
+    Relative paths are resolved against the manifest folder.
+    """
+    manifest = load_json_file(manifest_path)
+    if isinstance(manifest, dict):
+        manifest = manifest.get("metadata_paths")
+    if not isinstance(manifest, list):
+        raise ValueError(f"Invalid batch manifest at {manifest_path}. Expected a list of metadata paths.")
+
+    manifest_dir = os.path.dirname(os.path.abspath(manifest_path))
+    return [path if os.path.isabs(path) else os.path.join(manifest_dir, path) for path in manifest]
+
+class BatchPipeline:
+    """
+    Runs download -> separate -> move/encode for many songs, one thread pool per stage.
+    A song moves to the next stage as soon as its previous stage finishes, so while song N is
+    being separated, song N+1 can be downloading and song N-1 can be encoding.
+    """
+
+    def __init__(self, output_folder, demucs_model, stage_limits):
+        self.output_folder = output_folder
+        self.demucs_model = demucs_model
+        self.temp_output_folder = temp_output_path()
+        # The download threads each keep one YoutubeDL session across the songs they download
+        self.downloader = BatchDownloader(os.path.join(self.temp_output_folder, "downloads"),
+                                          max_workers=stage_limits["download"])
+        self._pools = {
+            stage: ThreadPoolExecutor(max_workers=limit, thread_name_prefix=f"batch-{stage}")
+            for stage, limit in stage_limits.items()
+        }
+        self._results = {}
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._all_done = threading.Condition(self._lock)
+
+    def submit(self, metadata_path):
+        with self._lock:
+            self._pending += 1
+        self._pools["download"].submit(self._run_stage, metadata_path, "download", self._download)
+
+    def wait(self):
+        """
+        Block until every submitted song finished or failed, then shut the pools down and return the results.
+        """
+        with self._all_done:
+            while self._pending:
+                self._all_done.wait()
+        for pool in self._pools.values():
+            pool.shutdown(wait=True)
+        self.downloader.close()
+        return self._results
+
+    def _run_stage(self, metadata_path, stage, func, *args):
+        try:
+            func(metadata_path, *args)
+        except Exception as e:
+            log_message(f"[Batch] {stage} failed for {metadata_path}: {e}")
+            self._finish(metadata_path, {"success": False, "stage": stage, "error": str(e)})
+
+    def _next(self, stage, metadata_path, func, *args):
+        self._pools[stage].submit(self._run_stage, metadata_path, stage, func, *args)
+
+    def _download(self, metadata_path):
+        song_metadata = load_json_file(metadata_path)
+        if song_metadata is None:
+            raise ValueError(f"Could not load metadata from {metadata_path}")
+
+        cached = cached_stage(song_metadata, self.demucs_model, self.output_folder)
+        if cached:
+            song_outputs_path, m4a_file_path = cached
+            print_report({song_metadata["URL"]}, True, True, m4a_file_path, 0)
+            self._finish(metadata_path, {"success": True, "output_path": song_outputs_path, "cached": True})
+            return
+
+        job = start_job(song_metadata, self.demucs_model, self.output_folder, self.temp_output_folder)
+        checkpoint, done = job
+        log_message(f"[Batch] Downloading {song_metadata['URL']}")
+        audio_file_path = run_checkpointed(checkpoint, done, "download", lambda path: [path],
+                                           self.downloader.download_one, song_metadata, checkpoint.folder)
+        log_message(f"Downloaded file: {audio_file_path}")
+        self._next("separate", metadata_path, self._separate, song_metadata, job, audio_file_path)
+
+    def _separate(self, metadata_path, song_metadata, job, audio_file_path):
+        checkpoint, done = job
+        if stream_encode_enabled():
+            # Separation feeds the encoders directly, so there is no separate encode stage to hand over to
+            song_outputs_path, m4a_file_path = run_stream_stage(checkpoint, done, audio_file_path, self.demucs_model,
+                                                                self.output_folder)
+            self._complete(metadata_path, song_metadata, job, audio_file_path, song_outputs_path, m4a_file_path)
+            return
+
+        demucs_outputs = run_checkpointed(checkpoint, done, "separate", stem_paths,
+                                          separate_stage, audio_file_path, checkpoint.folder, self.demucs_model)
+        self._next("encode", metadata_path, self._encode, song_metadata, job, audio_file_path, demucs_outputs)
+
+    def _encode(self, metadata_path, song_metadata, job, audio_file_path, demucs_outputs):
+        checkpoint, done = job
+        song_outputs_path = run_checkpointed(checkpoint, done, "move", stem_paths,
+                                             move_stage, audio_file_path, demucs_outputs, self.output_folder)
+        m4a_file_path = run_checkpointed(checkpoint, done, "encode", lambda path: [path],
+                                         encode_stage, song_outputs_path)
+        self._complete(metadata_path, song_metadata, job, audio_file_path, song_outputs_path, m4a_file_path)
+
+    def _complete(self, metadata_path, song_metadata, job, audio_file_path, song_outputs_path, m4a_file_path):
+        checkpoint, _ = job
+        source_hash = checkpoint.artifact_hash("download", audio_file_path)
+        checkpoint.clear()
+        # Every batch stage separates with the default shifts and overlap
+        cache_stage(song_metadata, default_plan(self.demucs_model), source_hash, song_outputs_path)
+        print_report({song_metadata["URL"]}, True, True, m4a_file_path, 0)
+        self._finish(metadata_path, {"success": True, "output_path": song_outputs_path})
+
+    def _finish(self, metadata_path, result):
+        with self._all_done:
+            self._results[metadata_path] = result
+            self._pending -= 1
+            self._all_done.notify_all()
+
+def convert_batch(manifest_path, output_folder, model_int=2):
+    """
+    Convert every song listed in the batch manifest with overlapping pipeline stages.
+    Prints the per-song results as the return value and returns them.
+    """
+    metadata_paths = load_batch_manifest(manifest_path)
+    demucs_model = get_demucs_model(model_int)
+    stage_limits = get_stage_limits()
+    log_message(f"[Batch] Converting {len(metadata_paths)} songs with model {demucs_model}, stage limits: {stage_limits}")
+
+    pipeline = BatchPipeline(output_folder, demucs_model, stage_limits)
+    for metadata_path in metadata_paths:
+        pipeline.submit(metadata_path)
+    results = pipeline.wait()
+
+    failed = [path for path, result in results.items() if not result["success"]]
+    log_message(f"[Batch] Finished: {len(results) - len(failed)} succeeded, {len(failed)} failed.")
+    print(f"Return Value: {json.dumps(results)}")
+    return results
+
+def download_batch(manifest_path, output_folder):
+    """
+    Download the audio of every song listed in the batch manifest into output_folder, a few at a time
+    over reused YoutubeDL sessions. Prints the per-song results, in manifest order, as the return value
+    and returns them.
+    """
+    songs = []
+    for metadata_path in load_batch_manifest(manifest_path):
+        song_metadata = load_json_file(metadata_path)
+        if song_metadata is None:
+            raise ValueError(f"Could not load metadata from {metadata_path}")
+        songs.append((song_metadata, output_folder))
+
+    downloader = BatchDownloader(os.path.join(temp_output_path(), "downloads"))
+    log_message(f"[Batch] Downloading {len(songs)} songs, {downloader.max_workers} at a time")
+    try:
+        results = downloader.download_many(songs)
+    finally:
+        downloader.close()
+
+    failed = [result["url"] for result in results if not result["success"]]
+    log_message(f"[Batch] Finished: {len(results) - len(failed)} downloaded, {len(failed)} failed.")
+    print(f"Return Value: {json.dumps(results)}")
+    return results
@@ -1,50 +1,152 @@
 ﻿import os
+import copy
 import json
+import threading
+import uuid
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
 
 
 # Always set the path to the config file inside the user's root directory
 CONFIG_FILE_PATH = os.path.join(os.path.expanduser("~"), "karaok_config", "smule_config.json")
+# Advisory lock taken around every write, shared by all the processes using the config
+CONFIG_LOCK_PATH = CONFIG_FILE_PATH + ".lock"
 
 # Ensure the directory exists
 os.makedirs(os.path.dirname(CONFIG_FILE_PATH), exist_ok=True)
 
-def load_config():
-    """
-    Load the configuration from the default configuration file.
-    If the config file doesn't exist, return an empty dictionary.
-    """
+# The parsed config and the (mtime, size, inode) of the file it was parsed from.
+# Writes replace the file with a new one, so the inode changes even when the mtime resolution is coarse.
+_cached_config = None
+_cached_signature = None
+_cache_lock = threading.Lock()
+_write_lock = threading.Lock()
+
+def _file_signature():
+    try:
+        stat = os.stat(CONFIG_FILE_PATH)
+    except FileNotFoundError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+def _read_config_file():
     print(f"Loading config from: {CONFIG_FILE_PATH}")
     if os.path.exists(CONFIG_FILE_PATH):
         with open(CONFIG_FILE_PATH, 'r') as config_file:
             return json.load(config_file)
     return {}
 
-def save_config(config_data):
+def _cached():
+    """
+    Return the parsed config, parsing the file again only when it changed since the last call.
+    """
+    global _cached_config, _cached_signature
+    with _cache_lock:
+        signature = _file_signature()
+        if _cached_config is None or signature != _cached_signature:
+            _cached_config = _read_config_file()
+            _cached_signature = signature
+        return _cached_config
+
+@contextmanager
+def _locked_config():
     """
-    Save the configuration data to the default configuration file.
+    Hold the advisory config lock, so a read-modify-write from another thread or process cannot interleave.
     """
+    with _write_lock:
+        with open(CONFIG_LOCK_PATH, 'a+') as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+                else:
+                    lock_file.seek(0)
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+def _write_config_file(config_data):
+    # Write to a temp file and rename it over the config, so readers never see a partial file
+    global _cached_config, _cached_signature
     print(f"Saving config to: {CONFIG_FILE_PATH}")
-    with open(CONFIG_FILE_PATH, 'w') as config_file:
-        json.dump(config_data, config_file, indent=4)
+    temp_path = f"{CONFIG_FILE_PATH}.{uuid.uuid4().hex}.tmp"
+    try:
+        with open(temp_path, 'w') as config_file:
+            json.dump(config_data, config_file, indent=4)
+            config_file.flush()
+            os.fsync(config_file.fileno())
+        os.replace(temp_path, CONFIG_FILE_PATH)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+    with _cache_lock:
+        _cached_config = copy.deepcopy(config_data)
+        _cached_signature = _file_signature()
+
+def load_config():
+    """
+    Load the configuration from the default configuration file.
+    If the config file doesn't exist, return an empty dictionary.
+    The file is only parsed again when it changed, the caller gets its own copy.
+    """
+    return copy.deepcopy(_cached())
+
+def save_config(config_data):
+    """
+    Save the configuration data to the default configuration file, atomically and under the config lock.
+    """
+    with _locked_config():
+        _write_config_file(config_data)
 
 def set_to_config(key, value):
     """
     Set a key-value pair in the config file and update it.
+    The file is re-read under the config lock, so keys set concurrently by other processes are kept.
     
     :param key: The key to set in the configuration.
     :param value: The value to associate with the key.
     """
-    # Load the existing config
-    config_data = load_config()
+    with _locked_config():
+        # Load the existing config
+        config_data = _read_config_file()
 
-    # Set the new key-value pair
-    config_data[key] = value
+        # Set the new key-value pair
+        config_data[key] = value
 
-    # Save the updated config back to the file
-    save_config(config_data)
+        # Save the updated config back to the file
+        _write_config_file(config_data)
 
     print(f"Updated config: Set {key} to {value}")
 
+def update_config(key, update, default_value=None):
+    """
+    Read-modify-write one key of the config file atomically: update is called with the current value
+    (default_value when the key is missing) and its return value is stored, all under the config lock,
+    so concurrent updates from other threads or processes are never lost.
+
+    :param key: The key to update in the configuration.
+    :param update: A function of the current value returning the new value. It gets its own copy to modify.
+    :return: The new value.
+    """
+    with _locked_config():
+        config_data = _read_config_file()
+        value = update(copy.deepcopy(config_data.get(key, default_value)))
+        config_data[key] = value
+        _write_config_file(config_data)
+
+    print(f"Updated config: Set {key} to {value}")
+    return value
+
 def sanitize_value(value):
     """
     Sanitize the value by wrapping it with double quotes if it contains spaces.
@@ -66,10 +168,8 @@ def get_from_config(key, default_value=None):
     :param default_value: The value to return if the key is not found (default: None).
     :return: The value associated with the key or the default value if not found.
     """
-    # Load the existing config
-    config_data = load_config()
-
-    # Get the value associated with the key, or the default value if the key is not found
-    value = config_data.get(key, default_value)
+    # Get the value associated with the key, or the default value if the key is not found.
+    # Copied, so a caller changing a list or dictionary value cannot change the cached config.
+    value = _cached().get(key, default_value)
 
-    return value
\ No newline at end of file
+    return copy.deepcopy(value)
\ No newline at end of file
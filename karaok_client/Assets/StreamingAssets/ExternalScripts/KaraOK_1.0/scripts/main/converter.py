@@ -1,10 +1,15 @@
 # converter.py (Handles the conversion process)
 from scripts.functional.youtube_downloader import download_audio_from_youtube
-from scripts.functional.audio_processing import separate_vocals, convert_wav_to_m4a
+from scripts.functional.audio_processing import separate_vocals, convert_wavs_to_m4a, separate_and_encode
 from scripts.functional.logger import log_message
 from scripts.functional.report import print_report
+from scripts.functional.separation_cache import get_video_id, lookup_separation, restore_separation, store_separation
+from scripts.main.job_checkpoint import JobCheckpoint, job_folder_path, run_checkpointed
+from scripts.main.time_budget import track_duration, choose_separation_settings, record_separation_time
+from scripts.main.config_manager import get_from_config
 from files_utils import move, load_json_file  # Import the new move function
 import os
+import time
 
 # Demucs models mapping
 DEMUCS_MODELS = {
@@ -14,6 +19,15 @@ DEMUCS_MODELS = {
     4: "mdx_extra_q"    # Slowest
 }
 
+# Checkpointed stages of a conversion job, in pipeline order. The 'plan' stage only runs with a deadline.
+CONVERT_STAGES = ("download", "plan", "separate", "move", "encode")
+# Stages when the separated audio is piped straight into the encoders (config 'stream_to_encoder')
+STREAM_STAGES = ("download", "plan", "separate_encode")
+
+# Demucs settings used when no deadline is given, the same as the demucs CLI defaults
+DEFAULT_SHIFTS = 1
+DEFAULT_OVERLAP = 0.25
+
 def temp_output_path():
     """
     Verifies if the demucs_temp path exists, and creates it if it does not.
@@ -39,11 +53,240 @@ def temp_output_path():
 
     return demucs_temp_path
 
-def convert(metadata_path, output_folder, model_int=2):
+def get_demucs_model(model_int):
+    """
+    Parse the model integer into the Demucs model name, defaulting to "htdemucs_ft" if invalid.
+    """
+    return DEMUCS_MODELS.get(model_int, "htdemucs_ft")
+
+def default_plan(demucs_model):
+    return {"model": demucs_model, "shifts": DEFAULT_SHIFTS, "overlap": DEFAULT_OVERLAP}
+
+def deadline_models(model_int):
+    """
+    The models a deadline job may use, from the requested one down to the fastest.
+    """
+    if model_int not in DEMUCS_MODELS:
+        model_int = 2
+    return [DEMUCS_MODELS[m] for m in sorted(DEMUCS_MODELS, reverse=True) if m <= model_int]
+
+def job_model_key(demucs_model, deadline=None):
+    """
+    The model part of the job folder key. Deadline jobs may separate with another model, so they get their own jobs.
+    """
+    return demucs_model if deadline is None else f"{demucs_model}@deadline"
+
+def stem_paths(folder):
+    """
+    Paths of the two stems Demucs writes with --two-stems=vocals.
+    """
+    return [os.path.join(folder, "vocals.wav"), os.path.join(folder, "no_vocals.wav")]
+
+def cacheable_outputs(song_outputs_path):
+    """
+    The stems and M4A files of a finished conversion, without the source audio that shares the song folder.
+    """
+    song_name = os.path.basename(os.path.normpath(song_outputs_path))
+    paths = []
+    for stem in ("vocals", "no_vocals"):
+        paths += [os.path.join(song_outputs_path, f"{stem}.wav"), os.path.join(song_outputs_path, f"{song_name}_{stem}.m4a")]
+    return [path for path in paths if os.path.isfile(path)]
+
+def stream_encode_enabled():
+    return bool(get_from_config("stream_to_encoder", False))
+
+def start_job(song_metadata, demucs_model, output_folder, temp_output_folder):
+    """
+    Open the checkpoint of the conversion job and find which stages can be skipped.
+    :return: (checkpoint, done) where done maps completed stage names to their records.
+    """
+    checkpoint = JobCheckpoint(job_folder_path(temp_output_folder, song_metadata["URL"], demucs_model, output_folder))
+    done = checkpoint.resume(STREAM_STAGES if stream_encode_enabled() else CONVERT_STAGES)
+    if done:
+        log_message(f"Resuming conversion from checkpoint {checkpoint.path}, completed stages: {list(done)}")
+    return checkpoint, done
+
+def run_job_stages(checkpoint, done, song_metadata, model_int, output_folder, deadline=None, started_at=None):
+    """
+    Run download -> plan -> separate -> move -> encode in the job folder, skipping the stages the checkpoint has as done.
+    Without a deadline the plan is simply the requested model with the default settings.
+    In streaming mode separate, move and encode are a single separate_encode stage.
+    :return: (song_outputs_path, m4a_file_path, source_hash, plan)
+    """
+    audio_file_path = run_checkpointed(checkpoint, done, "download", lambda path: [path],
+                                       download_stage, song_metadata, checkpoint.folder)
+    source_hash = checkpoint.artifact_hash("download", audio_file_path)
+
+    if deadline is None:
+        plan = default_plan(get_demucs_model(model_int))
+    else:
+        # The plan is only valid for the downloaded audio it was computed from
+        plan = run_checkpointed(checkpoint, done, "plan", lambda value: [audio_file_path],
+                                plan_stage, audio_file_path, model_int, deadline, started_at or time.time())
+
+    if stream_encode_enabled():
+        song_outputs_path, m4a_file_path = run_stream_stage(checkpoint, done, audio_file_path, plan["model"], output_folder,
+                                                            plan["shifts"], plan["overlap"])
+        return song_outputs_path, m4a_file_path, source_hash, plan
+
+    demucs_outputs = run_checkpointed(checkpoint, done, "separate", stem_paths,
+                                      separate_stage, audio_file_path, checkpoint.folder, plan["model"],
+                                      plan["shifts"], plan["overlap"])
+
+    song_outputs_path = run_checkpointed(checkpoint, done, "move", stem_paths,
+                                         move_stage, audio_file_path, demucs_outputs, output_folder)
+
+    m4a_file_path = run_checkpointed(checkpoint, done, "encode", lambda path: [path],
+                                     encode_stage, song_outputs_path)
+    return song_outputs_path, m4a_file_path, source_hash, plan
+
+def run_stream_stage(checkpoint, done, audio_file_path, demucs_model, output_folder,
+                     shifts=DEFAULT_SHIFTS, overlap=DEFAULT_OVERLAP):
+    """
+    Run the checkpointed separate_encode stage and return (song_outputs_path, m4a_file_path).
+    """
+    result = run_checkpointed(checkpoint, done, "separate_encode", lambda value: value["files"],
+                              separate_encode_stage, audio_file_path, demucs_model, output_folder, shifts, overlap)
+    m4a_files = [path for path in result["files"] if path.endswith(".m4a")]
+    instrumental = [path for path in m4a_files if path.endswith("_no_vocals.m4a")]
+    m4a_file_path = (instrumental or m4a_files or [""])[0]
+    return result["song_outputs_path"], m4a_file_path
+
+def cached_stage(song_metadata, demucs_model, output_folder, shifts=DEFAULT_SHIFTS, overlap=DEFAULT_OVERLAP):
+    """
+    Stage 0: Look the song up in the separation cache before downloading anything.
+    Only an entry separated with the given shifts and overlap matches, None accepts any settings.
+    On a hit, restore the cached outputs and return (song_outputs_path, m4a_file_path), otherwise return None.
+    """
+    entry = lookup_separation(get_video_id(song_metadata), demucs_model, shifts, overlap)
+    if entry is None:
+        return None
+
+    song_outputs_path = restore_separation(entry, output_folder)
+    m4a_files = [f for f in entry["files"] if f.endswith(".m4a")]
+    instrumental = [f for f in m4a_files if f.endswith("_no_vocals.m4a")]
+    m4a_file_path = os.path.join(song_outputs_path, (instrumental or m4a_files)[0]) if m4a_files else ""
+    return song_outputs_path, m4a_file_path
+
+def cached_conversion(song_metadata, model_int, output_folder, deadline=None):
+    """
+    Run the cache stage for the requested model. Without a deadline only a full quality entry (default shifts
+    and overlap) matches. With a deadline any cached model up to the requested one is good, since a cache hit
+    is always in time: each model is tried at full quality first, then with the reduced settings of an
+    earlier deadline job.
+    """
+    if deadline is None:
+        return cached_stage(song_metadata, get_demucs_model(model_int), output_folder)
+
+    for demucs_model in deadline_models(model_int):
+        cached = (cached_stage(song_metadata, demucs_model, output_folder)
+                  or cached_stage(song_metadata, demucs_model, output_folder, None, None))
+        if cached:
+            return cached
+    return None
+
+def cache_stage(song_metadata, plan, source_hash, song_outputs_path):
+    """
+    Stage 6: Store the stems and the final M4A in the separation cache, under the model, shifts and overlap
+    of the plan they were separated with. A cache failure never fails the conversion.
+    """
+    try:
+        store_separation(get_video_id(song_metadata), plan["model"], plan["shifts"], plan["overlap"], source_hash,
+                         song_outputs_path, cacheable_outputs(song_outputs_path))
+    except Exception as e:
+        log_message(f"Failed to store outputs in the separation cache: {e}")
+
+def download_stage(song_metadata, temp_output_folder):
+    """
+    Stage 1: Download the audio from YouTube into the temp folder and return the audio file path.
+    """
+    audio_file_path = download_audio_from_youtube(song_metadata, temp_output_folder)
+    log_message(f"Downloaded file: {audio_file_path}")
+    return audio_file_path
+
+def plan_stage(audio_file_path, model_int, deadline, started_at):
+    """
+    Stage 2 with a deadline: pick the best model, shifts and overlap, up to the requested model, whose estimated
+    separation time fits in what is left of the deadline. The estimate uses the track duration and the
+    per-host calibration of each model (see time_budget).
+    :return: A dictionary with the 'model', 'shifts' and 'overlap' to separate with.
+    """
+    duration = track_duration(audio_file_path)
+    if duration is None:
+        log_message(f"[Deadline] Could not read the duration of {audio_file_path}, using the requested model.")
+        return default_plan(get_demucs_model(model_int))
+
+    budget_seconds = deadline - (time.time() - started_at)
+    requested = model_int if model_int in DEMUCS_MODELS else 2
+    settings = choose_separation_settings(DEMUCS_MODELS, requested, duration, budget_seconds)
+    return {"model": settings["model"], "shifts": settings["shifts"], "overlap": settings["overlap"]}
+
+def separate_stage(audio_file_path, temp_output_folder, demucs_model, shifts=DEFAULT_SHIFTS, overlap=DEFAULT_OVERLAP):
+    """
+    Stage 3: Separate vocals with Demucs and return the folder holding the Demucs outputs.
+    """
+    log_message(f"Using Demucs model: {demucs_model} (shifts={shifts}, overlap={overlap})")
+    log_message("Starting vocal separation process.")
+    started_at = time.time()
+    separate_vocals(audio_file_path, temp_output_folder, demucs_model, shifts, overlap)
+    record_separation_time(demucs_model, audio_file_path, time.time() - started_at, shifts, overlap)
+
+    song_name = os.path.splitext(os.path.basename(audio_file_path))[0]
+    return os.path.join(temp_output_folder, demucs_model, song_name)
+
+def separate_encode_stage(audio_file_path, demucs_model, output_folder, shifts=DEFAULT_SHIFTS, overlap=DEFAULT_OVERLAP):
+    """
+    Stage 3 in streaming mode: separate vocals and pipe the stems listed in the config ('output_stems',
+    only "no_vocals" by default) straight into the M4A encoder in the song output folder.
+    WAV stems are written only when the config key 'keep_wav' is set.
+    :return: A dictionary with the song outputs path and the files produced.
+    """
+    log_message(f"Using Demucs model: {demucs_model} (shifts={shifts}, overlap={overlap})")
+    log_message("Starting vocal separation straight into the encoders.")
+    song_name = os.path.splitext(os.path.basename(audio_file_path))[0]
+    song_outputs_path = os.path.join(output_folder, song_name)
+    stems = get_from_config("output_stems", ["no_vocals"])
+    keep_wav = bool(get_from_config("keep_wav", False))
+
+    started_at = time.time()
+    files = separate_and_encode(audio_file_path, song_outputs_path, demucs_model, stems, keep_wav, shifts, overlap)
+    record_separation_time(demucs_model, audio_file_path, time.time() - started_at, shifts, overlap)
+    log_message(f"Final files created: {files}")
+    return {"song_outputs_path": song_outputs_path, "files": files}
+
+def move_stage(audio_file_path, demucs_outputs, output_folder):
+    """
+    Stage 4: Move the source audio and the Demucs outputs to the final destination and return the song outputs path.
+    """
+    song_name = os.path.basename(demucs_outputs)
+    move(audio_file_path, demucs_outputs)
+    # Move the files, overwriting duplicates but keeping the folder intact
+    song_outputs_path = os.path.join(output_folder, song_name)
+    move(demucs_outputs, song_outputs_path)
+    return song_outputs_path
+
+def encode_stage(song_outputs_path):
+    """
+    Stage 5: Convert the WAV stems listed in the config ('output_stems', only "no_vocals" by default) to M4A
+    with a single ffmpeg process and return the path of the instrumental M4A file.
+    """
+    stems = get_from_config("output_stems", ["no_vocals"])
+    wav_paths = [os.path.join(song_outputs_path, f"{stem}.wav") for stem in stems]
+    log_message(f"Starting conversion from WAV to M4A. WAV file paths: {wav_paths}, Output folder path: {song_outputs_path}")
+
+    m4a_file_paths = convert_wavs_to_m4a(wav_paths, song_outputs_path)
+    log_message(f"Final M4A files created at: {m4a_file_paths}")
+    instrumental = [path for path in m4a_file_paths if path.endswith("_no_vocals.m4a")]
+    return (instrumental or m4a_file_paths)[0]
+
+def convert(metadata_path, output_folder, model_int=2, deadline=None):
+    started_at = time.time()
     song_metadata = load_json_file(metadata_path)
     temp_output_folder = temp_output_path()
     """
     Run the actual process (downloading, converting) with YouTube URL, output folder, and Demucs model.
+    With a deadline in seconds, the model (up to the requested one), shifts and overlap are picked once the
+    track is downloaded so that the conversion is expected to finish in time.
     """
     # Log the start of the conversion process
     youtube_url = song_metadata["URL"]
@@ -51,46 +294,36 @@ def convert(metadata_path, output_folder, model_int=2):
     print(f"Output folder sanitized and created (if not existing): {temp_output_folder}")
 
     try:
-        # Step 1: Download the audio from YouTube
-        audio_file_path = download_audio_from_youtube(song_metadata, temp_output_folder)
-        log_message(f"Downloaded file: {audio_file_path}")
-
-        # Step 2: Parse the model integer into the Demucs model name
-        demucs_model = DEMUCS_MODELS.get(model_int, "htdemucs_ft")  # Default to "htdemucs_ft" if invalid
-        log_message(f"Using Demucs model: {demucs_model}")
-        
-        # Step 3: Separate vocals using the audio processing script
-        log_message("Starting vocal separation process.")
-        separate_vocals(audio_file_path, temp_output_folder, demucs_model)
-
-        # Step 4: Move Demucs outputs to the final destination
-        song_name = os.path.basename(audio_file_path).replace(".wav", "")
-        demucs_outputs = os.path.join(temp_output_folder, demucs_model, song_name)
-        move(audio_file_path, demucs_outputs)
-        # destination_folder = os.path.join(output_folder, "outputs")
-        # Move the files, overwriting duplicates but keeping the folder intact
-        song_outputs_path = os.path.join(output_folder, song_name)
-        move(demucs_outputs, song_outputs_path)
-        #save vocals and no vocals paths
-        no_vocals_path = os.path.join(song_outputs_path, "no_vocals.wav")
-        vocals_file_path = os.path.join(song_outputs_path, "vocals.wav")
-
-        # Step 5: Convert WAV files to M4A
-        
-        log_message(f"Starting conversion from WAV to M4A. WAV file path: {no_vocals_path}, Output folder path: {song_outputs_path}")
-
-        # Call the convert_wav_to_m4a method
-        m4a_file_path = convert_wav_to_m4a(no_vocals_path, song_outputs_path)
-
-        # Log the final file creation
-        log_message(f"Final M4A file created at: {m4a_file_path}")
+        # Step 1: Parse the model integer into the Demucs model name
+        demucs_model = get_demucs_model(model_int)
+
+        # Step 2: Return the cached outputs if this song was already separated with this model
+        cached = cached_conversion(song_metadata, model_int, output_folder, deadline)
+        if cached:
+            song_outputs_path, m4a_file_path = cached
+            print_report({youtube_url}, True, True, m4a_file_path, 0)
+            print (f'Return Value: {song_outputs_path}')
+            return song_outputs_path
+
+        # Step 3: Open the job checkpoint, so a previously crashed attempt resumes at its first incomplete stage
+        checkpoint, done = start_job(song_metadata, job_model_key(demucs_model, deadline), output_folder, temp_output_folder)
+
+        # Step 4: Download, pick the settings, separate vocals, move the Demucs outputs to the final destination and convert to M4A
+        song_outputs_path, m4a_file_path, source_hash, plan = run_job_stages(
+            checkpoint, done, song_metadata, model_int, output_folder, deadline, started_at)
+        checkpoint.clear()
+
+        # Step 5: Keep the outputs in the separation cache for the next time this song is converted
+        cache_stage(song_metadata, plan, source_hash, song_outputs_path)
 
         # Uncomment this if you want to process the Aeneas service for lyrics synchronization
+        # vocals_file_path = os.path.join(song_outputs_path, "vocals.wav")
         # process_aeneas_service(wav_file_path, vocals_file_path, lyrics)
 
         # Step 6: Generate and print the final report
         print_report({youtube_url}, True, True, m4a_file_path, 0)
         print (f'Return Value: {song_outputs_path}')
+        return song_outputs_path
 
     except Exception as e:
         log_message(f"An error occurred: {e}")
@@ -1,69 +1,25 @@
 import os
-import subprocess
 import sys
+import urllib.parse
+from http_download import download_file
+from transcode import get_profile, transcode
+from config_manager import get_from_config
+from environment import activate_venv
 
-def activate_venv(venv_path, venv_name):
+def download_media_file(url, output_path, venv_path, expected_sha256=None):
     """
-    Activate the virtual environment by sourcing its activate script and save the venv_path.
+    Stream the media file to output_path, resuming it if an earlier attempt was interrupted, then extract its audio.
     """
-    global _venv_path
-    print(f"Referring to virtual environment '{venv_name}' located at: {venv_path}")
-    
-    if sys.platform == "win32":
-        activate_script = os.path.join(venv_path, "Scripts", "activate.bat")
-    else:
-        activate_script = os.path.join(venv_path, "bin", "activate")
-
-    if os.path.exists(activate_script):
-        print(f"Activating virtual environment: {venv_name}")
-        
-        # Activate the virtual environment using subprocess
-        if sys.platform == "win32":
-            subprocess.call([activate_script], shell=True)
-        else:
-            # For Linux/Mac, source the activate script
-            subprocess.call(f'source "{activate_script}"', shell=True, executable="/bin/bash")
-        
-        # Save the virtual environment path after successful activation
-        _venv_path = venv_path
-    else:
-        print(f"Error: Activate script not found in virtual environment '{venv_name}' at: {venv_path}")
-        sys.exit(112)
-
-
-def ensure_requests_installed(venv_path):
-    """Ensure that the requests library is installed in the specified virtual environment"""
-    try:
-        import requests
-    except ModuleNotFoundError:
-        print("requests module not found in the virtual environment. Installing...")
-
-        # Path to pip inside the virtual environment
-        pip_executable = os.path.join(venv_path, "bin", "pip") if os.name != "nt" else os.path.join(venv_path, "Scripts", "pip.exe")
-
-        if not os.path.exists(pip_executable):
-            print(f"pip not found in virtual environment at {pip_executable}")
-            sys.exit(1)
-
-        # Run pip from the virtual environment to install requests
-        subprocess.run([pip_executable, "install", "requests"], check=True)
-        import requests  # Re-import after installation
-
-    return requests
-
-def download_media_file(url, output_path, venv_path):
-    requests = ensure_requests_installed(venv_path)  # Ensure requests is installed
-    file_name = os.path.basename(url)
+    file_name = os.path.basename(urllib.parse.urlparse(url).path)
     file_path = os.path.join(output_path, file_name)
 
-    response = requests.get(url, stream=True)
-    if response.status_code == 200:
-        with open(file_path, 'wb') as f:
-            f.write(response.content)
-        print(f"Downloaded file to: {file_path}")
-        extract_audio(file_path, output_path, venv_path)
-    else:
-        print("Failed to download file")
+    try:
+        download_file(url, file_path, expected_sha256=expected_sha256)
+    except Exception as e:
+        print(f"Failed to download file: {e}")
+        return
+    print(f"Downloaded file to: {file_path}")
+    extract_audio(file_path, output_path, venv_path)
 
 
 def get_unique_filename(base_path, extension):
@@ -76,39 +32,52 @@ def get_unique_filename(base_path, extension):
         counter += 1
     return f"{base_path}_{counter}{extension}"
 
-def extract_audio(media_file_path, output_path, venv_path):
+# Formats extract_audio produces when the config key 'extract_audio_profiles' is not set
+DEFAULT_EXTRACT_PROFILES = ["mp3", "m4a"]
+
+def extract_audio(media_file_path, output_path, venv_path, profile_names=None):
+    """
+    Extract the audio of the media file to every configured output profile with a single ffmpeg run,
+    so the source is demuxed and decoded only once.
+
+    :param profile_names: The output profiles (see transcode.OUTPUT_PROFILES), defaults to the config
+                          key 'extract_audio_profiles', or MP3 and M4A.
+    """
+    if profile_names is None:
+        profile_names = get_from_config("extract_audio_profiles", DEFAULT_EXTRACT_PROFILES)
+    custom_profiles = get_from_config("output_profiles", {})
+
     # Get base name from parent directory and file name
     dir_name = os.path.basename(os.path.dirname(media_file_path))
     base_output_name = os.path.join(output_path, f"{dir_name}")
 
-    # Define paths for MP3 and M4A files, ensuring they are unique
-    mp3_output_path = get_unique_filename(base_output_name, ".mp3")
-    m4a_output_path = get_unique_filename(base_output_name, ".m4a")
+    # Define a unique output path per profile
+    outputs = []
+    for name in profile_names:
+        profile = get_profile(name, custom_profiles)
+        outputs.append((0, get_unique_filename(base_output_name, profile["extension"]), profile))
 
     # Path to ffmpeg within the virtual environment
     ffmpeg_path = os.path.join(venv_path, "bin", "ffmpeg")
 
-    # Extract to MP3
-    subprocess.run([ffmpeg_path, "-i", media_file_path, "-q:a", "0", mp3_output_path], check=True)
-    print(f"Audio extracted to MP3: {mp3_output_path}")
-
-    # Extract to M4A
-    subprocess.run([ffmpeg_path, "-i", media_file_path, "-c:a", "aac", "-b:a", "320k", m4a_output_path], check=True)
-    print(f"Audio extracted to M4A: {m4a_output_path}")
+    transcode(ffmpeg_path, [media_file_path], outputs)
+    for name, (_, output_file_path, _) in zip(profile_names, outputs):
+        print(f"Audio extracted to {name.upper()}: {output_file_path}")
 
 # Usage
 if __name__ == "__main__":
     if len(sys.argv) < 4:
-        print("Usage: python download_and_extract_audio.py <media_file_url> <output_path> <venv_activate_path>")
+        print("Usage: python download_and_extract_audio.py <media_file_url> <output_path> <venv_activate_path> [sha256]")
         sys.exit(1)
     
     url = sys.argv[1]
     output_path = sys.argv[2]
     venv_path = sys.argv[3]
+    expected_sha256 = sys.argv[4] if len(sys.argv) > 4 else None
 
     # Activate the virtual environment
     venv_name = os.path.basename(venv_path)
     activate_venv(venv_path, venv_name)
     
     # Download and extract media file
-    download_media_file(url, output_path, venv_path)
\ No newline at end of file
+    download_media_file(url, output_path, venv_path, expected_sha256)
\ No newline at end of file
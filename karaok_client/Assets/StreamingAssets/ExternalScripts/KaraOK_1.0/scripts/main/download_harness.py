@@ -0,0 +1,112 @@
+# download_harness.py (Runs BatchDownloader against a local HTTP stand-in instead of YouTube)
+import os
+import sys
+import json
+import time
+import wave
+import shutil
+import filecmp
+import argparse
+import tempfile
+import threading
+from functools import partial
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+# Add the root of the project (KaraOK_1.0) to sys.path when run as a script
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "../.."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.append(PROJECT_ROOT)
+
+from scripts.functional.batch_downloader import BatchDownloader
+
+SAMPLE_RATE = 44100
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+def write_test_song(path, seconds, index):
+    """
+    Write a stereo 16-bit WAV of the given length, different for every index so no two songs are equal.
+    """
+    frame = index.to_bytes(2, "little", signed=True) * 2
+    with wave.open(path, "wb") as wav_file:
+        wav_file.setnchannels(2)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(SAMPLE_RATE)
+        wav_file.writeframes(frame * int(SAMPLE_RATE * seconds))
+
+def serve_folder(folder):
+    """
+    Serve folder over HTTP on a free local port from a background thread.
+
+    :return: (server, base URL). Call server.shutdown() when done.
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", 0), partial(_QuietHandler, directory=folder))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+def run_harness(songs=6, duplicates=2, workers=3, seconds=5, ffmpeg_path=None):
+    """
+    Download a batch of songs from a local stand-in server with BatchDownloader and check every result.
+    The batch repeats the first song 'duplicates' extra times, into other folders, to exercise deduplication.
+    yt-dlp reads the files through its generic extractor, so no network access or YouTube account is needed.
+
+    :return: True if every song was downloaded with the expected content.
+    """
+    work_folder = tempfile.mkdtemp(prefix="karaok_download_harness_")
+    server = None
+    try:
+        served_folder = os.path.join(work_folder, "served")
+        os.makedirs(served_folder)
+        for index in range(songs):
+            write_test_song(os.path.join(served_folder, f"song{index}.wav"), seconds, index + 1)
+        server, base_url = serve_folder(served_folder)
+
+        batch = []
+        expected_paths = []
+        for index in list(range(songs)) + [0] * duplicates:
+            metadata = {"URL": f"{base_url}/song{index}.wav", "Artist": "Harness", "Title": f"Song {index}"}
+            batch.append((metadata, os.path.join(work_folder, "out", str(len(batch)))))
+            expected_paths.append(os.path.join(served_folder, f"song{index}.wav"))
+
+        downloader = BatchDownloader(os.path.join(work_folder, "staging"), max_workers=workers, audio_format="native",
+                                     progress_callback=None, ffmpeg_path=ffmpeg_path or shutil.which("ffmpeg") or "ffmpeg")
+        started_at = time.time()
+        try:
+            results = downloader.download_many(batch)
+        finally:
+            downloader.close()
+        elapsed = time.time() - started_at
+
+        failures = []
+        for (metadata, _), expected, result in zip(batch, expected_paths, results):
+            if not result["success"]:
+                failures.append(f"{metadata['URL']}: {result['error']}")
+            elif not os.path.isfile(result["path"]) or not filecmp.cmp(result["path"], expected, shallow=False):
+                failures.append(f"{metadata['URL']}: {result['path']} does not match the served file")
+
+        print(f"[Harness] {len(batch)} entries ({songs} songs, {duplicates} duplicates), {workers} workers: "
+              f"{len(batch) - len(failures)} ok, {len(failures)} failed in {elapsed:.2f}s")
+        for failure in failures:
+            print(f"[Harness] FAILED {failure}")
+        print(f"Return Value: {json.dumps(not failures)}")
+        return not failures
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+        shutil.rmtree(work_folder, ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="Check BatchDownloader against a local HTTP stand-in for YouTube")
+    parser.add_argument("--songs", type=int, default=6, help="Distinct songs in the batch")
+    parser.add_argument("--duplicates", type=int, default=2, help="Extra entries of the first song")
+    parser.add_argument("--workers", type=int, default=3, help="Concurrent downloads")
+    parser.add_argument("--seconds", type=float, default=5, help="Length of every test song")
+    args = parser.parse_args()
+    ok = run_harness(args.songs, args.duplicates, args.workers, args.seconds)
+    sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
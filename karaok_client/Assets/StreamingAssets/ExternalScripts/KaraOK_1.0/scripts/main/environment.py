@@ -1,21 +1,64 @@
 import os
 import subprocess
 import sys
+from scripts.main.config_manager import get_from_config, set_to_config
 # Global variable to store the virtual environment path
 _venv_path = None
 
+# Config key of the fingerprint of the last environment that passed validation
+FINGERPRINT_CONFIG_KEY = "venv_fingerprint"
+
+def _activate_script(venv_path):
+    if sys.platform == "win32":
+        return os.path.join(venv_path, "Scripts", "activate.bat")
+    return os.path.join(venv_path, "bin", "activate")
+
+def _venv_bin(venv_path):
+    return os.path.join(venv_path, "Scripts" if sys.platform == "win32" else "bin")
+
+def venv_python_path(venv_path):
+    """
+    The interpreter of the virtual environment: bin/python, or Scripts/python.exe on Windows.
+    """
+    return os.path.join(venv_path, 'Scripts', 'python.exe') if sys.platform == "win32" else os.path.join(venv_path, 'bin', 'python')
+
+def _pyvenv_cfg_mtime(venv_path):
+    # pyvenv.cfg is rewritten whenever the venv is created again, a single stat tells if the fingerprint still holds
+    try:
+        return os.stat(os.path.join(venv_path, "pyvenv.cfg")).st_mtime_ns
+    except OSError:
+        return None
+
+def _fingerprint_is_valid(venv_path):
+    fingerprint = get_from_config(FINGERPRINT_CONFIG_KEY) or {}
+    mtime = _pyvenv_cfg_mtime(venv_path)
+    return mtime is not None and fingerprint.get("venv_path") == venv_path and fingerprint.get("pyvenv_cfg_mtime") == mtime
+
+def _save_fingerprint(venv_path):
+    mtime = _pyvenv_cfg_mtime(venv_path)
+    if mtime is not None:
+        set_to_config(FINGERPRINT_CONFIG_KEY, {"venv_path": venv_path, "python": venv_python_path(venv_path),
+                                               "pyvenv_cfg_mtime": mtime})
+
+def is_valid_environment(venv_path):
+    """
+    Check that the virtual environment has its activate script and interpreter.
+    Once it has passed, its fingerprint is kept in the config and later calls only stat pyvenv.cfg.
+    """
+    if _fingerprint_is_valid(venv_path):
+        return True
+    if os.path.exists(_activate_script(venv_path)) and os.path.exists(venv_python_path(venv_path)):
+        _save_fingerprint(venv_path)
+        return True
+    return False
+
 def check_environment(venv_path, venv_name):
     """
     Check if the virtual environment is properly set up by checking for the activate script.
     """
     print(f"Checking if virtual environment '{venv_name}' is installed at: {venv_path}")
-    
-    if sys.platform == "win32":
-        activate_script = os.path.join(venv_path, "Scripts", "activate.bat")
-    else:
-        activate_script = os.path.join(venv_path, "bin", "activate")
 
-    if os.path.exists(activate_script):
+    if is_valid_environment(venv_path):
         print(f"Virtual environment '{venv_name}' is installed and valid at: {venv_path}")
         return True
     else:
@@ -24,32 +67,26 @@ def check_environment(venv_path, venv_name):
 
 def activate_venv(venv_path, venv_name):
     """
-    Activate the virtual environment by sourcing its activate script and save the venv_path.
+    Activate the virtual environment in the current process and save the venv_path.
+    Sourcing the activate script in a shell would only affect that shell, so the variables it sets
+    (VIRTUAL_ENV, PATH) are set here instead; child processes and an interpreter switch inherit them.
     """
     global _venv_path
     print(f"Referring to virtual environment '{venv_name}' located at: {venv_path}")
-    
-    if sys.platform == "win32":
-        activate_script = os.path.join(venv_path, "Scripts", "activate.bat")
-    else:
-        activate_script = os.path.join(venv_path, "bin", "activate")
 
-    if os.path.exists(activate_script):
-        print(f"Activating virtual environment: {venv_name}")
-        
-        # Activate the virtual environment using subprocess
-        if sys.platform == "win32":
-            subprocess.call([activate_script], shell=True)
-        else:
-            # For Linux/Mac, source the activate script
-            subprocess.call(f'source "{activate_script}"', shell=True, executable="/bin/bash")
-        
-        # Save the virtual environment path after successful activation
-        _venv_path = venv_path
-    else:
+    if not is_valid_environment(venv_path):
         print(f"Error: Activate script not found in virtual environment '{venv_name}' at: {venv_path}")
         sys.exit(112)
 
+    if os.environ.get("VIRTUAL_ENV") != venv_path:
+        print(f"Activating virtual environment: {venv_name}")
+        os.environ["VIRTUAL_ENV"] = venv_path
+        os.environ["PATH"] = _venv_bin(venv_path) + os.pathsep + os.environ.get("PATH", "")
+        os.environ.pop("PYTHONHOME", None)
+
+    # Save the virtual environment path after successful activation
+    _venv_path = venv_path
+
 def get_venv_path():
     """
     Return the path to the activated virtual environment.
@@ -60,17 +97,34 @@ def get_venv_path():
         print("Error: Virtual environment is not activated. Call activate_venv first.")
         sys.exit(325)
 
+def running_in_venv(venv_path):
+    """
+    Whether this interpreter belongs to the virtual environment, however it was started (symlinks included).
+    """
+    return os.path.realpath(sys.prefix) == os.path.realpath(venv_path)
+
 def ensure_virtual_env(venv_path):
     """
     Ensures that the script is running inside the virtual environment.
-    If not, restart the script using the virtual environment's Python interpreter.
+    If not, replace this process with the same command run by the virtual environment's Python interpreter,
+    so no second process is spawned and waited on.
     """
-    #venv_path = sanitize_path_q(venv_path)
-    venv_python = os.path.join(venv_path, 'bin', 'python') if sys.platform != "win32" else os.path.join(venv_path, 'Scripts', 'python.exe')
+    if running_in_venv(venv_path):
+        return
 
-    # Check if we're running in the virtual environment
-    if sys.executable != venv_python:
-        print(f"Switching to virtual environment's Python interpreter at: {venv_python}")
-        # Restart the script using the virtual environment's Python interpreter
-        subprocess.call([venv_python] + sys.argv)
-        sys.exit()
\ No newline at end of file
+    venv_python = venv_python_path(venv_path)
+    print(f"Switching to virtual environment's Python interpreter at: {venv_python}")
+    # Anything still buffered would be lost when the process image is replaced
+    sys.stdout.flush()
+    sys.stderr.flush()
+    if sys.platform == "win32":
+        # os.execv on Windows starts a new process and exits this one, which Unity would see as the end of the run
+        sys.exit(subprocess.call([venv_python] + sys.argv))
+    os.execv(venv_python, [venv_python] + sys.argv)
+
+def bootstrap_venv(venv_path, venv_name):
+    """
+    Activate the virtual environment and make sure its interpreter runs the rest of the script.
+    """
+    activate_venv(venv_path, venv_name)
+    ensure_virtual_env(venv_path)
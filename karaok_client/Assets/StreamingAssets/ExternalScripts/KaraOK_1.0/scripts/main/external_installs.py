@@ -1,18 +1,51 @@
 import os
+import shutil
 import subprocess
 import platform
-import urllib.request
+from scripts.main.artifact_store import fetch_archive
 import zipfile
-import tarfile
 
-def install_ffmpeg(containing_folder_path):
+# Static FFmpeg 7.0.2 builds of every supported platform, from the imageio-ffmpeg 0.6.0 wheels on PyPI.
+# The URLs are immutable and PyPI publishes their SHA-256, pinned per platform in install_manifest.json.
+FFMPEG_ARCHIVE_URLS = {
+    "Darwin-x86_64": "https://files.pythonhosted.org/packages/da/58/87ef68ac83f4c7690961bce288fd8e382bc5f1513860fc7f90a9c1c1c6bf/imageio_ffmpeg-0.6.0-py3-none-macosx_10_9_intel.macosx_10_9_x86_64.whl",
+    "Darwin-arm64": "https://files.pythonhosted.org/packages/40/5c/f3d8a657d362cc93b81aab8feda487317da5b5d31c0e1fdfd5e986e55d17/imageio_ffmpeg-0.6.0-py3-none-macosx_11_0_arm64.whl",
+    "Linux-x86_64": "https://files.pythonhosted.org/packages/a0/2d/43c8522a2038e9d0e7dbdf3a61195ecc31ca576fb1527a528c877e87d973/imageio_ffmpeg-0.6.0-py3-none-manylinux2014_x86_64.whl",
+    "Linux-aarch64": "https://files.pythonhosted.org/packages/33/e7/1925bfbc563c39c1d2e82501d8372734a5c725e53ac3b31b4c2d081e895b/imageio_ffmpeg-0.6.0-py3-none-manylinux2014_aarch64.whl",
+    "Windows-AMD64": "https://files.pythonhosted.org/packages/2c/c6/fa760e12a2483469e2bf5058c5faff664acf66cadb4df2ad6205b016a73d/imageio_ffmpeg-0.6.0-py3-none-win_amd64.whl",
+    "Windows-x86": "https://files.pythonhosted.org/packages/a0/13/59da54728351883c3c1d9fca1710ab8eee82c7beba585df8f25ca925f08f/imageio_ffmpeg-0.6.0-py3-none-win32.whl",
+}
+# Folder of the FFmpeg binary inside the archives
+FFMPEG_ARCHIVE_BINARIES = "imageio_ffmpeg/binaries/"
+
+# platform.machine() names of the same architectures
+MACHINE_ALIASES = {"amd64": "x86_64", "x64": "x86_64", "aarch64": "arm64", "i386": "x86", "i686": "x86"}
+
+def ffmpeg_platform():
     """
-    Check if FFmpeg exists; if not, download and install it under the provided containing_folder_path.
+    The key of the current platform in FFMPEG_ARCHIVE_URLS and in 'ffmpeg_sha256' of install_manifest.json.
+    """
+    system = platform.system()
+    machine = MACHINE_ALIASES.get(platform.machine().lower(), platform.machine().lower())
+    if system == "Windows":
+        # imageio-ffmpeg publishes no Windows arm64 build: Windows on ARM gets the x64 one, which Windows 11
+        # runs under x64 emulation (Windows 10 on ARM only emulates x86 and cannot run it)
+        return f"{system}-{'AMD64' if machine in ('x86_64', 'arm64') else 'x86'}"
+    if system == "Linux" and machine == "arm64":
+        return f"{system}-aarch64"
+    return f"{system}-{machine}"
+
+def install_ffmpeg(containing_folder_path, expected_sha256=None):
+    """
+    Check if FFmpeg exists; if not, install it under the provided containing_folder_path.
+    The archive comes from the artifact store, which only downloads it the first time.
     
+    :param expected_sha256: Optional SHA-256 the archive must match.
     Returns the path to the installed FFmpeg.
     """
+    system = platform.system()
     ffmpeg_dir = os.path.join(containing_folder_path, 'ffmpeg')
-    ffmpeg_path = os.path.join(ffmpeg_dir, 'ffmpeg')
+    ffmpeg_path = os.path.join(ffmpeg_dir, 'ffmpeg.exe' if system == "Windows" else 'ffmpeg')
 
     # Check if FFmpeg is already installed
     if os.path.exists(ffmpeg_path):
@@ -20,77 +53,27 @@ def install_ffmpeg(containing_folder_path):
         return ffmpeg_path
 
     print("[FFmpeg] FFmpeg not found, starting installation...")
+    machine = platform.machine().lower()
+    if platform.system() == "Windows" and MACHINE_ALIASES.get(machine, machine) == "arm64":
+        print("[FFmpeg] No Windows arm64 build is available, installing the x64 build, which runs under emulation")
 
-    # Download FFmpeg based on the OS
-    system = platform.system()
-    
-    if system == "Darwin":  # macOS
-        ffmpeg_url = "https://evermeet.cx/ffmpeg/ffmpeg-7.0.2.zip"
-        ffmpeg_zip_path = os.path.join(containing_folder_path, 'ffmpeg.zip')
-        
-        print(f"[FFmpeg] Downloading FFmpeg from {ffmpeg_url}...")
-        urllib.request.urlretrieve(ffmpeg_url, ffmpeg_zip_path)
-        print(f"[FFmpeg] Downloaded FFmpeg zip file to {ffmpeg_zip_path}")
-
-        print("[FFmpeg] Extracting FFmpeg zip file...")
-        with zipfile.ZipFile(ffmpeg_zip_path, 'r') as zip_ref:
-            zip_ref.extractall(ffmpeg_dir)
-        print(f"[FFmpeg] Extracted FFmpeg to {ffmpeg_dir}")
-
-        # Clean up the downloaded zip file
-        os.remove(ffmpeg_zip_path)
-        print(f"[FFmpeg] Deleted zip file: {ffmpeg_zip_path}")
-
-    elif system == "Linux":
-        ffmpeg_url = "https://johnvansickle.com/ffmpeg/releases/ffmpeg-release-i686-static.tar.xz"
-        ffmpeg_tar_path = os.path.join(containing_folder_path, 'ffmpeg.tar.xz')
-
-        print(f"[FFmpeg] Downloading FFmpeg from {ffmpeg_url}...")
-        urllib.request.urlretrieve(ffmpeg_url, ffmpeg_tar_path)
-        print(f"[FFmpeg] Downloaded FFmpeg tar file to {ffmpeg_tar_path}")
-
-        print("[FFmpeg] Extracting FFmpeg tar file...")
-        with tarfile.open(ffmpeg_tar_path, 'r:xz') as tar_ref:
-            tar_ref.extractall(ffmpeg_dir)
-        print(f"[FFmpeg] Extracted FFmpeg to {ffmpeg_dir}")
-
-        # Clean up the downloaded tar file
-        os.remove(ffmpeg_tar_path)
-        print(f"[FFmpeg] Deleted tar file: {ffmpeg_tar_path}")
-        
-        # Move the extracted ffmpeg binary
-        extracted_ffmpeg_dir = os.path.join(ffmpeg_dir, os.listdir(ffmpeg_dir)[0])
-        ffmpeg_binary = os.path.join(extracted_ffmpeg_dir, 'ffmpeg')
-        os.rename(ffmpeg_binary, ffmpeg_path)
-        print(f"[FFmpeg] Moved FFmpeg binary to {ffmpeg_path}")
-
-    elif system == "Windows":
-        ffmpeg_url = "https://www.gyan.dev/ffmpeg/builds/ffmpeg-release-essentials.zip"
-        ffmpeg_zip_path = os.path.join(containing_folder_path, 'ffmpeg.zip')
-
-        print(f"[FFmpeg] Downloading FFmpeg from {ffmpeg_url}...")
-        urllib.request.urlretrieve(ffmpeg_url, ffmpeg_zip_path)
-        print(f"[FFmpeg] Downloaded FFmpeg zip file to {ffmpeg_zip_path}")
-
-        print("[FFmpeg] Extracting FFmpeg zip file...")
-        with zipfile.ZipFile(ffmpeg_zip_path, 'r') as zip_ref:
-            zip_ref.extractall(ffmpeg_dir)
-        print(f"[FFmpeg] Extracted FFmpeg to {ffmpeg_dir}")
-
-        # Clean up the downloaded zip file
-        os.remove(ffmpeg_zip_path)
-        print(f"[FFmpeg] Deleted zip file: {ffmpeg_zip_path}")
-        
-        # Move the ffmpeg binary
-        extracted_ffmpeg_dir = os.path.join(ffmpeg_dir, os.listdir(ffmpeg_dir)[0], 'bin')
-        ffmpeg_binary = os.path.join(extracted_ffmpeg_dir, 'ffmpeg.exe')
-        os.rename(ffmpeg_binary, os.path.join(ffmpeg_dir, 'ffmpeg.exe'))
-        ffmpeg_path = os.path.join(ffmpeg_dir, 'ffmpeg.exe')
-        print(f"[FFmpeg] Moved FFmpeg binary to {ffmpeg_path}")
-
-    else:
+    # Download FFmpeg based on the OS and architecture
+    archive_url = FFMPEG_ARCHIVE_URLS.get(ffmpeg_platform())
+    if not archive_url:
         print("[FFmpeg] Error: Unsupported operating system")
-        raise OSError("[FFmpeg] Unsupported operating system")
+        raise OSError(f"[FFmpeg] Unsupported operating system: {ffmpeg_platform()}")
+    ffmpeg_zip_path = fetch_archive(archive_url, expected_sha256)
+
+    print("[FFmpeg] Extracting FFmpeg zip file...")
+    os.makedirs(ffmpeg_dir, exist_ok=True)
+    with zipfile.ZipFile(ffmpeg_zip_path, 'r') as zip_ref:
+        binaries = [name for name in zip_ref.namelist()
+                    if name.startswith(FFMPEG_ARCHIVE_BINARIES + "ffmpeg-")]
+        if not binaries:
+            raise FileNotFoundError(f"[FFmpeg] No FFmpeg binary in {ffmpeg_zip_path}")
+        with zip_ref.open(binaries[0]) as source, open(ffmpeg_path, 'wb') as destination:
+            shutil.copyfileobj(source, destination)
+    print(f"[FFmpeg] Extracted {binaries[0]} to {ffmpeg_path}")
 
     # Grant execute permissions for macOS and Linux
     if system in ["Darwin", "Linux"]:
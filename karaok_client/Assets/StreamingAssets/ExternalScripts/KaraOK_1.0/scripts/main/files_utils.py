@@ -3,6 +3,7 @@
 import os
 import shutil
 import json
+import hashlib
 
 def load_json_file(path):
     try:
@@ -26,6 +27,29 @@ def load_json_file(path):
     
     return None  # Return None if an error occurs
 
+def file_sha256(path, chunk_size=1024 * 1024):
+    """
+    Compute the SHA-256 hex digest of a file, reading it in chunks so large audio files are not loaded into memory.
+    """
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+def link_or_copy(source, destination):
+    """
+    Hard-link the file when possible (instant and free on disk), otherwise copy it.
+    An existing destination file is replaced. Only use it for files that are never rewritten in place,
+    a write through either path changes both.
+    """
+    if os.path.exists(destination):
+        os.remove(destination)
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copy2(source, destination)
+
 def move(source, destination):
     """
     Move files or directories from source to destination.
@@ -1,4 +1,5 @@
 ﻿import os
+import re
 import subprocess
 import shutil
 import sys
@@ -13,21 +14,71 @@ def run_command(command, error_message):
         print(f"{error_message}: {e}")
         sys.exit(1)
 
-def install_gentle(venv_path):
-    gentle_path = os.path.join(venv_path, "gentle")
+GENTLE_REPOSITORY = "https://github.com/lowerquality/gentle.git"
+DEFAULT_GENTLE_REVISION = "master"
+# Written into the Gentle folder once install.sh and install_models.sh succeeded, with the installed commit
+INSTALLED_MARKER = ".karaok_installed"
+
+def gentle_install_path(venv_path):
+    return os.path.join(venv_path, "gentle")
+
+def installed_revision(venv_path):
+    """
+    Return the revision of the completed Gentle installation, or None if Gentle is missing or half installed.
+    """
+    try:
+        with open(os.path.join(gentle_install_path(venv_path), INSTALLED_MARKER), 'r') as marker_file:
+            return marker_file.read().strip() or None
+    except OSError:
+        return None
+
+def is_commit(revision):
+    return bool(re.fullmatch(r"[0-9a-f]{40}", revision or ""))
+
+def resolve_revision(revision, repository=GENTLE_REPOSITORY):
+    """
+    Return the commit the revision points at. A commit is returned as is, a branch or tag is looked up
+    on the remote, so what gets installed and recorded is a commit rather than a moving name.
+    """
+    if is_commit(revision):
+        return revision
+    output = subprocess.run(["git", "ls-remote", repository, revision, revision + "^{}"],
+                            check=True, capture_output=True, text=True).stdout
+    refs = [line.split("\t") for line in output.splitlines() if "\t" in line]
+    if not refs:
+        raise ValueError(f"Gentle revision '{revision}' was not found in {repository}")
+    # An annotated tag is listed twice, the '^{}' line holds the commit it points at
+    peeled = [commit for commit, ref in refs if ref.endswith("^{}")]
+    return peeled[0] if peeled else refs[0][0]
+
+def install_gentle(venv_path, revision=DEFAULT_GENTLE_REVISION, repository=GENTLE_REPOSITORY):
+    """
+    Install Gentle at the given revision (branch, tag or commit). The revision is resolved to its commit first,
+    nothing is done when that commit is already installed, and an existing clone is updated in place instead
+    of being deleted and cloned again.
+    """
+    gentle_path = gentle_install_path(venv_path)
+
+    commit = resolve_revision(revision, repository)
+    if installed_revision(venv_path) == commit:
+        print(f"Gentle {revision} ({commit}) is already installed at {gentle_path}")
+        return
 
     # Modify the PATH to include the Homebrew path inside the virtual environment
     brew_bin_path = os.path.join(venv_path, "bin")
     os.environ["PATH"] = f"{brew_bin_path}:{os.environ['PATH']}"
 
-    print(f"Step 1: Cloning the Gentle repository into {gentle_path}...")
-    if os.path.exists(gentle_path):
-        print(f"Removing existing Gentle installation at {gentle_path}...")
-        shutil.rmtree(gentle_path)
-        print(f"Removed {gentle_path}. Cloning a fresh repository.")
-
-    run_command(["git", "clone", "https://github.com/lowerquality/gentle.git", gentle_path],
-                "Error cloning the Gentle repository")
+    if os.path.isdir(os.path.join(gentle_path, ".git")):
+        print(f"Step 1: Updating the Gentle repository in {gentle_path} to {revision} ({commit})...")
+        run_command(["git", "-C", gentle_path, "fetch", repository, commit], "Error fetching the Gentle repository")
+    else:
+        print(f"Step 1: Cloning the Gentle repository into {gentle_path}...")
+        if os.path.exists(gentle_path):
+            print(f"Removing incomplete Gentle installation at {gentle_path}...")
+            shutil.rmtree(gentle_path)
+        run_command(["git", "clone", repository, gentle_path], "Error cloning the Gentle repository")
+        run_command(["git", "-C", gentle_path, "fetch", repository, commit], "Error fetching the Gentle repository")
+    run_command(["git", "-C", gentle_path, "checkout", "--force", "FETCH_HEAD"], f"Error checking out Gentle {commit}")
 
     os.chdir(gentle_path)
 
@@ -40,12 +91,15 @@ def install_gentle(venv_path):
     print("Step 3: Installing necessary models with install_models.sh...")
     run_command(["zsh", "install_models.sh"], "Error running install_models.sh")
 
+    with open(os.path.join(gentle_path, INSTALLED_MARKER), 'w') as marker_file:
+        marker_file.write(commit)
+
     print(f"Gentle installation complete. Installed at {gentle_path}")
 
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: python3 gentle_installer.py <path_to_virtual_environment>")
+    if len(sys.argv) not in (2, 3, 4):
+        print("Usage: python3 gentle_installer.py <path_to_virtual_environment> [revision] [repository]")
         sys.exit(1)
 
     install_path = sys.argv[1]
-    install_gentle(install_path)
\ No newline at end of file
+    install_gentle(install_path, *sys.argv[2:])
\ No newline at end of file
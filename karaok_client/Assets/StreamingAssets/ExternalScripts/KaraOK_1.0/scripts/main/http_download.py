@@ -0,0 +1,123 @@
+# http_download.py (Streams HTTP downloads to disk and resumes them after a dropped connection)
+import os
+import json
+import time
+import socket
+import urllib.error
+import urllib.request
+from http.client import IncompleteRead
+from files_utils import file_sha256
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+DEFAULT_RETRIES = 5
+DEFAULT_TIMEOUT = 30
+PARTIAL_SUFFIX = ".part"
+STATE_SUFFIX = ".part.json"
+
+def _load_state(state_path):
+    try:
+        with open(state_path, 'r') as state_file:
+            return json.load(state_file)
+    except (OSError, json.JSONDecodeError):
+        return {}
+
+def _save_state(state_path, state):
+    with open(state_path, 'w') as state_file:
+        json.dump(state, state_file)
+
+def _resume_request(url, offset, state):
+    """
+    Build the request for the remaining bytes. If-Range makes the server send the whole file again (200)
+    instead of the rest (206) when the file changed since the partial download started.
+    """
+    request = urllib.request.Request(url)
+    if offset:
+        request.add_header("Range", f"bytes={offset}-")
+        validator = state.get("etag") or state.get("last_modified")
+        if validator:
+            request.add_header("If-Range", validator)
+    return request
+
+def download_file(url, destination_path, expected_sha256=None, chunk_size=DEFAULT_CHUNK_SIZE, retries=DEFAULT_RETRIES,
+                  timeout=DEFAULT_TIMEOUT, progress=None):
+    """
+    Download url to destination_path in chunks, so memory use does not depend on the file size.
+    The download goes to '<destination_path>.part', next to a small state file with the URL and validators of
+    the server response. A dropped connection is retried with an HTTP Range request from the bytes already on
+    disk, and so is a download interrupted in an earlier run. The file is renamed into place once complete.
+
+    :param expected_sha256: Optional SHA-256 hex digest the complete file must match.
+    :param progress: Optional callable called with (downloaded_bytes, total_bytes or None) after every chunk.
+    :return: destination_path
+    """
+    partial_path = destination_path + PARTIAL_SUFFIX
+    state_path = destination_path + STATE_SUFFIX
+    os.makedirs(os.path.dirname(os.path.abspath(destination_path)), exist_ok=True)
+
+    state = _load_state(state_path)
+    if state.get("url") != url and os.path.exists(partial_path):
+        # A partial file from another URL cannot be resumed
+        os.remove(partial_path)
+    state["url"] = url
+
+    attempt = 0
+    while True:
+        offset = os.path.getsize(partial_path) if os.path.exists(partial_path) else 0
+        try:
+            with urllib.request.urlopen(_resume_request(url, offset, state), timeout=timeout) as response:
+                if response.status == 206:
+                    print(f"[Download] Resuming {url} from byte {offset}")
+                    mode = 'ab'
+                else:
+                    offset = 0
+                    mode = 'wb'
+                    state["etag"] = response.headers.get("ETag")
+                    state["last_modified"] = response.headers.get("Last-Modified")
+                    length = response.headers.get("Content-Length")
+                    state["total"] = int(length) if length else None
+                    _save_state(state_path, state)
+
+                total = state.get("total")
+                downloaded = offset
+                with open(partial_path, mode) as partial_file:
+                    for chunk in iter(lambda: response.read(chunk_size), b''):
+                        partial_file.write(chunk)
+                        downloaded += len(chunk)
+                        if progress:
+                            progress(downloaded, total)
+
+                if total and downloaded < total:
+                    raise IncompleteRead(b'', total - downloaded)
+            break
+        except urllib.error.HTTPError as e:
+            # 416: the partial file already holds every byte
+            if e.code == 416 and offset and offset == state.get("total"):
+                break
+            if e.code < 500:
+                raise
+            error = e
+        except (urllib.error.URLError, IncompleteRead, ConnectionError, socket.timeout) as e:
+            error = e
+
+        attempt += 1
+        if attempt > retries:
+            print(f"[Download] Giving up on {url} after {retries} retries: {error}")
+            raise error
+        delay = min(2 ** attempt, 30)
+        print(f"[Download] Connection to {url} dropped ({error}), retrying in {delay}s...")
+        time.sleep(delay)
+
+    if expected_sha256:
+        actual_sha256 = file_sha256(partial_path)
+        if actual_sha256.lower() != expected_sha256.lower():
+            # A corrupt file must not be resumed from either
+            os.remove(partial_path)
+            if os.path.exists(state_path):
+                os.remove(state_path)
+            raise ValueError(f"Checksum mismatch for {url}: expected {expected_sha256}, got {actual_sha256}")
+
+    os.replace(partial_path, destination_path)
+    if os.path.exists(state_path):
+        os.remove(state_path)
+    print(f"[Download] Downloaded {url} to {destination_path}")
+    return destination_path
@@ -0,0 +1,70 @@
+# import_profile.py (Measures how long every module takes to import, for 'smule.py --import-profile')
+import atexit
+import builtins
+import importlib.util
+import sys
+import threading
+import time
+
+# Modules listed in the report, slowest first
+REPORT_LIMIT = 30
+
+_original_import = builtins.__import__
+_records = {}  # module name -> [self seconds, cumulative seconds]
+_local = threading.local()
+_started_at = None
+
+def _resolve(name, globals, level):
+    if level == 0:
+        return name
+    try:
+        return importlib.util.resolve_name("." * level + name, (globals or {}).get("__package__"))
+    except (ImportError, ValueError):
+        return name
+
+def _timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+    module_name = _resolve(name, globals, level)
+    if module_name in sys.modules:
+        return _original_import(name, globals, locals, fromlist, level)
+
+    # Time spent in nested imports is added to the parent's frame, to tell self time from cumulative time
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    stack.append(0.0)
+    start = time.perf_counter()
+    try:
+        return _original_import(name, globals, locals, fromlist, level)
+    finally:
+        elapsed = time.perf_counter() - start
+        nested = stack.pop()
+        if stack:
+            stack[-1] += elapsed
+        record = _records.setdefault(module_name, [0.0, 0.0])
+        record[0] += elapsed - nested
+        record[1] += elapsed
+
+def report_import_profile(out=None):
+    """
+    Print the modules imported since start_import_profile, by cumulative import time.
+    Written to stderr by default so the 'Return Value' line on stdout is unaffected.
+    """
+    out = out or sys.stderr
+    total = time.perf_counter() - _started_at
+    out.write(f"[Import profile] {len(_records)} modules imported, process ran for {total * 1000:.1f} ms\n")
+    out.write(f"[Import profile] {'self ms':>9} | {'cumulative ms':>13} | module\n")
+    ranked = sorted(_records.items(), key=lambda item: item[1][1], reverse=True)[:REPORT_LIMIT]
+    for module_name, (self_time, cumulative) in ranked:
+        out.write(f"[Import profile] {self_time * 1000:9.1f} | {cumulative * 1000:13.1f} | {module_name}\n")
+    out.flush()
+
+def start_import_profile():
+    """
+    Time every import from now on and report them when the process exits.
+    """
+    global _started_at
+    if builtins.__import__ is _timed_import:
+        return
+    _started_at = time.perf_counter()
+    builtins.__import__ = _timed_import
+    atexit.register(report_import_profile)
@@ -1,13 +1,23 @@
 import os
+import re
+import json
 import subprocess
 import sys
+from concurrent.futures import ThreadPoolExecutor
 PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "../.."))
 sys.path.append(PROJECT_ROOT)
-from scripts.main.environment import activate_venv
-from scripts.main.external_installs import install_ffmpeg
+from scripts.main.environment import activate_venv, is_valid_environment, venv_python_path
+from scripts.main.external_installs import FFMPEG_ARCHIVE_URLS, ffmpeg_platform, install_ffmpeg
+from scripts.main.artifact_store import fetch_archive, install_wheels, seed_wheels
+from scripts.main.gentle_installer import (
+    DEFAULT_GENTLE_REVISION, GENTLE_REPOSITORY, installed_revision, is_commit, resolve_revision
+)
 from scripts.main.config_manager import get_from_config, set_to_config
 import shutil
 
+# The versions --install reconciles the environment to
+MANIFEST_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "install_manifest.json")
+
 def install_package_manager():
     """
     Install the appropriate package manager based on the operating system.
@@ -52,52 +62,160 @@ def install_git():
         print(f"Unsupported OS: {sys.platform}")
         sys.exit(1)
 
-def run_gentle_installer(venv_path):
+def run_gentle_installer(venv_path, revision=DEFAULT_GENTLE_REVISION, repository=GENTLE_REPOSITORY):
     """
     Run the gentle_installer.py script located in the same folder, passing venv_path as the argument.
+    It runs in its own process because it changes the working directory.
     """
     current_dir = os.path.dirname(os.path.abspath(__file__))
     gentle_installer_path = os.path.join(current_dir, "gentle_installer.py")
 
     print("Running Gentle installer...")
     try:
-        subprocess.run(["python3", gentle_installer_path, venv_path], check=True)  # Pass venv_path as argument
+        subprocess.run(["python3", gentle_installer_path, venv_path, revision, repository], check=True)  # Pass venv_path as argument
         print("Gentle installation complete.")
     except subprocess.CalledProcessError as e:
         print(f"Error running Gentle installer: {e}")
         sys.exit(1)
 
-def setup_environment(venv_path, venv_name):
+def load_manifest(manifest_path=MANIFEST_PATH):
+    with open(manifest_path, 'r') as manifest_file:
+        return json.load(manifest_file)
+
+def pin_gentle_revision(manifest, manifest_path=MANIFEST_PATH):
+    """
+    Replace a Gentle branch or tag in the manifest by the commit it points at now, so every later install
+    of the manifest gets the same code.
+    """
+    gentle = manifest.setdefault("gentle", {})
+    revision = gentle.get("revision", DEFAULT_GENTLE_REVISION)
+    if is_commit(revision):
+        return
+    gentle["revision"] = resolve_revision(revision, gentle.get("repository", GENTLE_REPOSITORY))
+    with open(manifest_path, 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=4)
+        manifest_file.write("\n")
+    print(f"[Artifacts] Pinned Gentle {revision} to {gentle['revision']} in {manifest_path}")
+
+def _normalize_package_name(name):
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+def installed_packages(venv_path):
     """
-    Set up the virtual environment and install necessary packages.
+    Return the {normalized name: version} of the packages installed in the virtual environment.
     """
+    venv_python = venv_python_path(venv_path)
+    output = subprocess.run([venv_python, "-m", "pip", "list", "--format=json", "--disable-pip-version-check"],
+                            check=True, capture_output=True, text=True).stdout
+    return {_normalize_package_name(package["name"]): package["version"] for package in json.loads(output)}
+
+def packages_to_install(locked_packages, installed):
+    """
+    Return the 'name==version' requirements of the locked packages that are missing or at another version.
+    """
+    return [f"{name}=={version}" for name, version in locked_packages.items()
+            if installed.get(_normalize_package_name(name)) != version]
+
+def reconcile_python_packages(venv_path, locked_packages):
+    requirements = packages_to_install(locked_packages, installed_packages(venv_path))
+    if not requirements:
+        print("[Install] Python packages are up to date.")
+        return
+    print(f"[Install] Installing {', '.join(requirements)}")
+    install_wheels(venv_path, requirements)
+
+def reconcile_ffmpeg(ffmpeg_sha256=None):
+    containing_folder_path = get_from_config("containing_folder_path")
+    if not containing_folder_path:
+        print("[Install] No containing folder path set, skipping FFmpeg.")
+        return
+    # install_ffmpeg returns at once when the binary is already there
+    ffmpeg_path = install_ffmpeg(containing_folder_path, (ffmpeg_sha256 or {}).get(ffmpeg_platform()))
+    if get_from_config("ffmpeg_path") != ffmpeg_path:
+        set_to_config("ffmpeg_path", ffmpeg_path)
+
+def reconcile_gentle(venv_path, gentle):
+    revision = gentle.get("revision", DEFAULT_GENTLE_REVISION)
+    repository = gentle.get("repository", GENTLE_REPOSITORY)
+    if not is_commit(revision):
+        print(f"[Install] Warning: Gentle revision '{revision}' is not a commit, two installs may get different code. "
+              f"Run --seed-artifacts to pin it in {MANIFEST_PATH}.")
+    # The marker holds the installed commit, a pinned commit is checked without git or the network
+    if installed_revision(venv_path) == revision:
+        print(f"[Install] Gentle {revision} is up to date.")
+        return
+    # Gentle is cloned with git, which may need the package manager first
+    if not shutil.which("git"):
+        install_package_manager()
+        install_git()
+    commit = resolve_revision(revision, repository)
+    if installed_revision(venv_path) == commit:
+        print(f"[Install] Gentle {revision} ({commit}) is up to date.")
+        return
+    run_gentle_installer(venv_path, commit, repository)
+
+def setup_environment(venv_path, venv_name, clean=False):
+    """
+    Bring the virtual environment in line with install_manifest.json.
+    Only what is missing or at another version is installed: the venv is created if it does not exist,
+    packages are installed or upgraded one by one, and FFmpeg and Gentle are skipped when present.
+    Packages and the FFmpeg archive come from the artifact store (see artifact_store), which downloads them once.
+    The independent steps (FFmpeg, Python packages, Gentle) run at the same time.
+
+    :param clean: Delete the virtual environment first and install everything from scratch.
+    """
+    manifest = load_manifest()
+
     # Step 1: Create the virtual environment
     print(f"Creating or updating virtual environment '{venv_name}' at '{venv_path}'...")
 
-    if os.path.exists(venv_path):
+    if clean and os.path.exists(venv_path):
         print(f"Removing existing virtual environment at {venv_path}")
-        subprocess.run(["rm", "-rf", venv_path])
-
-    subprocess.run(["python3", "-m", "venv", venv_path])
+        shutil.rmtree(venv_path)
 
-    # Log the virtual environment creation path
-    print(f"Virtual environment created at: {venv_path}")
+    if not is_valid_environment(venv_path):
+        subprocess.run(["python3", "-m", "venv", venv_path], check=True)
+        # Log the virtual environment creation path
+        print(f"Virtual environment created at: {venv_path}")
 
     # Step 2: Activate virtual environment right after creation
     activate_venv(venv_path, venv_name)
-    
-    # Step 3: Install the package manager based on OS
-    install_package_manager(venv_path)
 
-    # Step 4: Install Git using the package manager
-    install_git()
+    # Step 3: Reconcile FFmpeg, the Python packages and Gentle concurrently
+    steps = {
+        "FFmpeg": (reconcile_ffmpeg, manifest.get("ffmpeg_sha256")),
+        "Python packages": (reconcile_python_packages, venv_path, manifest.get("python_packages", {})),
+        "Gentle": (reconcile_gentle, venv_path, manifest.get("gentle", {})),
+    }
+    with ThreadPoolExecutor(max_workers=len(steps), thread_name_prefix="install") as pool:
+        futures = {name: pool.submit(*step) for name, step in steps.items()}
 
-    # Step 5: Install Gentle
-    run_gentle_installer(venv_path)
+    failed = []
+    for name, future in futures.items():
+        try:
+            future.result()
+        except (Exception, SystemExit) as e:
+            print(f"[Install] {name} failed: {e}")
+            failed.append(name)
+    if failed:
+        print(f"Environment setup incomplete at: {venv_path}, failed: {', '.join(failed)}")
+        sys.exit(1)
+
+    print(f"Environment setup complete at: {venv_path}")
 
-    # Step 6: Install required Python urllib3 packages
-    required_packages = ["demucs", "torchaudio", "yt-dlp", "diffq", "soundfile"]
-    
-    subprocess.run([os.path.join(venv_path, "bin", "pip3"), "install", "--upgrade"] + required_packages)
+def seed_artifacts(venv_path):
+    """
+    Fill the artifact store with everything --install needs: wheels of the locked packages (for the Python
+    version and platform of the virtual environment) and the FFmpeg archive of every platform.
+    A store seeded once can then serve installs with 'offline_install' set.
+    A Gentle branch or tag in the manifest is pinned to its current commit.
+    """
+    manifest = load_manifest()
+    pin_gentle_revision(manifest)
+    ffmpeg_sha256 = manifest.get("ffmpeg_sha256") or {}
+    requirements = [f"{name}=={version}" for name, version in manifest.get("python_packages", {}).items()]
 
-    print(f"Environment setup complete at: {venv_path}")
\ No newline at end of file
+    seed_wheels(venv_path, requirements)
+    for ffmpeg_key, url in FFMPEG_ARCHIVE_URLS.items():
+        fetch_archive(url, ffmpeg_sha256.get(ffmpeg_key))
+    print(f"Artifact store seeded for: {venv_path}")
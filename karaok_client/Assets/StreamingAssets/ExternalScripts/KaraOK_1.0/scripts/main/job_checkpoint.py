@@ -0,0 +1,110 @@
+# job_checkpoint.py (Records completed conversion stages so a crashed job can resume)
+import os
+import json
+import shutil
+import hashlib
+import uuid
+from scripts.functional.logger import log_message
+from files_utils import file_sha256
+
+CHECKPOINT_FILE_NAME = "checkpoint.json"
+
+def job_folder_path(temp_output_folder, youtube_url, demucs_model, output_folder):
+    """
+    Get the working folder of a conversion job. The same URL, model and output folder always map to the same
+    folder, so re-invoking the conversion finds the checkpoint of the previous attempt.
+    """
+    job_key = f"{youtube_url}|{demucs_model}|{os.path.abspath(output_folder)}"
+    job_id = hashlib.sha256(job_key.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(temp_output_folder, "jobs", job_id)
+
+class JobCheckpoint:
+    """
+    A small manifest in the job working folder that records, per completed stage, the stage result
+    and the SHA-256 of every artifact it produced.
+    """
+
+    def __init__(self, job_folder):
+        self.folder = job_folder
+        self.path = os.path.join(job_folder, CHECKPOINT_FILE_NAME)
+        os.makedirs(job_folder, exist_ok=True)
+        self._data = self._load()
+
+    def _load(self):
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r') as checkpoint_file:
+                    data = json.load(checkpoint_file)
+                if isinstance(data.get("stages"), dict):
+                    return data
+            except (OSError, json.JSONDecodeError, AttributeError) as e:
+                log_message(f"[Checkpoint] Ignoring unreadable checkpoint {self.path}: {e}")
+        return {"stages": {}}
+
+    def _save(self):
+        # Write to a temp file and rename so a crash never leaves a half written checkpoint
+        temp_path = f"{self.path}.{uuid.uuid4().hex}.tmp"
+        with open(temp_path, 'w') as checkpoint_file:
+            json.dump(self._data, checkpoint_file, indent=4)
+        os.replace(temp_path, self.path)
+
+    def _verify(self, record):
+        for artifact_path, artifact_hash in record.get("artifacts", {}).items():
+            if not os.path.isfile(artifact_path) or file_sha256(artifact_path) != artifact_hash:
+                return False
+        return True
+
+    def resume(self, stage_order):
+        """
+        Find the latest stage whose artifacts are still present and unchanged.
+        Earlier stages are considered done even if a later stage consumed their artifacts (e.g. moved them).
+
+        :param stage_order: The stage names in pipeline order.
+        :return: A dictionary of stage name -> record for the stages that do not need to run again.
+        """
+        stages = self._data["stages"]
+        for index in reversed(range(len(stage_order))):
+            record = stages.get(stage_order[index])
+            if record and self._verify(record):
+                return {stage: stages[stage] for stage in stage_order[:index + 1] if stage in stages}
+        return {}
+
+    def complete(self, stage, value, artifacts):
+        """
+        Record a stage as completed with its result value and the hashes of its artifact files.
+        """
+        record = {
+            "value": value,
+            "artifacts": {artifact_path: file_sha256(artifact_path) for artifact_path in artifacts},
+        }
+        self._data["stages"][stage] = record
+        self._save()
+        return record
+
+    def artifact_hash(self, stage, artifact_path):
+        return self._data["stages"].get(stage, {}).get("artifacts", {}).get(artifact_path)
+
+    def clear(self):
+        """
+        Delete the job folder once the job finished successfully.
+        """
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+def run_checkpointed(checkpoint, done, stage, artifacts_of, func, *args):
+    """
+    Run a pipeline stage unless the checkpoint already has it as done, and record it when it completes.
+
+    :param checkpoint: The JobCheckpoint of the job.
+    :param done: The records returned by JobCheckpoint.resume.
+    :param stage: The stage name.
+    :param artifacts_of: A function mapping the stage result to the list of artifact files to hash.
+    :param func: The stage function, called with *args.
+    :return: The stage result, either fresh or from the checkpoint.
+    """
+    if stage in done:
+        log_message(f"[Checkpoint] Skipping completed stage '{stage}'")
+        return done[stage]["value"]
+
+    value = func(*args)
+    checkpoint.complete(stage, value, artifacts_of(value))
+    return value
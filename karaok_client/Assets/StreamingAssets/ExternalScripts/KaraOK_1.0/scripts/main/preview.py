@@ -0,0 +1,160 @@
+# preview.py (Separates a short excerpt first, then runs the full conversion in the background)
+import os
+import sys
+import json
+import subprocess
+import threading
+import time
+from scripts.functional.audio_processing import separate_and_encode
+from scripts.functional.logger import log_message
+from scripts.main.config_manager import get_from_config
+from scripts.main.converter import (
+    DEMUCS_MODELS, temp_output_path, get_demucs_model, job_model_key, cached_conversion, start_job,
+    download_stage, convert
+)
+from scripts.main.job_checkpoint import run_checkpointed
+from files_utils import load_json_file
+
+# Length of the excerpt in seconds (config 'preview_seconds')
+DEFAULT_PREVIEW_SECONDS = 30
+# Where the excerpt starts (config 'preview_start'): a number of seconds, or "loudest" for the loudest
+# stretch of the track, which is usually the chorus
+DEFAULT_PREVIEW_START = 0
+PREVIEW_FOLDER_NAME = "preview"
+
+def loudest_window_start(audio_file_path, seconds):
+    """
+    Find the start, in whole seconds, of the loudest window of the given length, from the energy of each second.
+    Returns 0 when the file cannot be read by soundfile.
+    """
+    try:
+        import soundfile
+        with soundfile.SoundFile(audio_file_path) as source:
+            energies = [float((block ** 2).mean()) if len(block) else 0.0
+                        for block in source.blocks(blocksize=source.samplerate, dtype='float32', always_2d=True)]
+    except Exception as e:
+        log_message(f"[Preview] Could not measure the loudness of {audio_file_path} ({e}), previewing from the start.")
+        return 0
+
+    window = int(seconds)
+    if len(energies) <= window:
+        return 0
+    current = sum(energies[:window])
+    best_start, best_energy = 0, current
+    for start in range(1, len(energies) - window + 1):
+        current += energies[start + window - 1] - energies[start - 1]
+        if current > best_energy:
+            best_start, best_energy = start, current
+    return best_start
+
+def preview_start(audio_file_path, seconds):
+    start = get_from_config("preview_start", DEFAULT_PREVIEW_START)
+    if start == "loudest":
+        return loudest_window_start(audio_file_path, seconds)
+    return float(start or 0)
+
+def extract_excerpt(audio_file_path, excerpt_path, start, seconds):
+    """
+    Cut the excerpt out of the source audio with ffmpeg, decoded to WAV.
+    """
+    ffmpeg_path = get_from_config("ffmpeg_path")
+    if not ffmpeg_path:
+        raise ValueError("FFmpeg path not set. Please run 'smule.py --init' to configure the environment.")
+
+    os.makedirs(os.path.dirname(excerpt_path), exist_ok=True)
+    subprocess.run([ffmpeg_path, '-loglevel', 'error', '-ss', str(start), '-t', str(seconds), '-i', audio_file_path,
+                    '-y', excerpt_path], check=True)
+    return excerpt_path
+
+def preview_model():
+    """
+    The model the excerpt is separated with: the fastest one, unless the in-process engine already holds
+    other models (resident worker), in which case the most recently used of them. Loading the fastest
+    model there would evict the model the full conversion is about to use when only one may stay resident.
+    """
+    fastest = DEMUCS_MODELS[min(DEMUCS_MODELS)]
+    if get_from_config("demucs_engine", "inprocess") == "cli":
+        return fastest
+    from scripts.functional.demucs_engine import get_engine
+    resident = get_engine().loaded_models()
+    if not resident or fastest in resident:
+        return fastest
+    return resident[-1]
+
+def preview_stage(audio_file_path, job_folder, output_folder):
+    """
+    Separate only an excerpt of the track with the fastest model (see preview_model) and encode its instrumental to
+    <output_folder>/<song_name>/preview/preview_no_vocals.m4a.
+    :return: The path of the preview M4A.
+    """
+    seconds = float(get_from_config("preview_seconds", DEFAULT_PREVIEW_SECONDS))
+    start = preview_start(audio_file_path, seconds)
+    log_message(f"[Preview] Separating {seconds}s from {start}s of {audio_file_path}")
+
+    song_name = os.path.splitext(os.path.basename(audio_file_path))[0]
+    excerpt_path = extract_excerpt(audio_file_path, os.path.join(job_folder, PREVIEW_FOLDER_NAME, "excerpt.wav"),
+                                   start, seconds)
+    preview_folder = os.path.join(output_folder, song_name, PREVIEW_FOLDER_NAME)
+    files = separate_and_encode(excerpt_path, preview_folder, preview_model(), ("no_vocals",))
+    os.remove(excerpt_path)
+    return files[0]
+
+def start_background_conversion(metadata_path, output_folder, model_int, deadline, log_path):
+    """
+    Run 'smule.py --convert' in a detached process whose output goes to log_path, so the caller can exit
+    (and Unity can read the preview) while the full conversion goes on.
+    """
+    smule_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "smule.py")
+    command = [sys.executable, smule_path, "--convert", metadata_path, output_folder, str(model_int)]
+    if deadline is not None:
+        command += ["--deadline", str(deadline)]
+
+    os.makedirs(os.path.dirname(log_path), exist_ok=True)
+    with open(log_path, 'a') as log_file:
+        process = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=log_file, stderr=subprocess.STDOUT,
+                                   start_new_session=True)
+    log_message(f"[Preview] Full conversion running in the background (pid {process.pid}), logging to {log_path}")
+    return process.pid
+
+def preview(metadata_path, output_folder, model_int=2, deadline=None, background="process"):
+    """
+    Download the song, separate a short excerpt with the fastest model and return it right away,
+    then run the full conversion in the background. The full conversion resumes from the checkpoint
+    the preview leaves behind, so the song is only downloaded once.
+
+    :param background: "process" to detach the full conversion into its own process (command line),
+                       or "thread" to run it on a thread of the current process (resident worker).
+    :return: A dictionary with the 'preview_path' and the 'output_path' the full conversion will write to.
+             When the song is already cached, 'preview_path' is None and the outputs are ready.
+    """
+    started_at = time.time()
+    song_metadata = load_json_file(metadata_path)
+    temp_output_folder = temp_output_path()
+    log_message(f"Starting preview for YouTube URL: {song_metadata['URL']}")
+
+    cached = cached_conversion(song_metadata, model_int, output_folder, deadline)
+    if cached:
+        result = {"preview_path": None, "output_path": cached[0], "ready": True}
+        print(f"Return Value: {json.dumps(result)}")
+        return result
+
+    demucs_model = get_demucs_model(model_int)
+    checkpoint, done = start_job(song_metadata, job_model_key(demucs_model, deadline), output_folder, temp_output_folder)
+    audio_file_path = run_checkpointed(checkpoint, done, "download", lambda path: [path],
+                                       download_stage, song_metadata, checkpoint.folder)
+    preview_path = preview_stage(audio_file_path, checkpoint.folder, output_folder)
+
+    song_name = os.path.splitext(os.path.basename(audio_file_path))[0]
+    result = {"preview_path": preview_path, "output_path": os.path.join(output_folder, song_name), "ready": False}
+    if deadline is not None:
+        # The full conversion only has what the preview left of the deadline
+        deadline = max(deadline - (time.time() - started_at), 1.0)
+    if background == "thread":
+        threading.Thread(target=convert, args=(metadata_path, output_folder, model_int, deadline),
+                         name="preview-full-conversion").start()
+    else:
+        log_path = os.path.join(temp_output_folder, "previews", f"{os.path.basename(checkpoint.folder)}.log")
+        start_background_conversion(metadata_path, output_folder, model_int, deadline, log_path)
+
+    print(f"Return Value: {json.dumps(result)}")
+    return result
@@ -1,14 +1,20 @@
 import sys
+
+if "--import-profile" in sys.argv:
+    # Installed before any other import, so that every module is measured
+    from import_profile import start_import_profile
+    start_import_profile()
+
 import os
 import argparse
+import json
 
 # Add the root of the project (KaraOK_1.0) to sys.path
 PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "../.."))
 sys.path.append(PROJECT_ROOT)
 
-from scripts.main.installer import setup_environment
 from scripts.main.config_manager import set_to_config, get_from_config, load_config
-from scripts.main.environment import activate_venv, check_environment, ensure_virtual_env
+from scripts.main.environment import bootstrap_venv, check_environment
 
 VENV_NAME = "smule-env"
 
@@ -54,13 +60,25 @@ def main():
      
     # Command options
     parser.add_argument('--init', nargs=1, metavar=('containing_folder_path'), help="Initialize and set up environment with the given folder path")
-    parser.add_argument('--install', action='store_true', help="Create or overwrite the virtual environment and install necessary packages")
+    parser.add_argument('--install', action='store_true', help="Create the virtual environment if needed and install or upgrade only the packages and tools that differ from install_manifest.json")
+    parser.add_argument('--seed-artifacts', action='store_true', help="Download the wheels and FFmpeg archives --install needs into the artifact store, so later installs can run offline")
+    parser.add_argument('--clean', action='store_true', help="With --install, delete the virtual environment first and install everything from scratch")
     parser.add_argument('--convert', nargs=3, metavar=('metadata_path', 'output_folder', 'model'), help="Run the process for downloading and converting the YouTube video. Model is an integer between 1 (fastest) and 4 (slowest), default is 2.")
+    parser.add_argument('--preview', nargs=3, metavar=('metadata_path', 'output_folder', 'model'), help="Like --convert, but return a separated excerpt of the song right away and finish the full conversion in the background")
+    parser.add_argument('--deadline', type=float, metavar=('seconds'), help="With --convert, pick the best model up to the given one, and its shifts and overlap, that is expected to finish within the given number of seconds")
+    parser.add_argument('--calibrate', action='store_true', help="Measure how fast every Demucs model separates on this machine, used by --deadline")
+    parser.add_argument('--convert-batch', nargs=3, metavar=('manifest_path', 'output_folder', 'model'), help="Convert every metadata file listed in the manifest (a JSON list of metadata paths), overlapping download, separation and encoding across songs.")
+    parser.add_argument('--download-batch', nargs=2, metavar=('manifest_path', 'output_folder'), help="Download the audio of every metadata file listed in the manifest, several at a time")
     parser.add_argument('--wav2m4a', nargs=2, metavar=('input_file_path', 'output_directory_path'), help="Convert a WAV file to M4A format")
     parser.add_argument('--version', action='store_true', help="Check if the environment is installed")
     parser.add_argument('--demo', action='store_true', help="Run the process with hardcoded demo arguments")
     parser.add_argument('--environmentExists', action='store_true', help="Check if the environment exists")
     parser.add_argument('--getmetadata', nargs=1, metavar=('youtube_url'), help="Retrieve metadata (artist and song name) from the given YouTube URL")
+    parser.add_argument('--prefetch-audio', nargs=1, metavar=('youtube_url'), help="Download the audio of the given YouTube URL into the download cache at low priority (run by --getmetadata when 'prefetch_audio_on_metadata' is set)")
+    parser.add_argument('--prefetch-claimed', nargs=1, metavar=('audio_format'), help="With --prefetch-audio, the prefetch claim of the song in this download format was already taken for this process")
+    parser.add_argument('--getmetadata-batch', nargs='*', metavar=('url'), help="Retrieve the metadata of several YouTube videos or playlists, given as arguments or one per line on stdin, and write one JSON result per line as each one is ready")
+    parser.add_argument('--import-profile', action='store_true', help="Report how long every imported module took to import, on stderr when the command exits")
+    parser.add_argument('--serve', nargs='?', const='stdio', metavar=('port'), help="Stay resident and serve line-delimited JSON requests on stdin/stdout, or on the given local TCP port")
 
     args = parser.parse_args()
 
@@ -83,21 +101,67 @@ def main():
         print("Error: No virtual environment path set. Please run 'smule.py --init <containing_folder_path>' first.")
         exit(1)
 
+    # Handle the --version action before the bootstrap, it only inspects the environment and must not
+    # re-exec into it (or fail when it is not installed yet)
+    if args.version:
+        log_environment_details(venv_path)
+        check_environment(venv_path, VENV_NAME)
+        exit(0)
+
     if args.install:
         #log_environment_details(venv_path)
-        setup_environment(venv_path, VENV_NAME)
+        from scripts.main.installer import setup_environment
+        setup_environment(venv_path, VENV_NAME, clean=args.clean)
+        exit(0)
+
+    elif args.seed_artifacts:
+        from scripts.main.installer import seed_artifacts
+        seed_artifacts(venv_path)
         exit(0)
 
     else:
         # Activate and ensure the environment is being used
-        activate_venv(venv_path, VENV_NAME)
-        ensure_virtual_env(venv_path)
+        bootstrap_venv(venv_path, VENV_NAME)
+
+        if args.serve:
+            from scripts.main.worker_server import serve_stdio, serve_socket
+            if args.serve == 'stdio':
+                serve_stdio()
+            else:
+                serve_socket(args.serve)
+            sys.exit(0)
         
         if args.getmetadata:
             from scripts.functional.metadata_provider import get_song_metadata
             youtube_url = args.getmetadata[0]
-            artist, title, thumbnail, id = get_song_metadata(youtube_url)
-            print(f"Artist: {artist}, Title: {title}, Thumbnail: {thumbnail}")
+            metadata = get_song_metadata(youtube_url)
+            print(f"Artist: {metadata['artist']}, Title: {metadata['title']}, Thumbnails: {metadata['thumbnails']}")
+
+            # A conversion usually follows, start downloading its audio now
+            from scripts.functional.audio_prefetch import start_audio_prefetch
+            start_audio_prefetch(youtube_url)
+            sys.exit(0)
+
+        if args.prefetch_audio:
+            from scripts.functional.audio_prefetch import lower_priority, prefetch_audio
+            lower_priority()
+            if args.prefetch_claimed:
+                prefetch_audio(args.prefetch_audio[0], args.prefetch_claimed[0], claimed=True)
+            else:
+                prefetch_audio(args.prefetch_audio[0])
+            sys.exit(0)
+
+        if args.getmetadata_batch is not None:
+            from scripts.main.worker_server import detach_stdout
+            from scripts.functional.metadata_batch import MetadataResolver, read_urls
+            # Only the JSON lines go to stdout, logs go to stderr
+            results_out = detach_stdout()
+            urls = args.getmetadata_batch or read_urls(sys.stdin)
+            resolver = MetadataResolver()
+            try:
+                resolver.resolve_many(urls, lambda result: results_out.write(json.dumps(result) + "\n"))
+            finally:
+                resolver.close()
             sys.exit(0)
 
         if args.convert:
@@ -107,12 +171,49 @@ def main():
                 model = int(model) if model else 2  # Default to 2 if model is not provided
 
                 from scripts.main.converter import convert
-                convert(metadata_path, output_folder, model)
+                convert(metadata_path, output_folder, model, args.deadline)
                 exit(0)
             else:
                 print(f"Error: Environment '{VENV_NAME}' is not installed. Run 'smule.py --install' first.")
                 exit(1)
 
+        elif args.preview:
+            log_environment_details(venv_path)
+            if check_environment(venv_path, VENV_NAME):
+                metadata_path, output_folder, model = args.preview
+                model = int(model) if model else 2  # Default to 2 if model is not provided
+
+                from scripts.main.preview import preview
+                preview(metadata_path, output_folder, model, args.deadline)
+                exit(0)
+            else:
+                print(f"Error: Environment '{VENV_NAME}' is not installed. Run 'smule.py --install' first.")
+                exit(1)
+
+        elif args.convert_batch:
+            log_environment_details(venv_path)
+            if check_environment(venv_path, VENV_NAME):
+                manifest_path, output_folder, model = args.convert_batch
+                model = int(model) if model else 2  # Default to 2 if model is not provided
+
+                from scripts.main.batch_converter import convert_batch
+                convert_batch(manifest_path, output_folder, model)
+                exit(0)
+            else:
+                print(f"Error: Environment '{VENV_NAME}' is not installed. Run 'smule.py --install' first.")
+                exit(1)
+
+        elif args.calibrate:
+            from scripts.main.converter import DEMUCS_MODELS
+            from scripts.main.time_budget import calibrate_models
+            calibration = calibrate_models(DEMUCS_MODELS)
+            print(f"Return Value: {json.dumps(calibration)}")
+
+        elif args.download_batch:
+            manifest_path, output_folder = args.download_batch
+            from scripts.main.batch_converter import download_batch
+            download_batch(manifest_path, output_folder)
+
         elif args.wav2m4a:
             input_file_path, output_directory_path = args.wav2m4a
             print(f"Converting WAV to M4A: {input_file_path} to {output_directory_path}")
@@ -128,9 +229,5 @@ def main():
                 print(f"Error: Environment '{VENV_NAME}' is not installed. Run 'smule.py --install' first.")
                 exit(1)
 
-        elif args.version:
-            log_environment_details(venv_path)
-            check_environment(venv_path, VENV_NAME)
-
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,159 @@
+# time_budget.py (Picks the Demucs model and settings that finish within a time budget)
+import os
+import re
+import time
+import subprocess
+from scripts.functional.logger import log_message
+from scripts.main.config_manager import get_from_config, set_to_config, update_config
+
+# Seconds of separation per second of audio on a typical CPU, with shifts=1 and overlap=0.25.
+# Used until the host has its own calibration (config key 'demucs_calibration').
+DEFAULT_REALTIME_FACTORS = {
+    "htdemucs": 0.6,
+    "htdemucs_ft": 2.4,
+    "mdx_extra": 2.0,
+    "mdx_extra_q": 2.2,
+}
+REFERENCE_OVERLAP = 0.25
+# Share of the track duration reserved for encoding the M4A after separation
+ENCODE_TIME_FACTOR = 0.05
+# Weight of a new measurement in the calibration moving average
+CALIBRATION_WEIGHT = 0.3
+
+def get_realtime_factor(model):
+    calibration = get_from_config("demucs_calibration", {}) or {}
+    return float(calibration.get(model, DEFAULT_REALTIME_FACTORS.get(model, 2.5)))
+
+def _work_factor(shifts, overlap):
+    # Each shift is a full extra pass, and apply_model processes 1 / (1 - overlap) of the audio
+    return shifts * (1 - REFERENCE_OVERLAP) / (1 - overlap)
+
+def estimate_separation_seconds(model, duration, shifts=1, overlap=REFERENCE_OVERLAP):
+    return get_realtime_factor(model) * duration * _work_factor(shifts, overlap)
+
+def track_duration(audio_file_path):
+    """
+    Duration of the track in seconds, or None if it cannot be read without decoding the whole file.
+    """
+    try:
+        import soundfile
+        info = soundfile.info(audio_file_path)
+        return info.frames / info.samplerate
+    except Exception:
+        pass
+    try:
+        import torchaudio
+        info = torchaudio.info(audio_file_path)
+        if info.num_frames:
+            return info.num_frames / info.sample_rate
+    except Exception:
+        pass
+    return ffmpeg_duration(audio_file_path)
+
+def ffmpeg_duration(audio_file_path):
+    """
+    Duration of the track from the container header that ffmpeg prints, for compressed files (opus, m4a, ...).
+    """
+    ffmpeg_path = get_from_config("ffmpeg_path")
+    if not ffmpeg_path:
+        return None
+    try:
+        result = subprocess.run([ffmpeg_path, '-hide_banner', '-i', audio_file_path], capture_output=True, text=True)
+    except OSError:
+        return None
+    match = re.search(r"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)", result.stderr)
+    if not match:
+        return None
+    hours, minutes, seconds = match.groups()
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+def candidate_settings(demucs_models, max_model_int):
+    """
+    Separation settings from the best quality to the fastest, for the models up to max_model_int.
+    Higher model integers are slower and better, and so are more shifts and more overlap.
+    """
+    candidates = []
+    for model_int in sorted((m for m in demucs_models if m <= max_model_int), reverse=True):
+        model = demucs_models[model_int]
+        candidates.append({"model": model, "shifts": 2, "overlap": 0.25})
+        candidates.append({"model": model, "shifts": 1, "overlap": 0.25})
+        candidates.append({"model": model, "shifts": 1, "overlap": 0.1})
+    return candidates
+
+def choose_separation_settings(demucs_models, max_model_int, duration, budget_seconds):
+    """
+    Pick the best quality settings whose estimated separation and encoding time fits in budget_seconds.
+    Falls back to the fastest settings when nothing fits.
+
+    :return: A dictionary with 'model', 'shifts', 'overlap' and the 'estimate' in seconds.
+    """
+    candidates = candidate_settings(demucs_models, max_model_int) or candidate_settings(demucs_models, min(demucs_models))
+    available = budget_seconds - duration * ENCODE_TIME_FACTOR
+
+    for settings in candidates:
+        estimate = estimate_separation_seconds(settings["model"], duration, settings["shifts"], settings["overlap"])
+        if estimate <= available:
+            log_message(f"[Deadline] {settings} is estimated at {estimate:.1f}s for {duration:.1f}s of audio, "
+                        f"within the {budget_seconds:.1f}s left.")
+            return dict(settings, estimate=estimate)
+
+    fastest = candidates[-1]
+    estimate = estimate_separation_seconds(fastest["model"], duration, fastest["shifts"], fastest["overlap"])
+    log_message(f"[Deadline] Nothing fits in {budget_seconds:.1f}s, using the fastest settings {fastest} "
+                f"(estimated {estimate:.1f}s).")
+    return dict(fastest, estimate=estimate)
+
+def record_separation_time(model, audio_file_path, elapsed, shifts=1, overlap=REFERENCE_OVERLAP):
+    """
+    Fold a measured separation time into the host calibration of the model, so the estimates follow
+    the actual speed of this machine. A failure here never fails the conversion.
+    """
+    try:
+        duration = track_duration(audio_file_path)
+        if not duration:
+            return
+        measured = elapsed / (duration * _work_factor(shifts, overlap))
+
+        def fold(calibration):
+            calibration = dict(calibration or {})
+            previous = calibration.get(model)
+            calibration[model] = measured if previous is None else previous + CALIBRATION_WEIGHT * (measured - previous)
+            return calibration
+
+        # Under the config lock, so two conversions finishing together both count
+        update_config("demucs_calibration", fold, {})
+    except Exception as e:
+        log_message(f"[Deadline] Could not record the separation time of {model}: {e}")
+
+def calibrate_models(demucs_models, sample_seconds=20):
+    """
+    Measure the realtime factor of every Demucs model on this host by separating a short noise clip,
+    and store it as the host calibration. Separation time does not depend on the audio content.
+    """
+    import shutil
+    import tempfile
+    import numpy
+    import soundfile
+    from scripts.functional.audio_processing import separate_vocals
+
+    work_folder = tempfile.mkdtemp(prefix="karaok_calibration_")
+    try:
+        sample_path = os.path.join(work_folder, "calibration.wav")
+        samplerate = 44100
+        noise = numpy.random.default_rng(0).normal(0.0, 0.1, (int(sample_seconds * samplerate), 2))
+        soundfile.write(sample_path, noise.astype("float32"), samplerate)
+
+        calibration = {}
+        for model_int in sorted(demucs_models):
+            model_name = demucs_models[model_int]
+            # Load the model first, so the measurement does not include reading the weights
+            separate_vocals(sample_path, work_folder, model_name)
+            started_at = time.time()
+            separate_vocals(sample_path, work_folder, model_name)
+            calibration[model_name] = (time.time() - started_at) / sample_seconds
+            log_message(f"[Deadline] {model_name}: {calibration[model_name]:.2f}s per second of audio")
+    finally:
+        shutil.rmtree(work_folder, ignore_errors=True)
+
+    set_to_config("demucs_calibration", calibration)
+    return calibration
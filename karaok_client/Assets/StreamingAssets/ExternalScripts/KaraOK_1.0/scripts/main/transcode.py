@@ -0,0 +1,37 @@
+# transcode.py (Encodes one or more inputs to several output formats in a single ffmpeg run)
+import subprocess
+
+# Built-in output profiles: the file extension and the ffmpeg codec arguments of each format.
+# More can be defined, or these overridden, with the config key 'output_profiles' in the same shape.
+OUTPUT_PROFILES = {
+    "mp3": {"extension": ".mp3", "codec_args": ['-c:a', 'libmp3lame', '-q:a', '0']},
+    "m4a": {"extension": ".m4a", "codec_args": ['-c:a', 'aac', '-b:a', '320k']},
+    "opus": {"extension": ".opus", "codec_args": ['-c:a', 'libopus', '-b:a', '160k']},
+    "wav": {"extension": ".wav", "codec_args": ['-c:a', 'pcm_s16le']},
+}
+
+def get_profile(name, custom_profiles=None):
+    """
+    Look an output profile up by name, in custom_profiles first and then in the built-in profiles.
+    """
+    profile = (custom_profiles or {}).get(name) or OUTPUT_PROFILES.get(name)
+    if not profile:
+        raise ValueError(f"Unknown output profile '{name}'. Expected one of {sorted(set(OUTPUT_PROFILES) | set(custom_profiles or {}))}")
+    return profile
+
+def transcode(ffmpeg_path, input_paths, outputs):
+    """
+    Decode every input once and encode it to all of its outputs in the same ffmpeg process.
+
+    :param input_paths: The input files.
+    :param outputs: A list of (input_index, output_path, profile) tuples, input_index pointing into input_paths.
+    :return: The output paths.
+    """
+    command = [ffmpeg_path, '-y']
+    for input_path in input_paths:
+        command += ['-i', input_path]
+    for input_index, output_path, profile in outputs:
+        command += ['-map', f'{input_index}:a:0'] + profile["codec_args"] + [output_path]
+
+    subprocess.run(command, check=True)
+    return [output_path for _, output_path, _ in outputs]
@@ -1,12 +1,13 @@
 import os
 import subprocess
-import vosk
 import json
 import argparse
 import shutil
-import wave
 import sys
-from moviepy.editor import TextClip, CompositeVideoClip, AudioFileClip, ColorClip
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "../.."))
+sys.path.append(PROJECT_ROOT)
+from scripts.functional.logger import log_message
+from scripts.functional.vosk_engine import get_vosk_engine
 from config_manager import get_from_config, load_config
 import logging
 logging.basicConfig(level=logging.DEBUG)
@@ -83,24 +84,8 @@ def ensure_ffmpeg_and_imagemagick_paths():
 
 
 def transcribe_audio(vocal_track_path, vosk_model_path):
-    """ Transcribe the vocal track using Vosk and return word timestamps. """
-    model = vosk.Model(vosk_model_path)
-    wf = wave.open(vocal_track_path, "rb")
-
-    if wf.getnchannels() != 1 or wf.getsampwidth() != 2 or wf.getframerate() not in [8000, 16000, 44100]:
-        raise ValueError("Unsupported audio format for Vosk. Use mono, 16-bit, and either 8000, 16000, or 44100 Hz. converting..,")
-
-    rec = vosk.KaldiRecognizer(model, wf.getframerate())
-    results = []
-
-    while True:
-        data = wf.readframes(4000)
-        if len(data) == 0:
-            break
-        if rec.AcceptWaveform(data):
-            results.append(json.loads(rec.Result()))
-        else:
-            results.append(json.loads(rec.PartialResult()))
+    """ Transcribe the vocal track using Vosk and return word timestamps. The model stays loaded for later calls. """
+    results = get_vosk_engine().transcribe(vocal_track_path, vosk_model_path)
     print("[VOSK RETURN]")
     return results
 
@@ -143,6 +128,8 @@ def format_timestamp(seconds):
 
 def create_lyrics_video(instrumental_track_path, srt_file_path, output_video_path):
     """ Generate a video with synchronized lyrics from SRT file and instrumental audio. """
+    # Imported here, moviepy takes longer to import than the rest of the service to run
+    from moviepy.editor import TextClip, CompositeVideoClip, AudioFileClip, ColorClip
     
     # Ensure the directory for the output video exists, create if not
     os.makedirs(os.path.dirname(output_video_path), exist_ok=True)
@@ -165,15 +152,49 @@ def create_lyrics_video(instrumental_track_path, srt_file_path, output_video_pat
     # Create or override the MP4 file
     video.write_videofile(output_video_path, fps=24)
 
+def sync_lyrics_batch(jobs, vosk_model_path):
+    """
+    Sync the lyrics of many songs: the vocal tracks are transcribed concurrently against one resident model,
+    then the SRT file and video of each song are generated. A song that fails at any step is reported as
+    not synced without stopping the others.
+
+    :param jobs: A list of dictionaries with the same keys as the command line arguments.
+    :return: A list with, for each job in order, True if the song was synced, False otherwise.
+    """
+    try:
+        transcripts = get_vosk_engine().transcribe_many([job["vocal_track_path"] for job in jobs], vosk_model_path)
+    except Exception as e:
+        log_message(f"[Vosk] Could not transcribe the batch: {e}")
+        return [False] * len(jobs)
+
+    synced = []
+    for job, transcription in zip(jobs, transcripts):
+        if not transcription["success"]:
+            synced.append(False)
+            continue
+        try:
+            synchronized_words = align_lyrics_with_transcript(job["lyrics_file"], transcription["transcript"])
+            generate_srt_file(synchronized_words, job["output_srt_path"])
+            create_lyrics_video(job["instrumental_track_path"], job["output_srt_path"], job["output_video_path"])
+            synced.append(True)
+        except Exception as e:
+            log_message(f"[Vosk] Could not sync {job.get('vocal_track_path')}: {e}")
+            synced.append(False)
+    return synced
+
 def main():
     parser = argparse.ArgumentParser(description="Sync lyrics to a vocal track and generate a video.")
-    parser.add_argument("--vocal_track_path", required=True, help="Path to the vocal track (wav file)")
-    parser.add_argument("--lyrics_file", required=True, help="Path to the lyrics file (txt file)")
-    parser.add_argument("--instrumental_track_path", required=True, help="Path to the instrumental track (wav file)")
-    parser.add_argument("--output_srt_path", required=True, help="Path to output SRT file")
-    parser.add_argument("--output_video_path", required=True, help="Path to output video file")
+    parser.add_argument("--vocal_track_path", help="Path to the vocal track (wav file)")
+    parser.add_argument("--lyrics_file", help="Path to the lyrics file (txt file)")
+    parser.add_argument("--instrumental_track_path", help="Path to the instrumental track (wav file)")
+    parser.add_argument("--output_srt_path", help="Path to output SRT file")
+    parser.add_argument("--output_video_path", help="Path to output video file")
+    parser.add_argument("--batch", help="Path to a JSON list of songs to sync, each with the keys of the arguments above")
 
     args = parser.parse_args()
+    song_args = ["vocal_track_path", "lyrics_file", "instrumental_track_path", "output_srt_path", "output_video_path"]
+    if not args.batch and any(getattr(args, name) is None for name in song_args):
+        parser.error("either --batch or all of --" + ", --".join(song_args) + " are required")
    
     # Load Vosk model path from the configuration
     vosk_model_path = "/Users/shmuelvachnish/Library/Application Support/Shmulious/Kara-OK/setup_folder/venvs/vosk_models/vosk-model-en-us-0.22"
@@ -183,6 +204,12 @@ def main():
     if vosk_model_path is None:
         raise ValueError("Vosk model path not found in configuration.")
 
+    if args.batch:
+        with open(args.batch, 'r') as batch_file:
+            synced = sync_lyrics_batch(json.load(batch_file), vosk_model_path)
+        print(f"Return Value: {json.dumps(synced)}")
+        return
+
     # Step 1: Transcribe the vocals
     transcript = transcribe_audio(args.vocal_track_path, vosk_model_path)
 
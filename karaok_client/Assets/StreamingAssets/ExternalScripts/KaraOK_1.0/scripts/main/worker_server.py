@@ -0,0 +1,200 @@
+# worker_server.py (Keeps smule.py resident and serves requests as JSON lines)
+import os
+import sys
+import json
+import socketserver
+import threading
+import traceback
+
+class ShutdownRequested(Exception):
+    """
+    Raised by the 'shutdown' command to stop the serving loop after replying.
+    """
+
+def warm_up():
+    """
+    Import the heavy modules and load the default Demucs model once, so that every following request
+    runs against warm imports and a resident model.
+    """
+    print("[Worker] Warming up imports...")
+    import yt_dlp  # noqa: F401
+    import scripts.functional.metadata_provider  # noqa: F401
+    import scripts.functional.audio_processing  # noqa: F401
+    from scripts.main.converter import get_demucs_model
+    from scripts.main.config_manager import get_from_config
+
+    # Load the Demucs model the Unity side uses by default, so the first conversion does not pay for it
+    preload_model = get_from_config("serve_preload_model", 2)
+    if preload_model and get_from_config("demucs_engine", "inprocess") != "cli":
+        try:
+            from scripts.functional.demucs_engine import get_engine
+            get_engine().get_model(get_demucs_model(int(preload_model)))
+        except Exception as e:
+            print(f"[Worker] Could not preload the Demucs model: {e}")
+    print("[Worker] Warm up complete.")
+
+def _get_metadata(args):
+    from scripts.functional.metadata_provider import get_song_metadata
+    from scripts.functional.audio_prefetch import start_audio_prefetch
+    metadata = get_song_metadata(args["youtube_url"])
+    start_audio_prefetch(args["youtube_url"], background="thread")
+    return metadata
+
+def _get_metadata_batch(args):
+    from scripts.functional.metadata_batch import MetadataResolver
+    results = []
+    resolver = MetadataResolver()
+    try:
+        resolver.resolve_many(args["urls"], results.append)
+    finally:
+        resolver.close()
+    return results
+
+def _convert(args):
+    from scripts.main.converter import convert
+    model = int(args.get("model") or 2)  # Default to 2 if model is not provided
+    deadline = args.get("deadline")
+    return convert(args["metadata_path"], args["output_folder"], model, float(deadline) if deadline else None)
+
+def _preview(args):
+    from scripts.main.preview import preview
+    model = int(args.get("model") or 2)
+    deadline = args.get("deadline")
+    # The full conversion continues on a worker thread after the preview is returned
+    return preview(args["metadata_path"], args["output_folder"], model, float(deadline) if deadline else None,
+                   background="thread")
+
+def _convert_batch(args):
+    from scripts.main.batch_converter import convert_batch
+    model = int(args.get("model") or 2)
+    return convert_batch(args["manifest_path"], args["output_folder"], model)
+
+def _download_batch(args):
+    from scripts.main.batch_converter import download_batch
+    return download_batch(args["manifest_path"], args["output_folder"])
+
+def _wav2m4a(args):
+    from scripts.functional.audio_processing import convert_wav_to_m4a
+    return convert_wav_to_m4a(args["input_file_path"], args["output_directory_path"])
+
+def _ping(args):
+    return "pong"
+
+def _shutdown(args):
+    raise ShutdownRequested()
+
+# Commands that can be sent to the worker, mapped to their handlers
+_HANDLERS = {
+    "ping": _ping,
+    "getmetadata": _get_metadata,
+    "getmetadata_batch": _get_metadata_batch,
+    "convert": _convert,
+    "preview": _preview,
+    "convert_batch": _convert_batch,
+    "download_batch": _download_batch,
+    "wav2m4a": _wav2m4a,
+    "shutdown": _shutdown,
+}
+
+def handle_request(request):
+    """
+    Dispatch a single request dictionary and build the response dictionary.
+
+    :param request: A dictionary with 'command', optional 'args' and optional 'id'.
+    :return: A dictionary with 'id', 'ok' and either 'result' or 'error'.
+    """
+    request_id = request.get("id") if isinstance(request, dict) else None
+    command = request.get("command") if isinstance(request, dict) else None
+    handler = _HANDLERS.get(command)
+    if handler is None:
+        return {"id": request_id, "ok": False, "error": f"Unknown command: {command}. Expected one of {list(_HANDLERS)}"}
+
+    try:
+        result = handler(request.get("args") or {})
+        return {"id": request_id, "ok": True, "result": result}
+    except ShutdownRequested:
+        raise
+    except SystemExit as e:
+        # Some helpers call sys.exit on failure; this must not take the worker down
+        return {"id": request_id, "ok": False, "error": f"Command '{command}' exited with code {e.code}"}
+    except Exception as e:
+        traceback.print_exc()
+        return {"id": request_id, "ok": False, "error": str(e)}
+
+def handle_line(line):
+    """
+    Parse one line of the protocol and return the serialized response line.
+    Raises ShutdownRequested (carrying the response) when the worker should stop.
+    """
+    try:
+        request = json.loads(line)
+    except json.JSONDecodeError as e:
+        return json.dumps({"id": None, "ok": False, "error": f"Invalid JSON request: {e}"})
+
+    try:
+        return json.dumps(handle_request(request))
+    except ShutdownRequested:
+        request_id = request.get("id") if isinstance(request, dict) else None
+        raise ShutdownRequested(json.dumps({"id": request_id, "ok": True, "result": "bye"}))
+
+def detach_stdout():
+    """
+    Keep the real stdout for protocol responses only and point file descriptor 1 at stderr,
+    so prints from the pipeline and from child processes (demucs, ffmpeg) cannot corrupt the protocol.
+    """
+    sys.stdout.flush()
+    protocol_out = os.fdopen(os.dup(1), "w", buffering=1, encoding="utf-8")
+    os.dup2(2, 1)
+    return protocol_out
+
+def serve_stdio():
+    """
+    Serve line-delimited JSON requests from stdin and write one JSON response line per request to stdout.
+    """
+    protocol_out = detach_stdout()
+    warm_up()
+    protocol_out.write(json.dumps({"id": None, "ok": True, "result": "ready"}) + "\n")
+
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            response = handle_line(line)
+        except ShutdownRequested as e:
+            protocol_out.write(f"{e}\n")
+            break
+        protocol_out.write(response + "\n")
+
+    print("[Worker] Stopped serving on stdio.")
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for raw_line in self.rfile:
+            line = raw_line.decode("utf-8").strip()
+            if not line:
+                continue
+            try:
+                response = handle_line(line)
+            except ShutdownRequested as e:
+                self.wfile.write(f"{e}\n".encode("utf-8"))
+                # shutdown() blocks until serve_forever returns, so it must run outside this handler thread
+                threading.Thread(target=self.server.shutdown, daemon=True).start()
+                return
+            self.wfile.write((response + "\n").encode("utf-8"))
+
+class _WorkerTCPServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+def serve_socket(port, host="127.0.0.1"):
+    """
+    Serve the same line-delimited JSON protocol on a local TCP socket. Each connection may send many requests.
+    """
+    warm_up()
+    with _WorkerTCPServer((host, int(port)), _RequestHandler) as server:
+        print(f"[Worker] Listening on {host}:{server.server_address[1]}")
+        print(f"Return Value: {server.server_address[1]}")
+        sys.stdout.flush()
+        server.serve_forever()
+    print("[Worker] Stopped serving on socket.")